@@ -2,20 +2,20 @@ from datetime import datetime, timezone
 
 from fastapi import APIRouter, HTTPException, Depends
 from fastapi.security import OAuth2PasswordRequestForm
+from psycopg2 import errors
+from starlette.concurrency import run_in_threadpool
 
 from app.api.schemas.schemas import UserRegister
-from app.api.tokens.token import active_or_new_token, current_user
-from app.api.utils import hash_password, verify_password
-from app.api.ws.ws import manager
-from app.db.db import get_db, close_db
+from app.api.tokens.token import new_session_token, current_user, revoke_token, revoke_user_tokens
+from app.api.utils import hash_password_async, verify_and_update_password_async
+from app.api.ws.presence import presence
+from app.db.db import get_db
 
 router = APIRouter()
 
 
-@router.post('/register', summary='Register a new user', tags=['Register'])
-def register(payload: UserRegister):
-    conn, cur = get_db()
-    try:
+def _check_new_user(payload: UserRegister):
+    with get_db() as (conn, cur):
         cur.execute("select * from users where username = %s ", (payload.username,))
         if cur.fetchone():
             raise HTTPException(status_code=400, detail="Username already registered")
@@ -24,72 +24,98 @@ def register(payload: UserRegister):
         if cur.fetchone():
             raise HTTPException(status_code=409, detail="Email already registered")
 
-        data = {
-            'username': payload.username,
-            'email': payload.email,
-            'password_hash': hash_password(payload.password),
-        }
 
-        cur.execute(
-            """
-            insert into users (username, email, password_hash)
-            values (%s, %s, %s) RETURNING id, username, email, is_admin, is_active, created_at
-            """,
-            (data["username"], data["email"], data["password_hash"])
-        )
+def _insert_user(payload: UserRegister, password_hash: str):
+    with get_db() as (conn, cur):
+        # _check_new_user ran before the hash; a concurrent registration can still win the race
+        try:
+            cur.execute(
+                """
+                insert into users (username, email, password_hash)
+                values (%s, %s, %s) RETURNING id, username, email, is_admin, is_active, created_at
+                """,
+                (payload.username, payload.email, password_hash)
+            )
+        except errors.UniqueViolation as e:
+            if e.diag.constraint_name == "users_email_key":
+                raise HTTPException(status_code=409, detail="Email already registered")
+            raise HTTPException(status_code=400, detail="Username already registered")
 
         user = cur.fetchone()
 
         conn.commit()
-    finally:
-        close_db(conn, cur)
+        return user
+
+
+# hashing runs in the password process pool; the DB parts run in the threadpool and no
+# connection is held while a hash is being computed
+@router.post('/register', summary='Register a new user', tags=['Register'])
+async def register(payload: UserRegister):
+    await run_in_threadpool(_check_new_user, payload)
+
+    password_hash = await hash_password_async(payload.password)
+
+    user = await run_in_threadpool(_insert_user, payload, password_hash)
 
     return {"success": True, "message": "User registered", "user": user}
 
 
-@router.post('/login', summary='Login a user', tags=['Login'])
-def login(form: OAuth2PasswordRequestForm = Depends()):
-    conn, cur = get_db()
-    try:
+def _load_user(username: str):
+    with get_db() as (conn, cur):
+        cur.execute("SELECT * FROM users WHERE username = %s", (username,))
+        return cur.fetchone()
 
-        username = form.username
-        password = form.password
 
+def _finish_login(user: dict, new_password_hash: str | None):
+    with get_db() as (conn, cur):
         now = datetime.now(timezone.utc)
 
-        cur.execute("SELECT * FROM users WHERE username = %s", (username,))
-        user = cur.fetchone()
-        if not user:
-            raise HTTPException(status_code=404, detail="User not found")
+        token ,expire_at = new_session_token(user, cur)
 
-        user_db_password = user["password_hash"]
+        if new_password_hash:
+            # stored hash used an older scheme or cost
+            cur.execute("UPDATE users SET last_login_at = %s, password_hash = %s WHERE id = %s", (now, new_password_hash, user["id"]))
+        else:
+            cur.execute("UPDATE users SET last_login_at = %s WHERE id = %s", (now, user["id"]))
+        conn.commit()
 
-        check_password = verify_password(password, user_db_password)
+    return token, expire_at
 
-        if not check_password:
-            raise HTTPException(status_code=400, detail="Incorrect password")
 
-        token ,expire_at = active_or_new_token(user)
+@router.post('/login', summary='Login a user', tags=['Login'])
+async def login(form: OAuth2PasswordRequestForm = Depends()):
+    user = await run_in_threadpool(_load_user, form.username)
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
 
-        cur.execute("UPDATE users SET last_login_at = %s WHERE id = %s", (now, user["id"]))
-        conn.commit()
-    finally:
-        close_db(conn, cur)
+    check_password, new_password_hash = await verify_and_update_password_async(form.password, user["password_hash"])
+
+    if not check_password:
+        raise HTTPException(status_code=400, detail="Incorrect password")
+
+    token ,expire_at = await run_in_threadpool(_finish_login, user, new_password_hash)
 
     return {"success": True, "message": "login successfull", "access_token": token, "token_type": "bearer", "expire_at": expire_at}
 
 
 @router.post('/logout', summary='Logout a user', tags=['Logout'])
 def logout(current: dict = Depends(current_user)):
-    conn, cur = get_db()
-    try:
+    with get_db() as (conn, cur):
         user_id = current["user_id"]
-        if not manager.is_user_online(user_id):
+        # sockets here or on another live worker keep the user online
+        if not presence.is_online(user_id) and not presence.lookup_remote(cur, [user_id]).get(user_id, {}).get("is_online"):
             cur.execute("UPDATE users SET is_online = FALSE, last_seen_at = now() WHERE id = %s", (user_id,))
         else:
             cur.execute("UPDATE users SET last_seen_at = now() WHERE id = %s", (user_id,))
 
         conn.commit()
-        return {"success": True, "message": "Logout successful"}
-    finally:
-        close_db(conn, cur)
+
+    revoke_token(current["token"])
+    return {"success": True, "message": "Logout successful"}
+
+
+@router.post('/logout/all', summary='Logout every session of a user', tags=['Logout'])
+def logout_all(current: dict = Depends(current_user)):
+    # every device signed in with its own token; this ends them all, including the current one
+    revoke_user_tokens(current["user_id"])
+    return {"success": True, "message": "Logged out of all sessions"}
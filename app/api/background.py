@@ -0,0 +1,132 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+_tasks: list["PeriodicTask"] = []
+
+
+class PeriodicTask:
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._task: asyncio.Task | None = None
+        _tasks.append(self)
+
+    async def run_once(self):
+        raise NotImplementedError
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("%s failed", type(self).__name__)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        # last flush so nothing buffered is lost on shutdown
+        try:
+            await self.run_once()
+        except Exception:
+            logger.exception("%s final flush failed", type(self).__name__)
+
+
+class BatchWriter(PeriodicTask):
+    # group commit: callers await a future, rows are written max_rows at a time
+    # by one task after at most `interval` seconds, in submission order
+    def __init__(self, write, max_rows: int, max_delay: float, row_errors: tuple = (Exception,)):
+        super().__init__(max_delay)
+        self.write = write
+        self.max_rows = max(max_rows, 1)
+        # errors one bad row can cause; anything else (a lost connection) fails the whole batch
+        self.row_errors = row_errors
+        self._pending: list[tuple[tuple, asyncio.Future]] = []
+        self._has_rows = asyncio.Event()
+        self._full = asyncio.Event()
+
+    async def submit(self, *row):
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((row, future))
+        self._has_rows.set()
+        if len(self._pending) >= self.max_rows:
+            self._full.set()
+        return await future
+
+    async def run_once(self):
+        while self._pending:
+            batch, self._pending = self._pending[:self.max_rows], self._pending[self.max_rows:]
+            if not self._pending:
+                self._has_rows.clear()
+            if len(self._pending) < self.max_rows:
+                self._full.clear()
+
+            try:
+                await self._write(batch)
+            except asyncio.CancelledError:
+                for _, future in batch:
+                    future.cancel()
+                raise
+
+    async def _write(self, batch: list):
+        # a batch that fails on a row error is split in half and retried, so one bad row (a
+        # deleted chat, a constraint violation) fails only its own future, at the cost of about
+        # 2 * log2(max_rows) extra round trips
+        try:
+            results = await self.write([row for row, _ in batch])
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            if len(batch) == 1 or not isinstance(e, self.row_errors):
+                logger.exception("%s batch of %s failed", type(self).__name__, len(batch))
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                return
+            results = None
+
+        if results is None:
+            middle = len(batch) // 2
+            await self._write(batch[:middle])
+            await self._write(batch[middle:])
+            return
+
+        for (_, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    async def _loop(self):
+        while True:
+            await self._has_rows.wait()
+            try:
+                await asyncio.wait_for(self._full.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            await self.run_once()
+
+
+def start_background_tasks():
+    for task in _tasks:
+        task.start()
+
+
+async def stop_background_tasks():
+    for task in _tasks:
+        await task.stop()
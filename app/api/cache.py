@@ -0,0 +1,261 @@
+import bisect
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from app.config import MEMBERSHIP_CACHE_SIZE, MEMBERSHIP_CACHE_TTL, MESSAGE_TAIL_SIZE, MESSAGE_TAIL_MAX_BYTES, PUBSUB_BACKEND, WORKERS
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+class TTLCache:
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING:
+                self.misses += 1
+                return default
+
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return default
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def __contains__(self, key) -> bool:
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            return entry is not _MISSING and entry[0] > time.monotonic()
+
+    def set(self, key, value, ttl: float | None = None):
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0:
+            self.pop(key)
+            return
+
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key):
+        with self._lock:
+            entry = self._data.pop(key, _MISSING)
+        return None if entry is _MISSING else entry[1]
+
+    def pop_where(self, predicate) -> int:
+        with self._lock:
+            keys = [k for k, (_, v) in self._data.items() if predicate(k, v)]
+            for k in keys:
+                del self._data[k]
+        return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+class _Tail:
+    __slots__ = ("ids", "messages", "sizes", "bytes", "complete")
+
+    def __init__(self):
+        self.ids: list[int] = []
+        self.messages: list[dict] = []
+        self.sizes: list[int] = []
+        self.bytes = 0
+        # True when the tail holds the room's whole history, so any page size can be answered
+        self.complete = False
+
+
+class MessageTail:
+    # last `size` serialized messages per room in id order; whole rooms are evicted LRU once the
+    # total goes over max_bytes
+    def __init__(self, size: int, max_bytes: int):
+        self.size = size
+        self.max_bytes = max_bytes
+        self._rooms: OrderedDict = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _insert(self, tail: _Tail, message: dict):
+        message_id = message["id"]
+        i = bisect.bisect_left(tail.ids, message_id)
+        if i < len(tail.ids) and tail.ids[i] == message_id:
+            return
+        if i == 0 and len(tail.ids) >= self.size:
+            return
+
+        size = len(json.dumps(message, default=str))
+        tail.ids.insert(i, message_id)
+        tail.messages.insert(i, message)
+        tail.sizes.insert(i, size)
+        tail.bytes += size
+        self._bytes += size
+
+        while len(tail.ids) > self.size:
+            tail.ids.pop(0)
+            tail.messages.pop(0)
+            dropped = tail.sizes.pop(0)
+            tail.bytes -= dropped
+            self._bytes -= dropped
+            tail.complete = False
+
+    def _evict(self):
+        while self._bytes > self.max_bytes and self._rooms:
+            _, tail = self._rooms.popitem(last=False)
+            self._bytes -= tail.bytes
+            self.evictions += 1
+
+    def add(self, key, message: dict):
+        if self.size <= 0:
+            return
+        with self._lock:
+            tail = self._rooms.get(key)
+            if tail is None:
+                tail = self._rooms[key] = _Tail()
+            self._rooms.move_to_end(key)
+            self._insert(tail, message)
+            self._evict()
+
+    def seed(self, key, messages: list[dict], complete: bool):
+        # messages: the newest rows of the room as read from the database
+        if self.size <= 0:
+            return
+        with self._lock:
+            tail = self._rooms.get(key)
+            if tail is None:
+                tail = self._rooms[key] = _Tail()
+            self._rooms.move_to_end(key)
+            for message in messages:
+                self._insert(tail, message)
+            if complete and len(tail.ids) < self.size:
+                tail.complete = True
+            self._evict()
+
+    def latest(self, key, limit: int, head=_MISSING) -> list[dict] | None:
+        # newest `limit` messages, oldest first; None when the tail cannot answer for sure.
+        # head: the room's newest id (None if empty) as just read from the database; a tail
+        # that ends elsewhere missed an event and is not served
+        with self._lock:
+            tail = self._rooms.get(key)
+            if tail is None or limit < 1 or (len(tail.ids) < limit and not tail.complete):
+                self.misses += 1
+                return None
+            if head is not _MISSING and (tail.ids[-1] if tail.ids else None) != head:
+                self.misses += 1
+                return None
+
+            self._rooms.move_to_end(key)
+            self.hits += 1
+            return [dict(m) for m in tail.messages[-limit:]]
+
+    def since(self, key, after_id: int, head=_MISSING) -> list[dict] | None:
+        # everything newer than after_id, oldest first; None unless the tail reaches back that far.
+        # head: as in latest()
+        with self._lock:
+            tail = self._rooms.get(key)
+            if tail is None or not tail.ids or (tail.ids[0] > after_id and not tail.complete):
+                self.misses += 1
+                return None
+            if head is not _MISSING and tail.ids[-1] != head:
+                self.misses += 1
+                return None
+
+            self._rooms.move_to_end(key)
+            self.hits += 1
+            i = bisect.bisect_right(tail.ids, after_id)
+            return [dict(m) for m in tail.messages[i:]]
+
+    def invalidate(self, key):
+        with self._lock:
+            tail = self._rooms.pop(key, None)
+            if tail is not None:
+                self._bytes -= tail.bytes
+
+    def clear(self):
+        with self._lock:
+            self._rooms.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "rooms": len(self._rooms),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+# (group_id, user_id) -> {"role", "is_mute", "username"}, or False when the group exists but the user is not a member
+membership_cache = TTLCache(maxsize=MEMBERSHIP_CACHE_SIZE, ttl=MEMBERSHIP_CACHE_TTL)
+
+# conversation_id -> (user1_id, user2_id)
+conversation_cache = TTLCache(maxsize=MEMBERSHIP_CACHE_SIZE, ttl=MEMBERSHIP_CACHE_TTL)
+
+
+def update_cached_membership(group_id: int, user_id: int, **fields):
+    membership = membership_cache.get((group_id, user_id))
+    if membership:
+        membership_cache.set((group_id, user_id), {**membership, **fields})
+
+
+def set_cached_non_member(group_id: int, user_id: int):
+    membership_cache.set((group_id, user_id), False)
+
+
+def forget_group_member(group_id: int, user_id: int):
+    membership_cache.pop((group_id, user_id))
+
+
+def forget_group(group_id: int):
+    membership_cache.pop_where(lambda key, _: key[0] == group_id)
+
+
+def _message_tail_size():
+    # the in-memory backend cannot reach other workers' tails, so it only keeps one when alone
+    if PUBSUB_BACKEND == "postgres" or WORKERS <= 1:
+        return MESSAGE_TAIL_SIZE
+    if MESSAGE_TAIL_SIZE:
+        logger.warning(
+            "MESSAGE_TAIL_SIZE=%d ignored: PUBSUB_BACKEND=memory with %d workers", MESSAGE_TAIL_SIZE, WORKERS
+        )
+    return 0
+
+
+# ("conversation" | "group", room_id) -> newest messages, serves first-page history
+message_tail = MessageTail(size=_message_tail_size(), max_bytes=MESSAGE_TAIL_MAX_BYTES)
@@ -1,16 +1,104 @@
+import base64
+import binascii
+from datetime import datetime
+
 from fastapi import APIRouter, HTTPException, Depends
 
 from app.api.tokens.token import current_user
-from app.db.db import get_db, close_db
+from app.db.db import get_db
 
 router = APIRouter()
 
 
-@router.get("/conversations", summary="Get all conversations", tags=["Conversations"])
-def get_conversations(current: dict = Depends(current_user)):
-    conn, cur = get_db()
+def encode_inbox_cursor(last_activity_at: datetime, conversation_id: int) -> str:
+    raw = f"{last_activity_at.isoformat()}|{conversation_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
 
+
+def decode_inbox_cursor(cursor: str) -> tuple[datetime, int]:
     try:
+        at, conversation_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(at), int(conversation_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+@router.get("/conversations/inbox", summary="Inbox with last message preview", tags=["Conversations"])
+def get_inbox(current: dict = Depends(current_user), limit: int = 30, cursor: str | None = None):
+    with get_db() as (conn, cur):
+        user_id = current["user_id"]
+
+        if limit > 100:
+            limit = 100
+        if limit < 1:
+            limit = 1
+
+        before_at, before_id = decode_inbox_cursor(cursor) if cursor else ("infinity", 0)
+
+        # each side is a top-N scan on its (user, activity, id) index; the preview is one
+        # primary-key lookup per row through conversations.last_message_id
+        cur.execute(
+            """
+            WITH mine AS (
+                (SELECT id, user2_id AS peer_id, last_message_id, COALESCE(last_message_at, created_at) AS last_activity_at
+                 FROM conversations
+                 WHERE user1_id = %(user_id)s
+                   AND (COALESCE(last_message_at, created_at), id) < (%(before_at)s::timestamptz, %(before_id)s)
+                 ORDER BY COALESCE(last_message_at, created_at) DESC, id DESC
+                 LIMIT %(limit)s)
+                UNION ALL
+                (SELECT id, user1_id AS peer_id, last_message_id, COALESCE(last_message_at, created_at) AS last_activity_at
+                 FROM conversations
+                 WHERE user2_id = %(user_id)s
+                   AND (COALESCE(last_message_at, created_at), id) < (%(before_at)s::timestamptz, %(before_id)s)
+                 ORDER BY COALESCE(last_message_at, created_at) DESC, id DESC
+                 LIMIT %(limit)s)
+            )
+            SELECT mine.id AS conversation_id, mine.peer_id, u.username AS peer_username, mine.last_activity_at,
+                   m.id AS last_message_id, m.sender_id AS last_message_sender_id, m.body AS last_message_body,
+                   m.created_at AS last_message_created_at, COALESCE(cr.unread_count, 0) AS unread_count
+            FROM mine
+            JOIN users u ON u.id = mine.peer_id
+            LEFT JOIN LATERAL (
+                SELECT id, sender_id, body, created_at FROM messages WHERE id = mine.last_message_id
+            ) m ON true
+            LEFT JOIN conversation_reads cr ON cr.conversation_id = mine.id AND cr.user_id = %(user_id)s
+            ORDER BY mine.last_activity_at DESC, mine.id DESC
+            LIMIT %(limit)s
+            """,
+            {"user_id": user_id, "before_at": before_at, "before_id": before_id, "limit": limit + 1},
+        )
+        rows = cur.fetchall()
+
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        next_cursor = encode_inbox_cursor(rows[-1]["last_activity_at"], rows[-1]["conversation_id"]) if has_more else None
+
+        data = []
+        for row in rows:
+            last_message = None
+            if row["last_message_id"] is not None:
+                last_message = {
+                    "id": row["last_message_id"],
+                    "sender_id": row["last_message_sender_id"],
+                    "body": row["last_message_body"],
+                    "created_at": row["last_message_created_at"],
+                }
+            data.append({
+                "conversation_id": row["conversation_id"],
+                "peer_id": row["peer_id"],
+                "peer_username": row["peer_username"],
+                "last_message": last_message,
+                "last_activity_at": row["last_activity_at"],
+                "unread_count": row["unread_count"],
+            })
+
+        return {"success": True, "message": "inbox", "data": data, "limit": limit, "next_cursor": next_cursor}
+
+
+@router.get("/conversations", summary="Get all conversations", tags=["Conversations"])
+def get_conversations(current: dict = Depends(current_user)):
+    with get_db() as (conn, cur):
         user_id = current["user_id"]
 
         cur.execute(
@@ -30,15 +118,10 @@ def get_conversations(current: dict = Depends(current_user)):
 
         return {"success": True, "message": "All conversations found", "data": conversations}
 
-    finally:
-        close_db(conn, cur)
-
 
 @router.post("/conversations/{friend_id}", summary="Create a new conversation", tags=["Conversations"])
 def post_conversation(friend_id: int, current: dict = Depends(current_user)):
-    conn, cur = get_db()
-
-    try:
+    with get_db() as (conn, cur):
         user_id = current["user_id"]
 
         if friend_id == user_id:
@@ -64,6 +147,3 @@ def post_conversation(friend_id: int, current: dict = Depends(current_user)):
         conn.commit()
 
         return {"success": True, "message": "New conversation created", "conversation_id": conversation_id}
-
-    finally:
-        close_db(conn, cur)
@@ -1,21 +1,17 @@
 from fastapi import APIRouter, HTTPException, Depends
 
 from app.api.tokens.token import current_user
-from app.db.db import get_db, close_db
+from app.db.db import get_db
 
 router = APIRouter()
 
 
 @router.get("/friends", summary="Get all friends", tags=["Friends"])
 def get_friends(current: dict = Depends(current_user)):
-    print(current)
-    conn, cur = get_db()
-    try:
+    with get_db() as (conn, cur):
 
         user_id = current["user_id"]
 
-        cur.execute("SELECT * FROM friends WHERE user_id = %s", (user_id,))
-
         cur.execute(
             """
             SELECT u.id, u.username, u.last_login_at
@@ -31,14 +27,11 @@ def get_friends(current: dict = Depends(current_user)):
         friends = cur.fetchall()
 
         return {"succes": True, "messages": "all friends", "user_id": user_id, "data": friends}
-    finally:
-        close_db(conn, cur)
 
 
 @router.delete("/friends/{friend_id}", summary="Delete a friend", tags=["Friends"])
 def delete_friend(friend_id: int, current: dict = Depends(current_user)):
-    conn, cur = get_db()
-    try:
+    with get_db() as (conn, cur):
         user_id = current["user_id"]
         cur.execute("SELECT 1 FROM friends WHERE user_id = %s AND friend_id = %s", (user_id, friend_id))
 
@@ -56,14 +49,10 @@ def delete_friend(friend_id: int, current: dict = Depends(current_user)):
 
         return {"succes": True, "message": "Friend deleted"}
 
-    finally:
-        close_db(conn, cur)
-
 
 @router.get("/friends/requests", summary="Get friend requests", tags=["Friend Requests"])
 def get_friends_requests(current: dict = Depends(current_user)):
-    conn, cur = get_db()
-    try:
+    with get_db() as (conn, cur):
         user_id = current["user_id"]
         cur.execute(
             """
@@ -80,40 +69,38 @@ def get_friends_requests(current: dict = Depends(current_user)):
             return {"succes": True, "messages": "no friends", "data": [], "user_id": user_id}
 
         return {"succes": True, "messages": "all requests", "data": requests_, "user_id": user_id}
-    finally:
-        close_db(conn, cur)
 
 
 @router.post("/friends/requests/{username}", summary="Request a friend request", tags=["Friend Requests"])
 def request_friend(username: str, current: dict = Depends(current_user)):
-    conn, cur = get_db()
-    try:
+    with get_db() as (conn, cur):
         user_id = current["user_id"]
 
-        cur.execute("SELECT id FROM users WHERE username = %s", (username,))
-        friend_id = cur.fetchone().get("id", None)
-        if not friend_id:
-            raise HTTPException(status_code=404, detail="User not found")
-
-        cur.execute("SELECT id FROM users WHERE id = %s", (friend_id,))
-
+        # the user and both duplicate checks in one round trip
+        cur.execute(
+            """
+            SELECT u.id,
+                   EXISTS (SELECT 1 FROM friends WHERE user_id = %s AND friend_id = u.id) AS already_friends,
+                   EXISTS (SELECT 1 FROM friend_requests WHERE from_user_id = %s AND to_user_id = u.id AND status = 'pending') AS already_requested
+            FROM users u
+            WHERE u.username = %s
+            """,
+            (user_id, user_id, username),
+        )
         friend = cur.fetchone()
 
         if not friend:
             raise HTTPException(status_code=404, detail="User not found")
 
+        friend_id = friend["id"]
+
         if friend_id == user_id:
             raise HTTPException(status_code=400, detail="You cannot send a friend request to yourself")
 
-        cur.execute("SELECT 1 FROM friends WHERE user_id = %s AND friend_id = %s", (user_id, friend_id))
-
-        if cur.fetchone():
+        if friend["already_friends"]:
             raise HTTPException(status_code=409, detail="Already friends")
 
-        cur.execute("SELECT 1 FROM friend_requests WHERE from_user_id = %s AND to_user_id = %s AND status = 'pending'", (user_id, friend_id))
-
-        existing_requests = cur.fetchone()
-        if existing_requests:
+        if friend["already_requested"]:
             raise HTTPException(status_code=409, detail="Friend request already sent")
 
         cur.execute(
@@ -130,15 +117,10 @@ def request_friend(username: str, current: dict = Depends(current_user)):
         conn.commit()
         return {"success": True, "message": "Friend request sent", "request_id": request_id}
 
-    finally:
-        close_db(conn, cur)
-
 
 @router.post("/requests/{request_id}/accept", summary="Accept friend request", tags=["Friend Requests"])
 def accept_friend(request_id: int, current: dict = Depends(current_user)):
-    conn, cur = get_db()
-
-    try:
+    with get_db() as (conn, cur):
         to_user_id = current["user_id"]
 
         cur.execute("SELECT id, from_user_id, to_user_id FROM friend_requests WHERE id = %s AND status = 'pending'", (request_id,))
@@ -160,14 +142,9 @@ def accept_friend(request_id: int, current: dict = Depends(current_user)):
         conn.commit()
         return {"success": True, "message": "Request accepted"}
 
-    finally:
-        close_db(conn, cur)
-
 @router.post("/requests/{request_id}/decline", summary="Decline friend request", tags=["Friend Requests"])
 def decline_friend(request_id: int, current: dict = Depends(current_user)):
-    conn, cur = get_db()
-
-    try:
+    with get_db() as (conn, cur):
         to_user_id = current["user_id"]
 
         cur.execute("SELECT id, from_user_id, to_user_id FROM friend_requests WHERE id = %s AND status = 'pending'", (request_id,))
@@ -184,7 +161,4 @@ def decline_friend(request_id: int, current: dict = Depends(current_user)):
 
 
         conn.commit()
-        return {"success": True, "message": "Request declined"}
-
-    finally:
-        close_db(conn, cur)
\ No newline at end of file
+        return {"success": True, "message": "Request declined"}
\ No newline at end of file
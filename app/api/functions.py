@@ -1,271 +1,580 @@
-from fastapi import HTTPException
+from datetime import datetime, timezone
 
-from app.api.tokens.token import current_user
-from app.db.db import get_db, close_db
+import asyncpg
 
-def serialize_message(row: dict) -> dict:
+from app.api.background import PeriodicTask, BatchWriter
+from app.api.metrics import timed_db
+from app.api.cache import TTLCache, membership_cache, conversation_cache, message_tail
+from app.api.tokens.token import decode_token, validate_token_doc, get_cached_token, cache_token, stateless_token_doc
+from app.config import GROUP_ACTIVITY_FLUSH_INTERVAL, READ_RECEIPT_FLUSH_INTERVAL, MEMBERSHIP_CACHE_SIZE, INGEST_MODE, INGEST_BATCH_SIZE, INGEST_BATCH_MAX_DELAY, TOKEN_VALIDATION
+from app.db.async_db import get_async_db
+
+def serialize_message(row) -> dict:
     row = dict(row)
 
-    for k in ("created_at", "delivered_at", "read_at"):
+    for k in ("created_at", "updated_at", "delivered_at", "read_at"):
         if k in row and row[k] is not None:
             row[k] = row[k].isoformat()
 
     return row
 
 
-def get_recipient_id(conversation_id: int, sender_id: int) -> int | None:
-    conn, cur = get_db()
-    try:
-        cur.execute("SELECT user1_id, user2_id FROM conversations WHERE id = %s",(conversation_id,))
-        row = cur.fetchone()
-        if not row:
-            return None
+GROUP_MESSAGE_FIELDS = ("id", "group_id", "sender_id", "content", "created_at", "updated_at")
 
-        if isinstance(row, dict):
-            u1, u2 = row["user1_id"], row["user2_id"]
-        else:
-            u1, u2 = row[0], row[1]
 
-        return u2 if sender_id == u1 else u1
-    finally:
-        close_db(conn, cur)
+def remember_message(msg: dict):
+    # read_at is derived from the reader's watermark when served, never kept in the tail
+    message_tail.add(("conversation", msg["conversation_id"]), {**msg, "read_at": None})
 
 
-def get_user_id_from_token(token):
+def remember_group_message(msg: dict):
+    # same shape as a group_messages row returned by GET /groups/{id}/messages
+    message_tail.add(("group", msg["group_id"]), {k: msg.get(k) for k in GROUP_MESSAGE_FIELDS})
 
-    token_doc = current_user(token)
 
-    user_id = token_doc['user_id']
+@timed_db
+async def get_conversation_participants(conversation_id: int) -> tuple[int, int] | None:
+    participants = conversation_cache.get(conversation_id)
+    if participants is not None:
+        return participants
+
+    async with get_async_db() as conn:
+        row = await conn.fetchrow("SELECT user1_id, user2_id FROM conversations WHERE id = $1", conversation_id)
+    if not row:
+        return None
+
+    participants = (row["user1_id"], row["user2_id"])
+    conversation_cache.set(conversation_id, participants)
+    return participants
+
+
+async def get_recipient_id(conversation_id: int, sender_id: int) -> int | None:
+    participants = await get_conversation_participants(conversation_id)
+    if not participants:
+        return None
+
+    u1, u2 = participants
+
+    return u2 if sender_id == u1 else u1
+
+
+@timed_db
+async def get_group_membership(group_id: int, user_id: int) -> dict | bool | None:
+    # None: group not found, False: not a member
+    membership = membership_cache.get((group_id, user_id))
+    if membership is not None:
+        return membership
+
+    async with get_async_db() as conn:
+        row = await conn.fetchrow(
+            """
+            SELECT gm.role, gm.is_mute, u.username
+            FROM groups g
+            LEFT JOIN group_members gm ON gm.group_id = g.id AND gm.user_id = $2
+            LEFT JOIN users u ON u.id = gm.user_id
+            WHERE g.id = $1
+            """,
+            group_id, user_id,
+        )
+    if row is None:
+        return None
+
+    membership = {"role": row["role"], "is_mute": row["is_mute"], "username": row["username"]} if row["role"] is not None else False
+    membership_cache.set((group_id, user_id), membership)
+    return membership
 
-    return user_id
 
+@timed_db
+async def get_user_id_from_token(token):
 
-def check_conversation(conversation_id:int, user_id:int):
+    payload = decode_token(token)
 
-    conn,cur = get_db()
+    if TOKEN_VALIDATION == "stateless":
+        return stateless_token_doc(token, payload)["user_id"]
 
-    try:
-        cur.execute("SELECT * FROM conversations WHERE id = %s", (conversation_id,))
-        conversation = cur.fetchone()
-        if not conversation:
-            return False, "Conversation not found"
+    token_doc = get_cached_token(token)
+    if token_doc is None:
+        async with get_async_db() as conn:
+            token_doc = await conn.fetchrow("SELECT * FROM tokens WHERE token = $1", token)
 
-        print(conversation)
+        token_doc = validate_token_doc(dict(token_doc) if token_doc else None, payload["user_id"])
+        cache_token(token, token_doc)
 
-        user_id_list = [conversation['user1_id'],conversation['user2_id']]
+    token_doc = validate_token_doc(token_doc, payload["user_id"])
+
+    user_id = token_doc['user_id']
+
+    return user_id
 
-        if user_id not in user_id_list:
-            return False, "user not found in conversation"
-        return True, "OK"
 
+async def check_conversation(conversation_id:int, user_id:int):
 
-    finally:
-        close_db(conn,cur)
+    participants = await get_conversation_participants(conversation_id)
+    if not participants:
+        return False, "Conversation not found"
 
-def check_groups(group_id:int,user_id:int):
-    conn, cur = get_db()
-    try:
-        cur.execute("SELECT 1 FROM groups WHERE id = %s", (group_id,))
-        check_group = cur.fetchone()
+    if user_id not in participants:
+        return False, "user not found in conversation"
+    return True, "OK"
 
-        if not check_group:
-            return False, "Group not found"
+async def check_groups(group_id:int,user_id:int):
+    membership = await get_group_membership(group_id, user_id)
 
-        cur.execute("SELECT 1 FROM group_members WHERE group_id = %s AND user_id = %s", (group_id,user_id),)
-        check_user_in_group = cur.fetchone()
+    if membership is None:
+        return False, "Group not found"
 
-        if not check_user_in_group:
-            return False, "User not found in group"
+    if not membership:
+        return False, "User not found in group"
 
-        return True, "OK"
+    return True, "OK"
 
 
-    finally:
-        close_db(conn, cur)
+@timed_db
+async def get_missed_messages(conversation_id: int, after_id: int, limit: int) -> tuple[list[dict], bool]:
+    # for resume-on-reconnect: (messages newer than after_id oldest first, truncated). The tail
+    # only answers if it ends at the conversation's newest message, else it may have missed one
+    async with get_async_db() as conn:
+        head = await conn.fetchval("SELECT last_message_id FROM conversations WHERE id = $1", conversation_id)
+        if head is None or head <= after_id:
+            return [], False
+
+        messages = message_tail.since(("conversation", conversation_id), after_id, head=head)
+        if messages is None:
+            rows = await conn.fetch(
+                """
+                SELECT id, conversation_id, sender_id, body, created_at, delivered_at, read_at
+                FROM messages
+                WHERE conversation_id = $1 AND id > $2
+                ORDER BY id ASC
+                LIMIT $3
+                """,
+                conversation_id, after_id, limit + 1,
+            )
+            messages = [serialize_message(r) for r in rows]
+
+    return messages[:limit], len(messages) > limit
+
+
+@timed_db
+async def get_missed_group_messages(group_id: int, after_id: int, limit: int) -> tuple[list[dict], bool]:
+    async with get_async_db() as conn:
+        head = await conn.fetchval("SELECT max(id) FROM group_messages WHERE group_id = $1", group_id)
+        if head is None or head <= after_id:
+            return [], False
+
+        messages = message_tail.since(("group", group_id), after_id, head=head)
+        if messages is None:
+            rows = await conn.fetch(
+                """
+                SELECT id, group_id, sender_id, content, created_at, updated_at
+                FROM group_messages
+                WHERE group_id = $1 AND id > $2
+                ORDER BY id ASC
+                LIMIT $3
+                """,
+                group_id, after_id, limit + 1,
+            )
+            messages = [serialize_message(r) for r in rows]
+
+    return messages[:limit], len(messages) > limit
 
 
-def messages_insert_to_db(conversation_id: int, sender_id: int, body: str) -> dict:
-    conn, cur = get_db()
-    try:
-        cur.execute(
+@timed_db
+async def get_user_channels(user_id: int, conversation_ids: list[int] | None = None, group_ids: list[int] | None = None) -> tuple[list[int], list[int]]:
+    # conversations and groups the user may subscribe to; None means all of them
+    async with get_async_db() as conn:
+        conversations = await conn.fetch(
             """
-            INSERT INTO messages (conversation_id, sender_id, body)
-            VALUES (%s, %s, %s)
-            RETURNING id, conversation_id, sender_id, body, created_at, delivered_at, read_at
+            SELECT id FROM conversations
+            WHERE (user1_id = $1 OR user2_id = $1) AND ($2::int[] IS NULL OR id = ANY($2::int[]))
             """,
-            (conversation_id, sender_id, body),
+            user_id, conversation_ids,
         )
-        row = cur.fetchone()
-        conn.commit()
-        return serialize_message(row)
-    finally:
-        close_db(conn, cur)
-
-def is_user_muted_in_group(group_id: int, user_id: int) -> bool:
-    conn, cur = get_db()
-    try:
-        cur.execute(
-            "SELECT is_mute FROM group_members WHERE group_id = %s AND user_id = %s",
-            (group_id, user_id)
-        )
-        row = cur.fetchone()
-        if row is None:
-            return True
-        return bool(row["is_mute"])
-    finally:
-        close_db(conn, cur)
-
-def group_messages_insert_to_db(group_id: int, sender_id: int, content: str) -> dict:
-    conn, cur = get_db()
-    try:
-        cur.execute(
+        groups = await conn.fetch(
             """
-            INSERT INTO group_messages (group_id, sender_id, content)
-            VALUES (%s, %s, %s)
-            RETURNING id, group_id, sender_id, content, created_at
+            SELECT gm.group_id FROM group_members gm
+            JOIN groups g ON g.id = gm.group_id
+            WHERE gm.user_id = $1 AND g.deleted_at IS NULL AND ($2::bigint[] IS NULL OR gm.group_id = ANY($2::bigint[]))
             """,
-            (group_id, sender_id, content),
+            user_id, group_ids,
         )
-        row = cur.fetchone()
 
-        cur.execute("SELECT username FROM users WHERE id = %s", (sender_id,))
-        sender_name = cur.fetchone()["username"]
-        row["sender_name"] =sender_name
+    return [r["id"] for r in conversations], [r["group_id"] for r in groups]
 
 
-        cur.execute("SELECT is_mute FROM group_members WHERE group_id = %s AND user_id = %s", (group_id, sender_id,))
-        is_mute = cur.fetchone()["is_mute"]
-        row["is_mute"] = is_mute
+# what a single bad message can raise from a batched insert (a deleted chat, a bad value)
+INGEST_ROW_ERRORS = (asyncpg.IntegrityConstraintViolationError, asyncpg.DataError)
 
-        print("row", row)
-        # group preview için faydalı
-        cur.execute(
-            "UPDATE groups SET last_message_at = now() WHERE id = %s",
-            (group_id,),
+
+@timed_db
+async def messages_insert_batch(rows: list[tuple]) -> list:
+    # ids are drawn in row order (the sequence is read over an ordered subquery),
+    # so a batch keeps per-conversation submission order
+    async with get_async_db() as conn:
+        inserted = await conn.fetch(
+            """
+            WITH v AS (
+                SELECT nextval(pg_get_serial_sequence('messages', 'id')) AS id, s.*
+                FROM (
+                    SELECT * FROM unnest($1::int[], $2::int[], $3::text[], $4::boolean[])
+                        WITH ORDINALITY AS t(conversation_id, sender_id, body, delivered, ord)
+                    ORDER BY ord
+                ) s
+            ), ins AS (
+                INSERT INTO messages (id, conversation_id, sender_id, body, delivered_at)
+                SELECT id, conversation_id, sender_id, body, CASE WHEN delivered THEN now() END FROM v
+                RETURNING id, conversation_id, sender_id, body, created_at, delivered_at, read_at
+            ), unread AS (
+                INSERT INTO conversation_reads (conversation_id, user_id, unread_count)
+                SELECT c.id, CASE WHEN c.user1_id = v.sender_id THEN c.user2_id ELSE c.user1_id END, count(*)
+                FROM v JOIN conversations c ON c.id = v.conversation_id
+                GROUP BY 1, 2
+                ON CONFLICT (conversation_id, user_id) DO UPDATE
+                SET unread_count = conversation_reads.unread_count + EXCLUDED.unread_count
+            ), latest AS (
+                UPDATE conversations c
+                SET last_message_id = x.id, last_message_at = x.created_at
+                FROM (
+                    SELECT DISTINCT ON (conversation_id) conversation_id, id, created_at
+                    FROM ins ORDER BY conversation_id, id DESC
+                ) x
+                WHERE c.id = x.conversation_id AND (c.last_message_id IS NULL OR c.last_message_id < x.id)
+            )
+            SELECT ins.*, v.ord FROM ins JOIN v ON v.id = ins.id
+            """,
+            [r[0] for r in rows], [r[1] for r in rows], [r[2] for r in rows], [r[3] for r in rows],
         )
 
-        conn.commit()
+    by_ord = {row["ord"]: row for row in inserted}
+    results = []
+    for i in range(1, len(rows) + 1):
+        row = by_ord.get(i)
         if row is None:
-            raise RuntimeError("insert message failed")
-
-        return serialize_message(row)
-    finally:
-        close_db(conn, cur)
-
-def check_group_member(group_id: int, user_id: int) -> bool:
-    conn, cur = get_db()
-    try:
-        cur.execute(
-            "SELECT 1 FROM group_members WHERE group_id = %s AND user_id = %s",
-            (group_id, user_id),
+            results.append(RuntimeError("insert message failed"))
+            continue
+        row = dict(row)
+        row.pop("ord")
+        msg = serialize_message(row)
+        remember_message(msg)
+        results.append(msg)
+    return results
+
+
+message_ingest = BatchWriter(messages_insert_batch, INGEST_BATCH_SIZE, INGEST_BATCH_MAX_DELAY, INGEST_ROW_ERRORS)
+
+
+@timed_db
+async def messages_insert_to_db(conversation_id: int, sender_id: int, body: str, delivered: bool = False) -> dict:
+    if INGEST_MODE == "batch":
+        return await message_ingest.submit(conversation_id, sender_id, body, delivered)
+
+    # delivered=True when the recipient is online: one INSERT instead of INSERT + UPDATE
+    async with get_async_db() as conn:
+        row = await conn.fetchrow(
+            """
+            WITH ins AS (
+                INSERT INTO messages (conversation_id, sender_id, body, delivered_at)
+                VALUES ($1, $2, $3, CASE WHEN $4::boolean THEN now() END)
+                RETURNING id, conversation_id, sender_id, body, created_at, delivered_at, read_at
+            ), unread AS (
+                INSERT INTO conversation_reads (conversation_id, user_id, unread_count)
+                SELECT c.id, CASE WHEN c.user1_id = $2 THEN c.user2_id ELSE c.user1_id END, 1
+                FROM conversations c WHERE c.id = $1
+                ON CONFLICT (conversation_id, user_id) DO UPDATE
+                SET unread_count = conversation_reads.unread_count + 1
+            ), latest AS (
+                UPDATE conversations c
+                SET last_message_id = ins.id, last_message_at = ins.created_at
+                FROM ins
+                WHERE c.id = ins.conversation_id AND (c.last_message_id IS NULL OR c.last_message_id < ins.id)
+            )
+            SELECT * FROM ins
+            """,
+            conversation_id, sender_id, body, delivered,
         )
-        return cur.fetchone() is not None
-    finally:
-        close_db(conn, cur)
-
-def mark_group_read(group_id: int, user_id: int) -> None:
-    conn, cur = get_db()
-    try:
-        cur.execute(
+
+    msg = serialize_message(row)
+    remember_message(msg)
+    return msg
+
+async def is_user_muted_in_group(group_id: int, user_id: int) -> bool:
+    membership = await get_group_membership(group_id, user_id)
+    if not membership:
+        return True
+    return bool(membership["is_mute"])
+
+class GroupActivityWriter(PeriodicTask):
+    # coalesces groups.last_message_at so a busy group's row is written at most once per interval
+    def __init__(self, interval: float):
+        super().__init__(interval)
+        self._pending: dict[int, datetime] = {}
+
+    def touch(self, group_id: int, at: datetime):
+        current = self._pending.get(group_id)
+        if current is None or at > current:
+            self._pending[group_id] = at
+
+    @timed_db
+    async def run_once(self):
+        if not self._pending:
+            return
+
+        pending, self._pending = self._pending, {}
+        try:
+            async with get_async_db() as conn:
+                await conn.execute(
+                    """
+                    UPDATE groups g
+                    SET last_message_at = GREATEST(g.last_message_at, v.at)
+                    FROM unnest($1::bigint[], $2::timestamptz[]) AS v(id, at)
+                    WHERE g.id = v.id
+                    """,
+                    list(pending.keys()), list(pending.values()),
+                )
+        except Exception:
+            for group_id, at in pending.items():
+                self.touch(group_id, at)
+            raise
+
+
+group_activity = GroupActivityWriter(GROUP_ACTIVITY_FLUSH_INTERVAL)
+
+
+@timed_db
+async def group_messages_insert_batch(rows: list[tuple]) -> list:
+    async with get_async_db() as conn:
+        inserted = await conn.fetch(
             """
-            UPDATE group_members
-            SET last_read_at = now()
-            WHERE group_id = %s AND user_id = %s
+            WITH v AS (
+                SELECT nextval(pg_get_serial_sequence('group_messages', 'id')) AS id, s.*
+                FROM (
+                    SELECT * FROM unnest($1::bigint[], $2::bigint[], $3::text[])
+                        WITH ORDINALITY AS t(group_id, sender_id, content, ord)
+                    ORDER BY ord
+                ) s
+            ), ins AS (
+                INSERT INTO group_messages (id, group_id, sender_id, content)
+                SELECT id, group_id, sender_id, content FROM v
+                RETURNING id, group_id, sender_id, content, created_at, updated_at
+            ), unread AS (
+                -- one counter per member: a busy group spreads over its member rows instead
+                -- of locking the group row; nobody counts their own messages
+                UPDATE group_members gm SET unread_count = gm.unread_count + x.cnt
+                FROM (
+                    SELECT m.group_id, m.user_id, count(*) AS cnt
+                    FROM v JOIN group_members m ON m.group_id = v.group_id AND m.user_id <> v.sender_id
+                    GROUP BY m.group_id, m.user_id
+                ) x
+                WHERE gm.group_id = x.group_id AND gm.user_id = x.user_id
+            )
+            SELECT ins.*, u.username AS sender_name, gm.is_mute, v.ord
+            FROM ins
+            JOIN v ON v.id = ins.id
+            JOIN users u ON u.id = ins.sender_id
+            LEFT JOIN group_members gm ON gm.group_id = ins.group_id AND gm.user_id = ins.sender_id
             """,
-            (group_id, user_id),
+            [r[0] for r in rows], [r[1] for r in rows], [r[2] for r in rows],
         )
-        conn.commit()
-    finally:
-        close_db(conn, cur)
+
+    by_ord = {row["ord"]: row for row in inserted}
+    results = []
+    for i in range(1, len(rows) + 1):
+        row = by_ord.get(i)
+        if row is None:
+            results.append(RuntimeError("insert message failed"))
+            continue
+        group_activity.touch(row["group_id"], row["created_at"])
+        row = dict(row)
+        row.pop("ord")
+        msg = serialize_message(row)
+        remember_group_message(msg)
+        results.append(msg)
+    return results
 
 
+group_message_ingest = BatchWriter(group_messages_insert_batch, INGEST_BATCH_SIZE, INGEST_BATCH_MAX_DELAY, INGEST_ROW_ERRORS)
 
-import psycopg2
 
-def set_user_online(user_id: int, is_online: bool) -> bool:
-    try:
-        conn, cur = get_db()
-        try:
-            cur.execute(
-                "UPDATE users SET is_online = %s WHERE id = %s",
-                (is_online, user_id),
-            )
-            conn.commit()
-            return True
-        finally:
-            close_db(conn, cur)
-    except psycopg2.OperationalError:
-        return False
-
-def touch_last_seen(user_id: int):
-    conn, cur = get_db()
-    try:
-        cur.execute("UPDATE users SET last_seen_at = now() WHERE id = %s", (user_id,))
-        conn.commit()
-    finally:
-        close_db(conn, cur)
-
-
-def mark_read(message_id: int):
-    conn, cur = get_db()
-    try:
-        cur.execute(
+@timed_db
+async def group_messages_insert_to_db(group_id: int, sender_id: int, content: str) -> dict:
+    if INGEST_MODE == "batch":
+        return await group_message_ingest.submit(group_id, sender_id, content)
+
+    async with get_async_db() as conn:
+        row = await conn.fetchrow(
             """
-            UPDATE messages
-            SET read_at = now()
-            WHERE id = %s AND read_at IS NULL
-            RETURNING id, read_at
+            WITH ins AS (
+                INSERT INTO group_messages (group_id, sender_id, content)
+                VALUES ($1, $2, $3)
+                RETURNING id, group_id, sender_id, content, created_at, updated_at
+            ), unread AS (
+                UPDATE group_members SET unread_count = unread_count + 1
+                WHERE group_id = $1 AND user_id <> $2
+            )
+            SELECT ins.*, u.username AS sender_name, gm.is_mute
+            FROM ins
+            JOIN users u ON u.id = ins.sender_id
+            LEFT JOIN group_members gm ON gm.group_id = ins.group_id AND gm.user_id = ins.sender_id
             """,
-            (message_id,)
+            group_id, sender_id, content,
         )
-        row = cur.fetchone()
-        conn.commit()
-        if not row:
-            return None
+    if row is None:
+        raise RuntimeError("insert message failed")
 
-        row = dict(row)
-        row["read_at"] = row["read_at"].isoformat() if row["read_at"] else None
-        return row
-    finally:
-        close_db(conn, cur)
+    # group preview için faydalı
+    group_activity.touch(group_id, row["created_at"])
+
+    msg = serialize_message(row)
+    remember_group_message(msg)
+    return msg
 
-def mark_conversation_read(conversation_id: int, reader_id: int, last_message_id: int) -> int:
+async def check_group_member(group_id: int, user_id: int) -> bool:
+    return bool(await get_group_membership(group_id, user_id))
 
-    conn, cur = get_db()
-    try:
-        cur.execute(
+@timed_db
+async def mark_group_read(group_id: int, user_id: int) -> None:
+    async with get_async_db() as conn:
+        await conn.execute(
             """
-            UPDATE messages
-            SET read_at = now()
-            WHERE conversation_id = %s
-              AND sender_id <> %s
-              AND read_at IS NULL
-              AND id <= %s
+            UPDATE group_members
+            SET last_read_at = now(), unread_count = 0
+            WHERE group_id = $1 AND user_id = $2
             """,
-            (conversation_id, reader_id, last_message_id),
+            group_id, user_id,
         )
-        updated = cur.rowcount
-        conn.commit()
-        return updated
-    finally:
-        close_db(conn, cur)
-
-def mark_delivered(message_id: int) -> dict | None:
-    conn, cur = get_db()
-    try:
-        cur.execute(
+
+
+class ReadWatermarkWriter(PeriodicTask):
+    # one monotonic watermark per (conversation, reader) instead of rewriting every unread row;
+    # bursts of conversation.read inside an interval collapse into a single upsert
+    def __init__(self, interval: float):
+        super().__init__(interval)
+        self.known = TTLCache(maxsize=MEMBERSHIP_CACHE_SIZE, ttl=300)
+        self._pending: dict[tuple[int, int], tuple[int, datetime]] = {}
+
+    def advance(self, conversation_id: int, user_id: int, last_message_id: int, at: datetime | None = None):
+        key = (conversation_id, user_id)
+        self.known.set(key, max(last_message_id, self.known.get(key, 0)))
+
+        at = at or datetime.now(timezone.utc)
+        pending = self._pending.get(key)
+        if pending is None or last_message_id > pending[0]:
+            self._pending[key] = (last_message_id, at)
+
+    @timed_db
+    async def run_once(self):
+        if not self._pending:
+            return
+
+        pending, self._pending = self._pending, {}
+        keys = list(pending.keys())
+        try:
+            async with get_async_db() as conn, conn.transaction():
+                await conn.execute(
+                    """
+                    INSERT INTO conversation_reads (conversation_id, user_id, last_read_message_id, read_at)
+                    SELECT * FROM unnest($1::int[], $2::int[], $3::int[], $4::timestamptz[])
+                    ON CONFLICT (conversation_id, user_id) DO UPDATE
+                    SET last_read_message_id = GREATEST(conversation_reads.last_read_message_id, EXCLUDED.last_read_message_id),
+                        read_at = CASE WHEN EXCLUDED.last_read_message_id > conversation_reads.last_read_message_id
+                                       THEN EXCLUDED.read_at ELSE conversation_reads.read_at END
+                    """,
+                    [k[0] for k in keys], [k[1] for k in keys],
+                    [pending[k][0] for k in keys], [pending[k][1] for k in keys],
+                )
+                # recounted from the watermark rather than decremented, so any drift in the
+                # insert-side +1s is repaired whenever the reader catches up
+                await conn.execute(
+                    """
+                    UPDATE conversation_reads cr
+                    SET unread_count = (
+                        SELECT count(*) FROM messages m
+                        WHERE m.conversation_id = cr.conversation_id AND m.sender_id <> cr.user_id
+                          AND m.id > cr.last_read_message_id
+                    )
+                    FROM unnest($1::int[], $2::int[]) AS v(conversation_id, user_id)
+                    WHERE cr.conversation_id = v.conversation_id AND cr.user_id = v.user_id
+                    """,
+                    [k[0] for k in keys], [k[1] for k in keys],
+                )
+        except Exception:
+            for (conversation_id, user_id), (last_message_id, at) in pending.items():
+                self.advance(conversation_id, user_id, last_message_id, at)
+            raise
+
+
+read_watermarks = ReadWatermarkWriter(READ_RECEIPT_FLUSH_INTERVAL)
+
+
+class DeliveryWriter(PeriodicTask):
+    # delivered_at for messages whose recipient is connected to another worker: the worker that
+    # hands the frame to the recipient's socket marks it, one UPDATE per interval
+    def __init__(self, interval: float):
+        super().__init__(interval)
+        self._pending: set[int] = set()
+
+    def mark(self, message_id: int):
+        self._pending.add(message_id)
+
+    @timed_db
+    async def run_once(self):
+        if not self._pending:
+            return
+
+        pending, self._pending = self._pending, set()
+        try:
+            async with get_async_db() as conn:
+                await conn.execute(
+                    "UPDATE messages SET delivered_at = now() WHERE id = ANY($1::int[]) AND delivered_at IS NULL",
+                    list(pending),
+                )
+        except Exception:
+            self._pending |= pending
+            raise
+
+
+deliveries = DeliveryWriter(READ_RECEIPT_FLUSH_INTERVAL)
+
+
+@timed_db
+async def mark_conversation_read(conversation_id: int, reader_id: int, last_message_id: int) -> tuple[int, int] | None:
+    # returns (read up to, how many of the peer's messages this event newly marks as read), or None
+    # when nothing changes: the id is past no message of this conversation, or not past the watermark.
+    # Ids beyond the newest message are clamped to it, so a client cannot read ahead.
+    watermark = read_watermarks.known.get((conversation_id, reader_id), 0)
+    if last_message_id <= watermark:
+        return None
+
+    async with get_async_db() as conn:
+        row = await conn.fetchrow(
             """
-            UPDATE messages
-            SET delivered_at = now()
-            WHERE id = %s AND delivered_at IS NULL
-            RETURNING id, conversation_id, sender_id, body, created_at, delivered_at, read_at
+            WITH target AS (
+                SELECT LEAST($3, c.last_message_id) AS id
+                FROM conversations c
+                WHERE c.id = $1
+            ), valid AS (
+                SELECT t.id FROM target t
+                JOIN messages m ON m.id = t.id AND m.conversation_id = $1
+            ), wm AS (
+                -- the in-memory watermark may be ahead of rows the writer has not flushed yet
+                SELECT GREATEST(COALESCE(max(last_read_message_id), 0), $4) AS id
+                FROM conversation_reads
+                WHERE conversation_id = $1 AND user_id = $2
+            )
+            SELECT valid.id AS target, wm.id AS watermark,
+                   (SELECT count(*) FROM messages m
+                    WHERE m.conversation_id = $1 AND m.sender_id <> $2
+                      AND m.id > wm.id AND m.id <= valid.id) AS updated
+            FROM valid, wm
             """,
-            (message_id,),
+            conversation_id, reader_id, last_message_id, watermark,
         )
-        row = cur.fetchone()
-        conn.commit()
-        if not row:
-            return None
-        return serialize_message(row)
-    finally:
-        close_db(conn, cur)
\ No newline at end of file
+
+    if row is None:
+        return None
+    if row["target"] <= row["watermark"]:
+        read_watermarks.known.set((conversation_id, reader_id), row["watermark"])
+        return None
+
+    read_watermarks.advance(conversation_id, reader_id, row["target"])
+    return row["target"], row["updated"]
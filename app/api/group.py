@@ -1,43 +1,37 @@
 from fastapi import APIRouter, HTTPException, Depends, Query
+from app.api.cache import message_tail
+from app.api.functions import serialize_message, GROUP_MESSAGE_FIELDS
 from app.api.schemas.schemas import CreateGroup, UpdateGroup, ChangeVisibility, AddMember, ChangeRole, UpdateMessageContent
 from app.api.tokens.token import current_user
-from app.db.db import get_db, close_db
+from app.api.ws.membership import forget_group_from_thread, forget_group_member_from_thread, set_non_member_from_thread, update_membership_from_thread
+from app.api.ws.tail import invalidate_tail_from_thread
+from app.db.db import get_db
 
 router = APIRouter()
 
+GROUP_MESSAGE_COLUMNS = ", ".join(GROUP_MESSAGE_FIELDS)
+
 
 # region GROUPS
 @router.get("/groups/public", summary="public groups", tags=["Groups"])
 def get_public_groups():
-    con, cur = get_db()
-
-    try:
+    with get_db() as (con, cur):
         cur.execute("SELECT * FROM groups WHERE is_private = FALSE ORDER BY id")
         public_groups = cur.fetchall()
         return {"success": True, "message": "public group", "data": public_groups}
 
-    finally:
-        close_db(con, cur)
-
 @router.get("/groups/my", summary="my groups", tags=["Groups"])
 def get_my_groups(current: dict = Depends(current_user)):
-    con, cur = get_db()
-
-    try:
+    with get_db() as (con, cur):
         user_id = current["user_id"]
         cur.execute("SELECT DISTINCT g.* FROM groups g LEFT JOIN group_members gm ON gm.group_id = g.id AND gm.user_id = %s WHERE g.owner_id = %s OR gm.user_id IS NOT NULL", (user_id,user_id))
 
         my_groups = cur.fetchall()
         return {"success": True, "message": "my group", "data": my_groups}
 
-    finally:
-        close_db(con, cur)
-
 @router.get("/groups/{group_id}", summary="get group detail", tags=["Groups"])
 def get_group(group_id: int, current: dict = Depends(current_user)):
-    con, cur = get_db()
-
-    try:
+    with get_db() as (con, cur):
         user_id = current["user_id"]
 
         cur.execute("SELECT * FROM groups WHERE id = %s", (group_id,))
@@ -53,15 +47,9 @@ def get_group(group_id: int, current: dict = Depends(current_user)):
         return {"success": True, "message": "group found", "data": group}
 
 
-    finally:
-        close_db(con, cur)
-
-
 @router.post("/groups", summary="create new group", tags=["Groups"])
 def create_group(payload: CreateGroup, current: dict = Depends(current_user)):
-    con, cur = get_db()
-
-    try:
+    with get_db() as (con, cur):
         user_id = current["user_id"]
 
         cur.execute("SELECT name FROM groups WHERE owner_id = %s AND name = %s", (user_id, payload.name))
@@ -82,14 +70,9 @@ def create_group(payload: CreateGroup, current: dict = Depends(current_user)):
         return {"success": True, "message": "group created", "group_id": group_id}
 
 
-    finally:
-        close_db(con, cur)
-
-
 @router.put("/groups/{group_id}", summary="update my group", tags=["Groups"])
 def update_group(payload: UpdateGroup, group_id: int, current: dict = Depends(current_user)):
-    con, cur = get_db()
-    try:
+    with get_db() as (con, cur):
         user_id = current["user_id"]
 
         cur.execute("SELECT * FROM groups WHERE id = %s AND owner_id = %s", (group_id, user_id))
@@ -114,15 +97,10 @@ def update_group(payload: UpdateGroup, group_id: int, current: dict = Depends(cu
 
         return {"success": True, "message": "group updated", "data": updated}
 
-    finally:
-        close_db(con, cur)
-
 
 @router.delete("/groups/{group_id}", summary="delete my group", tags=["Groups"])
 def delete_group(group_id: int, current: dict = Depends(current_user)):
-    con, cur = get_db()
-
-    try:
+    with get_db() as (con, cur):
         user_id = current["user_id"]
 
         cur.execute("DELETE FROM groups WHERE id = %s AND owner_id = %s", (group_id, user_id))
@@ -131,18 +109,15 @@ def delete_group(group_id: int, current: dict = Depends(current_user)):
             raise HTTPException(status_code=404, detail="Group not found")
 
         con.commit()
+        forget_group_from_thread(group_id)
+        invalidate_tail_from_thread("group", group_id)
 
         return {"success": True, "message": "group deleted"}
 
-    finally:
-        close_db(con, cur)
-
 
 @router.put("/groups/{group_id}/visibility", summary="change my group's visibility", tags=["Groups"])
 def change_visibility(payload: ChangeVisibility, group_id: int, current: dict = Depends(current_user)):
-    con, cur = get_db()
-
-    try:
+    with get_db() as (con, cur):
         user_id = current["user_id"]
 
         is_private = payload.is_private
@@ -157,16 +132,12 @@ def change_visibility(payload: ChangeVisibility, group_id: int, current: dict =
 
         return {"success": True, "message": "group updated", "data": updated}
 
-    finally:
-        close_db(con, cur)
-
 
 
 
 @router.post("/groups/{group_id}/join", summary="join to group", tags=["Groups"])
 def join_to_group(group_id: int, current: dict = Depends(current_user)):
-    conn, cur = get_db()
-    try:
+    with get_db() as (conn, cur):
         user_id = current["user_id"]
 
         cur.execute("SELECT id, is_private FROM groups WHERE id = %s", (group_id,))
@@ -183,18 +154,16 @@ def join_to_group(group_id: int, current: dict = Depends(current_user)):
             raise HTTPException(status_code=409, detail="You already joined this group")
 
 
-        cur.execute("INSERT INTO group_members (group_id, user_id) VALUES (%s, %s)",(group_id, user_id))
+        # history from before joining does not count as unread (unread_count starts at 0)
+        cur.execute("INSERT INTO group_members (group_id, user_id) VALUES (%s, %s)", (group_id, user_id))
         conn.commit()
+        forget_group_member_from_thread(group_id, user_id)
 
         return {"success": True, "message": "joined", "group_id": group_id}
 
-    finally:
-        close_db(conn, cur)
-
 @router.post("/groups/{group_id}/leave", summary="leave group", tags=["Groups"])
 def leave_group(group_id: int, current: dict = Depends(current_user)):
-    conn, cur = get_db()
-    try:
+    with get_db() as (conn, cur):
         user_id = current["user_id"]
 
         cur.execute("SELECT owner_id FROM groups WHERE id = %s", (group_id,))
@@ -211,21 +180,17 @@ def leave_group(group_id: int, current: dict = Depends(current_user)):
 
         cur.execute("DELETE FROM group_members WHERE group_id = %s AND user_id = %s",(group_id, user_id))
         conn.commit()
+        set_non_member_from_thread(group_id, user_id)
 
         return {"success": True, "message": "left", "group_id": group_id}
 
-    finally:
-        close_db(conn, cur)
-
 # endregion GROUPS
 
 # region GROUP MEMBERS
 
 @router.get("/groups/{group_id}/members", summary="get my group's members", tags=["Group Members"])
 def get_group_members(group_id: int, current: dict = Depends(current_user)):
-    con, cur = get_db()
-
-    try:
+    with get_db() as (con, cur):
         user_id = current["user_id"]
 
         cur.execute("SELECT 1 FROM groups WHERE id = %s", (group_id,))
@@ -246,45 +211,49 @@ def get_group_members(group_id: int, current: dict = Depends(current_user)):
         return {"success": True, "message": "group members", "members": members}
 
 
-
-    finally:
-        close_db(con, cur)
-
-
 @router.post("/groups/{group_id}/members", summary="add member", tags=["Group Members"])
 def add_member(group_id: int, payload: AddMember, current: dict = Depends(current_user)):
-    con, cur = get_db()
-
-    try:
+    with get_db() as (con, cur):
         user_id = current["user_id"]
 
-        cur.execute("SELECT 1 FROM groups WHERE id = %s AND owner_id = %s", (group_id, user_id))
-        if cur.fetchone() is None:
+        # ownership, user lookup and insert in one statement; the flags pick the error
+        cur.execute(
+            """
+            WITH g AS (
+                SELECT id FROM groups WHERE id = %s AND owner_id = %s
+            ), u AS (
+                SELECT id FROM users WHERE id = %s
+            ), added AS (
+                INSERT INTO group_members (group_id, user_id, role)
+                SELECT g.id, u.id, %s::group_role FROM g, u
+                ON CONFLICT (group_id, user_id) DO NOTHING
+                RETURNING 1
+            )
+            SELECT EXISTS (SELECT 1 FROM g) AS is_owner,
+                   EXISTS (SELECT 1 FROM u) AS user_exists,
+                   EXISTS (SELECT 1 FROM added) AS added
+            """,
+            (group_id, user_id, payload.member_id, payload.role),
+        )
+        result = cur.fetchone()
+
+        if not result["is_owner"]:
             raise HTTPException(status_code=403, detail="You are not a owner of this group")
 
-        cur.execute("SELECT 1 FROM users WHERE id= %s", (payload.member_id,))
-        check_user = cur.fetchone()
-        if not check_user:
+        if not result["user_exists"]:
             raise HTTPException(status_code=404, detail="User not found")
 
-        cur.execute("SELECT 1 FROM group_members WHERE group_id = %s AND user_id = %s", (group_id, payload.member_id))
-        exist_member = cur.fetchone()
-        if exist_member:
+        if not result["added"]:
             raise HTTPException(status_code=409, detail="User is already a member of this group")
 
-        cur.execute("INSERT INTO group_members (group_id, user_id, role) VALUES (%s, %s, %s)", (group_id, payload.member_id, payload.role))
         con.commit()
+        forget_group_member_from_thread(group_id, payload.member_id)
         return {"success": True, "message": "member added"}
 
-    finally:
-        close_db(con, cur)
-
 
 @router.delete("/groups/{group_id}/members/{member_id}", summary="  Delete member in groups", tags=["Group Members"])
 def delete_member(group_id: int, member_id: int, current: dict = Depends(current_user)):
-    con, cur = get_db()
-
-    try:
+    with get_db() as (con, cur):
         user_id = current["user_id"]
 
         cur.execute("SELECT 1 FROM groups WHERE id = %s AND owner_id = %s", (group_id, user_id))
@@ -298,17 +267,13 @@ def delete_member(group_id: int, member_id: int, current: dict = Depends(current
 
         cur.execute("DELETE FROM group_members WHERE group_id = %s AND user_id = %s", (group_id, member_id))
         con.commit()
+        set_non_member_from_thread(group_id, member_id)
         return {"success": True, "message": "member deleted"}
 
-    finally:
-        close_db(con, cur)
-
 
 @router.delete("/groups/{group_id}/members/me", summary="leave this group", tags=["Group Members"])
 def leaving_to_group(group_id: int, current: dict = Depends(current_user)):
-    con, cur = get_db()
-
-    try:
+    with get_db() as (con, cur):
 
         user_id = current["user_id"]
 
@@ -324,18 +289,13 @@ def leaving_to_group(group_id: int, current: dict = Depends(current_user)):
 
         cur.execute("DELETE FROM group_members WHERE group_id = %s AND user_id = %s", (group_id, user_id))
         con.commit()
+        set_non_member_from_thread(group_id, user_id)
         return {"success": True, "message": "You left the group"}
 
 
-
-    finally:
-        close_db(con, cur)
-
-
 @router.put("/groups/{group_id}/members/{member_id}/role", summary="Update member role in group", tags=["Group Members"])
 def change_member_role(group_id: int, member_id: int, payload: ChangeRole, current: dict = Depends(current_user)):
-    conn, cur = get_db()
-    try:
+    with get_db() as (conn, cur):
         user_id = current["user_id"]
 
         cur.execute("SELECT owner_id FROM groups WHERE id = %s", (group_id,))
@@ -369,17 +329,13 @@ def change_member_role(group_id: int, member_id: int, payload: ChangeRole, curre
 
         cur.execute("UPDATE group_members SET role = %s WHERE group_id = %s AND user_id = %s",(payload.role, group_id, member_id))
         conn.commit()
+        update_membership_from_thread(group_id, member_id, role=payload.role)
         return {"success": True, "message": "member role updated"}
 
-    finally:
-        close_db(conn, cur)
-
 
 @router.put("/groups/{group_id}/members/{member_id}/mute", summary="  Mute member in groups", tags=["Group Members"])
 def mute_member(group_id: int, member_id: int, current: dict = Depends(current_user)):
-    con, cur = get_db()
-
-    try:
+    with get_db() as (con, cur):
         user_id = current["user_id"]
 
         cur.execute("SELECT 1 FROM groups WHERE id = %s AND owner_id = %s", (group_id, user_id))
@@ -393,17 +349,13 @@ def mute_member(group_id: int, member_id: int, current: dict = Depends(current_u
 
         cur.execute("UPDATE group_members SET is_mute = true WHERE group_id = %s AND user_id = %s ", (group_id, member_id))
         con.commit()
+        update_membership_from_thread(group_id, member_id, is_mute=True)
         return {"success": True, "message": "member has been muted"}
 
-    finally:
-        close_db(con, cur)
-
 
 @router.put("/groups/{group_id}/members/{member_id}/unmute", summary="  Unmute member in groups", tags=["Group Members"])
 def unmute_member(group_id: int, member_id: int, current: dict = Depends(current_user)):
-    con, cur = get_db()
-
-    try:
+    with get_db() as (con, cur):
         user_id = current["user_id"]
 
         cur.execute("SELECT 1 FROM groups WHERE id = %s AND owner_id = %s", (group_id, user_id))
@@ -417,54 +369,89 @@ def unmute_member(group_id: int, member_id: int, current: dict = Depends(current
 
         cur.execute("UPDATE group_members SET is_mute = false WHERE group_id = %s AND user_id = %s ", (group_id, member_id))
         con.commit()
+        update_membership_from_thread(group_id, member_id, is_mute=False)
         return {"success": True, "message": "member has been unmuted"}
 
-    finally:
-        close_db(con, cur)
-
 @router.put("/groups/{group_id}/members/me/read",summary="mark group as read",tags=["Group Members"])
 def mark_group_as_read(group_id: int, current: dict = Depends(current_user)):
-    con, cur = get_db()
-    try:
+    with get_db() as (con, cur):
         user_id = current["user_id"]
         cur.execute("SELECT 1 FROM group_members WHERE group_id = %s AND user_id = %s",(group_id, user_id))
         if cur.fetchone() is None:
             raise HTTPException(status_code=403, detail="You are not a member of this group")
 
-        cur.execute("""UPDATE group_members SET last_read_at = now() WHERE group_id = %s AND user_id = %s """, (group_id, user_id))
+        cur.execute("""UPDATE group_members SET last_read_at = now(), unread_count = 0 WHERE group_id = %s AND user_id = %s """, (group_id, user_id))
 
         con.commit()
         return {"success": True, "message": "group marked as read"}
 
-    finally:
-        close_db(con, cur)
-
 
 # endregion GROUP MEMBERS
 
 # region GROUP MESSAGES
 
 @router.get("/groups/{group_id}/messages", summary="Get group messages",tags=["Group Messages"])
-def get_group_messages(group_id: int,page: int = 1,limit: int = 20, current: dict = Depends(current_user)):
-
-    con, cur = get_db()
+def get_group_messages(group_id: int,page: int = 1,limit: int = 20, before_id: int | None = None, after_id: int | None = None, current: dict = Depends(current_user)):
 
-    try:
+    with get_db() as (con, cur):
         user_id = current["user_id"]
 
-        cur.execute("SELECT 1 FROM group_members WHERE group_id = %s AND user_id = %s", (group_id, user_id))
-        if cur.fetchone() is None:
+        if limit > 100:
+            limit = 100
+        if limit < 1:
+            limit = 1
+        if page < 1:
+            page = 1
+
+        if before_id is not None and after_id is not None:
+            raise HTTPException(status_code=400, detail="Use either before_id or after_id")
+
+        cur.execute(
+            "SELECT (SELECT max(id) FROM group_messages WHERE group_id = %s) AS last_message_id FROM group_members WHERE group_id = %s AND user_id = %s",
+            (group_id, group_id, user_id),
+        )
+        membership = cur.fetchone()
+        if membership is None:
             raise HTTPException(status_code=403, detail="You are not a member of this group")
 
+        # cursor mode: seek on (group_id, id), newest first like the page mode
+        if after_id is not None:
+            cur.execute("SELECT " + GROUP_MESSAGE_COLUMNS + " FROM group_messages WHERE group_id = %s AND id > %s ORDER BY id ASC LIMIT %s ", (group_id, after_id, limit + 1))
+            messages = cur.fetchall()
+            has_more = len(messages) > limit
+            messages = messages[:limit]
+            next_cursor = messages[-1]["id"] if has_more else None
+            messages = list(reversed(messages))
+
+            return {"success": True,"message": "messages fetched","limit": limit,"count": len(messages),"data": messages,"next_cursor": next_cursor}
+
+        if before_id is not None:
+            cur.execute("SELECT " + GROUP_MESSAGE_COLUMNS + " FROM group_messages WHERE group_id = %s AND id < %s ORDER BY id DESC LIMIT %s ", (group_id, before_id, limit + 1))
+            messages = cur.fetchall()
+            has_more = len(messages) > limit
+            messages = messages[:limit]
+            next_cursor = messages[-1]["id"] if has_more else None
+
+            return {"success": True,"message": "messages fetched","limit": limit,"count": len(messages),"data": messages,"next_cursor": next_cursor}
+
+        # first page: newest messages straight from the in-memory tail when it has enough of them
+        if page == 1:
+            cached = message_tail.latest(("group", group_id), limit, head=membership["last_message_id"])
+            if cached is not None:
+                messages = list(reversed(cached))
+                next_cursor = messages[-1]["id"] if len(messages) == limit else None
+                return {"success": True,"message": "messages fetched","page": page,"limit": limit,"count": len(messages),"data": messages,"next_cursor": next_cursor}
+
         offset = (page - 1) * limit
 
-        cur.execute("SELECT * FROM group_messages WHERE group_id = %s ORDER BY created_at DESC LIMIT %s OFFSET %s ", (group_id,limit,offset))
+        cur.execute("SELECT " + GROUP_MESSAGE_COLUMNS + " FROM group_messages WHERE group_id = %s ORDER BY created_at DESC LIMIT %s OFFSET %s ", (group_id,limit,offset))
         messages = cur.fetchall()
+        next_cursor = messages[-1]["id"] if len(messages) == limit else None
 
-        return {"success": True,"message": "messages fetched","page": page,"limit": limit,"count": len(messages),"data": messages}
+        if page == 1:
+            message_tail.seed(("group", group_id), [serialize_message(m) for m in reversed(messages)], complete=len(messages) < limit)
 
-    finally:
-        close_db(con, cur)
+        return {"success": True,"message": "messages fetched","page": page,"limit": limit,"count": len(messages),"data": messages,"next_cursor": next_cursor}
 
 
 
@@ -472,9 +459,7 @@ def get_group_messages(group_id: int,page: int = 1,limit: int = 20, current: dic
 def delete_message(group_id: int, message_id: int, current: dict = Depends(current_user)):
 
 
-    con, cur = get_db()
-
-    try:
+    with get_db() as (con, cur):
         user_id = current["user_id"]
 
         cur.execute("SELECT 1 FROM group_members WHERE group_id = %s AND user_id = %s", (group_id, user_id))
@@ -487,25 +472,20 @@ def delete_message(group_id: int, message_id: int, current: dict = Depends(curre
         if row is None:
             raise HTTPException(status_code=404, detail="Message not found")
 
-        if row[0] != user_id:
+        if row["sender_id"] != user_id:
             raise HTTPException(status_code=403, detail="You cannot delete someone else's message")
 
 
 
         cur.execute("DELETE FROM group_messages WHERE group_id = %s AND id = %s AND sender_id = %s ", (group_id, message_id, user_id))
         con.commit()
+        invalidate_tail_from_thread("group", group_id)
         return {"success": True, "message": "message deleted"}
 
-
-    finally:
-        close_db(con, cur)
-
 @router.put("/groups/{group_id}/messages/{message_id}", summary="Update Message",tags=["Group Messages"])
 def update_message(payload: UpdateMessageContent ,group_id: int, message_id: int, current: dict = Depends(current_user)):
 
-    con, cur = get_db()
-
-    try:
+    with get_db() as (con, cur):
         user_id = current["user_id"]
 
         cur.execute("SELECT 1 FROM group_members WHERE group_id = %s AND user_id = %s", (group_id, user_id))
@@ -520,16 +500,12 @@ def update_message(payload: UpdateMessageContent ,group_id: int, message_id: int
 
         cur.execute("UPDATE group_messages SET content = %s  WHERE group_id = %s AND id = %s AND sender_id = %s", (payload.content, group_id, message_id, user_id))
         con.commit()
+        invalidate_tail_from_thread("group", group_id)
 
         return {"success": True, "message": "message updated"}
 
 
 
-    finally:
-        close_db(con, cur)
-
-
-
 
 
 
@@ -1,11 +1,39 @@
 # app/main.py
-from fastapi import FastAPI, APIRouter
+import math
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, APIRouter, Request
 from fastapi.openapi.docs import get_swagger_ui_html
 from fastapi.security import HTTPBasic
+from fastapi.responses import JSONResponse, PlainTextResponse
 from starlette.middleware.cors import CORSMiddleware
 
-from app.api import auth, friends, conversations, messages, group
-from app.api.ws import ws, ws_group
+from app.api import auth, friends, conversations, messages, group, presence, unread, search, metrics
+from app.api.background import start_background_tasks, stop_background_tasks
+from app.api.cache import membership_cache, conversation_cache, message_tail
+from app.api.tokens.revocation import revocations, revocation_sync
+from app.api.tokens.token import token_cache, token_sweeper
+from app.api.utils import close_hash_pool
+from app.api.ws import ws, ws_group, ws_mux
+from app.api.ws.pubsub import pubsub
+from app.db.async_db import close_async_pool, async_pool_stats
+from app.config import DB_POOL_TIMEOUT
+from app.db.db import PoolTimeout, close_pool, pool_stats
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await pubsub.start()
+    # stateless auth must not serve requests before the denylist is loaded
+    await revocation_sync.run_once()
+    start_background_tasks()
+    yield
+    await stop_background_tasks()
+    await pubsub.stop()
+    await close_async_pool()
+    close_pool()
+    close_hash_pool()
+
 
 app = FastAPI(
     title="Realtime - Chat",
@@ -15,11 +43,22 @@ app = FastAPI(
     redoc_url=None,
     openapi_url="/openapi.json",
     contact={"name": "Ali A.", "email": "alialinxz@gmail.com"},
+    lifespan=lifespan,
 )
 
 security = HTTPBasic()
 
 
+# Pool exhausted: tell the client to back off instead of a bare 500
+@app.exception_handler(PoolTimeout)
+async def pool_timeout_handler(request: Request, exc: PoolTimeout):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Database busy, try again later"},
+        headers={"Retry-After": str(max(1, math.ceil(DB_POOL_TIMEOUT)))},
+    )
+
+
 # Swagger ana sayfa
 @app.get("/", include_in_schema=False)
 async def homepage():
@@ -29,6 +68,27 @@ async def homepage():
     )
 
 
+# Runtime stats (pool sizing etc.)
+@app.get("/stats", include_in_schema=False)
+def stats():
+    return {
+        "db_pool": pool_stats(),
+        "async_db_pool": async_pool_stats(),
+        "token_cache": token_cache.stats(),
+        "token_sweeper": token_sweeper.stats(),
+        "token_revocations": revocations.stats(),
+        "membership_cache": membership_cache.stats(),
+        "conversation_cache": conversation_cache.stats(),
+        "message_tail": message_tail.stats(),
+    }
+
+
+# Prometheus scrape target (per worker)
+@app.get("/metrics", include_in_schema=False)
+async def metrics_endpoint():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
 # CORS
 app.add_middleware(
     CORSMiddleware,
@@ -38,6 +98,8 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+app.add_middleware(metrics.MetricsMiddleware)
+
 # Router
 router = APIRouter()
 
@@ -47,4 +109,8 @@ app.include_router(conversations.router)
 app.include_router(messages.router)
 app.include_router(ws.router)
 app.include_router(ws_group.router)
+app.include_router(ws_mux.router)
 app.include_router(group.router)
+app.include_router(presence.router)
+app.include_router(unread.router)
+app.include_router(search.router)
@@ -1,56 +1,115 @@
 from fastapi import APIRouter, HTTPException, Depends
 
+from app.api.cache import message_tail
+from app.api.functions import serialize_message
 from app.api.schemas.schemas import MessageCreate
 from app.api.tokens.token import current_user
-from app.db.db import get_db, close_db
+from app.api.ws.tail import invalidate_tail_from_thread
+from app.db.db import get_db
 
 router = APIRouter()
 
+# read receipts live in conversation_reads as one watermark per reader; read_at is derived from it
+MESSAGE_SELECT = """
+    SELECT m.id, m.conversation_id, m.sender_id, m.body, m.created_at, m.delivered_at,
+           COALESCE(m.read_at, CASE WHEN m.id <= cr.last_read_message_id THEN cr.read_at END) AS read_at
+    FROM messages m
+    LEFT JOIN conversation_reads cr ON cr.conversation_id = m.conversation_id AND cr.user_id <> m.sender_id
+"""
 
 
 @router.get("/messages/{conversation_id}", summary="Get all messages", tags=["Messages"])
-def get_messages(conversation_id:int,current: dict = Depends(current_user), page: int = 0, limit: int = 100):
+def get_messages(conversation_id:int,current: dict = Depends(current_user), page: int = 0, limit: int = 100, before_id: int | None = None, after_id: int | None = None):
 
-    conn,cur = get_db()
-    try:
+    with get_db() as (conn, cur):
 
         user_id = current["user_id"]
 
         if limit > 100:
             limit = 100
+        if limit < 1:
+            limit = 1
         if page < 0:
             page = 0
 
-        offset = page * limit
+        if before_id is not None and after_id is not None:
+            raise HTTPException(status_code=400, detail="Use either before_id or after_id")
 
-        cur.execute("select 1 from conversations where id = %s and (user1_id = %s OR user2_id = %s)", (conversation_id, user_id, user_id))
+        cur.execute("select last_message_id from conversations where id = %s and (user1_id = %s OR user2_id = %s)", (conversation_id, user_id, user_id))
+        conversation = cur.fetchone()
 
-        if not cur.fetchone():
+        if not conversation:
             raise HTTPException(status_code=404, detail="Conversation not found")
 
+        # cursor mode: seek on (conversation_id, id), cost does not grow with scroll depth
+        if after_id is not None:
+            cur.execute(
+                MESSAGE_SELECT + """
+                WHERE m.conversation_id = %s AND m.id > %s
+                ORDER BY m.id ASC
+                LIMIT %s
+                """, (conversation_id, after_id, limit + 1))
+
+            messages = cur.fetchall()
+            has_more = len(messages) > limit
+            messages = messages[:limit]
+            next_cursor = messages[-1]["id"] if has_more else None
+
+            return {"success": True, "message": "all messages", "data": messages, "limit": limit, "next_cursor": next_cursor}
+
+        if before_id is not None:
+            cur.execute(
+                MESSAGE_SELECT + """
+                WHERE m.conversation_id = %s AND m.id < %s
+                ORDER BY m.id DESC
+                LIMIT %s
+                """, (conversation_id, before_id, limit + 1))
+
+            messages = cur.fetchall()
+            has_more = len(messages) > limit
+            messages = messages[:limit]
+            next_cursor = messages[-1]["id"] if has_more else None
+            messages = list(reversed(messages))
+
+            return {"success": True, "message": "all messages", "data": messages, "limit": limit, "next_cursor": next_cursor}
+
+        # first page: newest messages straight from the in-memory tail when it has enough of them
+        if page == 0:
+            cached = message_tail.latest(("conversation", conversation_id), limit, head=conversation["last_message_id"])
+            if cached is not None:
+                cur.execute("SELECT user_id, last_read_message_id, read_at FROM conversation_reads WHERE conversation_id = %s", (conversation_id,))
+                watermarks = {r["user_id"]: r for r in cur.fetchall()}
+                for msg in cached:
+                    for reader_id, wm in watermarks.items():
+                        if reader_id != msg["sender_id"] and msg["id"] <= wm["last_read_message_id"] and wm["read_at"] is not None:
+                            msg["read_at"] = wm["read_at"].isoformat()
+
+                next_cursor = cached[0]["id"] if len(cached) == limit else None
+                return {"success": True, "message": "all messages", "data": cached, "page": page, "limit": limit, "next_cursor": next_cursor}
+
+        offset = page * limit
+
         cur.execute(
-            """
-            SELECT * FROM messages 
-            WHERE conversation_id = %s
-            ORDER BY created_at DESC 
+            MESSAGE_SELECT + """
+            WHERE m.conversation_id = %s
+            ORDER BY m.created_at DESC
             LIMIT %s OFFSET %s
             """, (conversation_id, limit, offset))
 
         messages = cur.fetchall()
+        next_cursor = messages[-1]["id"] if len(messages) == limit else None
         messages = list(reversed(messages))
 
-        return {"success": True, "message": "all messages", "data": messages, "page": page, "limit": limit}
-
+        if page == 0:
+            message_tail.seed(("conversation", conversation_id), [{**serialize_message(m), "read_at": None} for m in messages], complete=len(messages) < limit)
 
-    finally:
-        close_db(conn,cur)
+        return {"success": True, "message": "all messages", "data": messages, "page": page, "limit": limit, "next_cursor": next_cursor}
 
 
 
 @router.post("/messages/{conversation_id}", summary="Create a new message", tags=["Messages"])
 def create_new_message(conversation_id:int, payload:MessageCreate, current: dict = Depends(current_user)):
-    conn,cur = get_db()
-    try:
+    with get_db() as (conn, cur):
 
         user_id = current["user_id"]
 
@@ -62,17 +121,28 @@ def create_new_message(conversation_id:int, payload:MessageCreate, current: dict
 
         cur.execute(
             """
-            INSERT INTO messages (conversation_id,sender_id, body) 
-            VALUES (%s, %s, %s)
-            RETURNING conversation_id, sender_id, body, created_at, delivered_at, read_at
+            WITH ins AS (
+                INSERT INTO messages (conversation_id,sender_id, body) 
+                VALUES (%s, %s, %s)
+                RETURNING id, conversation_id, sender_id, body, created_at, delivered_at, read_at
+            ), unread AS (
+                INSERT INTO conversation_reads (conversation_id, user_id, unread_count)
+                SELECT c.id, CASE WHEN c.user1_id = %s THEN c.user2_id ELSE c.user1_id END, 1
+                FROM conversations c WHERE c.id = %s
+                ON CONFLICT (conversation_id, user_id) DO UPDATE
+                SET unread_count = conversation_reads.unread_count + 1
+            ), latest AS (
+                UPDATE conversations c
+                SET last_message_id = ins.id, last_message_at = ins.created_at
+                FROM ins
+                WHERE c.id = ins.conversation_id AND (c.last_message_id IS NULL OR c.last_message_id < ins.id)
+            )
+            SELECT conversation_id, sender_id, body, created_at, delivered_at, read_at FROM ins
             """,
-            (conversation_id, user_id, payload.body))
+            (conversation_id, user_id, payload.body, user_id, conversation_id))
 
         msg = cur.fetchone()
         conn.commit()
+        invalidate_tail_from_thread("conversation", conversation_id)
 
         return {"success": True, "message": "sent", "data": msg}
-
-
-    finally:
-        close_db(conn,cur)
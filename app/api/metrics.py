@@ -0,0 +1,157 @@
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+from typing import Callable
+
+from app.db.instrument import query_scope
+
+# Prometheus text exposition without a client library. observe() is one bisect and two adds
+# on a per-label list, so everything here stays on in production; buckets are cumulated only
+# when /metrics is scraped. Values are per worker process.
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+_metrics: list = []
+
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        self._series: dict[tuple, list] = {}
+        _metrics.append(self)
+
+    def observe(self, value: float, *labels):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total) in list(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                le = 'le="' + (bound if isinstance(bound, str) else _number(bound)) + '"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+class Gauge:
+    # read at scrape time from callbacks, so the hot path never touches it
+    def __init__(self, name: str, help: str, labelnames: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._sources: dict[tuple, Callable[[], float]] = {}
+        _metrics.append(self)
+
+    def set_function(self, fn, *labels):
+        self._sources[labels] = fn
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        for labels, fn in list(self._sources.items()):
+            lines.append(f"{self.name}{_labels(self.labelnames, labels)} {_number(fn())}")
+        return lines
+
+
+def render() -> str:
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+ws_connections = Gauge("chat_ws_connections", "Open WebSocket connections", ("kind",))
+ws_rooms = Gauge("chat_ws_rooms", "Rooms with at least one local socket", ("kind",))
+ws_event_seconds = Histogram("chat_ws_event_seconds", "Time to handle one incoming WebSocket event", ("kind", "event"))
+broadcast_seconds = Histogram("chat_broadcast_fanout_seconds", "Time to enqueue one event to every local socket of a room", ("kind",))
+broadcast_room_size = Histogram("chat_broadcast_room_size", "Local sockets an event was fanned out to", ("kind",), SIZE_BUCKETS)
+db_seconds = Histogram("chat_db_seconds", "Latency of the WebSocket database helpers", ("function",))
+http_request_seconds = Histogram("chat_http_request_seconds", "REST request latency", ("method", "route", "status"))
+db_statements = Histogram("chat_db_statements", "Database statements per REST request or WS event", ("scope",), SIZE_BUCKETS)
+
+
+@contextmanager
+def track_ws_event(kind: str, event_type, known: frozenset):
+    # event types come from the client; anything unknown shares one label
+    event = event_type if event_type in known else "other"
+    label = f"ws {kind} {event}"
+    started = time.perf_counter()
+    with query_scope(label) as queries:
+        yield
+    ws_event_seconds.observe(time.perf_counter() - started, kind, event)
+    db_statements.observe(queries.statements, label)
+
+
+def timed_db(fn):
+    name = fn.__qualname__
+
+    @wraps(fn)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await fn(*args, **kwargs)
+        finally:
+            db_seconds.observe(time.perf_counter() - started, name)
+
+    return wrapper
+
+
+class MetricsMiddleware:
+    # plain ASGI (not BaseHTTPMiddleware) so the per-request cost is two clock reads; the route
+    # label is the path template, so /messages/1 and /messages/2 share a series. It also opens the
+    # request's query scope and reports it in a Server-Timing header.
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        with query_scope() as queries:
+
+            async def send_wrapper(message):
+                nonlocal status
+                if message["type"] == "http.response.start":
+                    status = message["status"]
+                    timing = f'db;dur={queries.seconds * 1000:.1f};desc="{queries.statements} statements"'
+                    message["headers"] = [*message.get("headers", ()), (b"server-timing", timing.encode())]
+                await send(message)
+
+            started = time.perf_counter()
+            try:
+                await self.app(scope, receive, send_wrapper)
+            finally:
+                route = scope.get("route")
+                path = route.path if route is not None else "unmatched"
+                queries.label = f"{scope['method']} {path}"
+                http_request_seconds.observe(time.perf_counter() - started, scope["method"], path, status)
+                db_statements.observe(queries.statements, queries.label)
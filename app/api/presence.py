@@ -0,0 +1,30 @@
+from fastapi import APIRouter, Depends, Query
+
+from app.api.tokens.token import current_user
+from app.api.ws.presence import presence
+from app.db.db import get_db
+
+router = APIRouter()
+
+
+@router.get("/presence", summary="Who is online", tags=["Presence"])
+def get_presence(user_ids: list[int] = Query(..., max_length=500), current: dict = Depends(current_user)):
+    # users with a socket on this worker come from the in-memory registry; only the rest are
+    # looked up in presence_sockets / users, in one query
+    remote = {}
+    others = [user_id for user_id in user_ids if not presence.is_online(user_id)]
+    if others:
+        with get_db() as (conn, cur):
+            remote = presence.lookup_remote(cur, others)
+
+    data = []
+    for user_id in user_ids:
+        if presence.is_online(user_id):
+            data.append({"user_id": user_id, "is_online": True, "last_seen_at": presence.last_seen(user_id)})
+            continue
+
+        row = remote.get(user_id, {})
+        seen = [t for t in (presence.last_seen(user_id), row.get("last_seen_at")) if t is not None]
+        data.append({"user_id": user_id, "is_online": bool(row.get("is_online")), "last_seen_at": max(seen) if seen else None})
+
+    return {"success": True, "message": "presence", "data": data}
@@ -0,0 +1,113 @@
+import base64
+import binascii
+
+from fastapi import APIRouter, HTTPException, Depends, Query
+
+from app.api.tokens.token import current_user
+from app.db.db import get_db
+
+router = APIRouter()
+
+SOURCES = ("conversation", "group")
+
+HEADLINE_OPTIONS = "StartSel=<mark>, StopSel=</mark>, MaxWords=24, MinWords=8, MaxFragments=2, FragmentDelimiter=\" … \""
+
+
+def encode_search_cursor(rank: float, source: str, message_id: int) -> str:
+    raw = f"{rank!r}|{source}|{message_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_search_cursor(cursor: str) -> tuple[float, str, int]:
+    try:
+        rank, source, message_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        if source not in SOURCES:
+            raise ValueError(source)
+        return float(rank), source, int(message_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def build_search_query(user_id: int, q: str, limit: int, conversation_id: int | None = None, group_id: int | None = None, cursor: tuple | None = None) -> tuple[str, dict]:
+    # one statement: membership, GIN match, rank, keyset page, then snippets for the page only
+    params = {"user_id": user_id, "q": q, "limit": limit, "conversation_id": conversation_id, "group_id": group_id}
+
+    # membership drives the plan: the caller's chats first, then a (chat_id, search_vector) GIN
+    # probe per chat, so the work is bounded by the caller's chats and never scans everyone's matches
+    parts = []
+    if group_id is None:
+        parts.append(
+            """
+            SELECT 'conversation' AS source, c.id AS chat_id, m.id, m.sender_id, m.body AS text, m.created_at,
+                   ts_rank(m.search_vector, q.query) AS rank
+            FROM q
+            JOIN conversations c ON c.user1_id = %(user_id)s OR c.user2_id = %(user_id)s
+            JOIN LATERAL (
+                SELECT id, sender_id, body, created_at, search_vector FROM messages
+                WHERE conversation_id = c.id AND search_vector @@ q.query
+            ) m ON true
+            """ + ("WHERE c.id = %(conversation_id)s" if conversation_id is not None else "")
+        )
+    if conversation_id is None:
+        parts.append(
+            """
+            SELECT 'group' AS source, gm.group_id AS chat_id, g.id, g.sender_id, g.content AS text, g.created_at,
+                   ts_rank(g.search_vector, q.query) AS rank
+            FROM q
+            JOIN group_members gm ON gm.user_id = %(user_id)s
+            JOIN LATERAL (
+                SELECT id, sender_id, content, created_at, search_vector FROM group_messages
+                WHERE group_id = gm.group_id AND search_vector @@ q.query
+            ) g ON true
+            """ + ("WHERE gm.group_id = %(group_id)s" if group_id is not None else "")
+        )
+
+    after = ""
+    if cursor is not None:
+        params["after_rank"], params["after_source"], params["after_id"] = cursor
+        after = "WHERE (rank, source, id) < (%(after_rank)s::real, %(after_source)s, %(after_id)s)"
+
+    sql = """
+        WITH q AS (
+            SELECT websearch_to_tsquery('simple', %(q)s) AS query
+        ), hits AS (
+            """ + " UNION ALL ".join(parts) + """
+        ), page AS (
+            SELECT * FROM hits
+            """ + after + """
+            ORDER BY rank DESC, source DESC, id DESC
+            LIMIT %(limit)s
+        )
+        SELECT page.source, page.chat_id, page.id, page.sender_id, page.created_at, page.rank,
+               ts_headline('simple', page.text, q.query, '""" + HEADLINE_OPTIONS + """') AS snippet
+        FROM page, q
+        ORDER BY page.rank DESC, page.source DESC, page.id DESC
+    """
+    return sql, params
+
+
+@router.get("/search/messages", summary="Search messages", tags=["Search"])
+def search_messages(q: str = Query(..., min_length=1, max_length=200), conversation_id: int | None = None, group_id: int | None = None, limit: int = 20, cursor: str | None = None, current: dict = Depends(current_user)):
+    # scope: one conversation, one group, or (with neither) every chat of the caller
+    with get_db() as (conn, cur):
+        user_id = current["user_id"]
+
+        if conversation_id is not None and group_id is not None:
+            raise HTTPException(status_code=400, detail="Use either conversation_id or group_id")
+
+        if limit > 50:
+            limit = 50
+        if limit < 1:
+            limit = 1
+
+        after = decode_search_cursor(cursor) if cursor else None
+
+        sql, params = build_search_query(user_id, q, limit + 1, conversation_id, group_id, after)
+        cur.execute(sql, params)
+        rows = cur.fetchall()
+
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        next_cursor = encode_search_cursor(rows[-1]["rank"], rows[-1]["source"], rows[-1]["id"]) if has_more else None
+
+        return {"success": True, "message": "search results", "data": rows, "limit": limit, "next_cursor": next_cursor}
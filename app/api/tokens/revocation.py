@@ -0,0 +1,163 @@
+import hashlib
+import math
+import threading
+import time
+from datetime import timedelta
+
+from app.api.background import PeriodicTask
+from app.config import TOKEN_VALIDATION, TOKEN_DENYLIST_CAPACITY, TOKEN_REVOCATION_SYNC_INTERVAL
+from app.db.async_db import get_async_db
+
+# rows inserted by other workers can become visible slightly out of created_at order
+SYNC_OVERLAP = timedelta(seconds=5)
+
+
+class BloomFilter:
+    def __init__(self, capacity: int, error_rate: float = 0.01):
+        self.capacity = max(capacity, 1)
+        self.size = max(int(-self.capacity * math.log(error_rate) / math.log(2) ** 2), 64)
+        self.hashes = max(round(self.size / self.capacity * math.log(2)), 1)
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key: str):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, key: str):
+        for p in self._positions(key):
+            self.bits[p >> 3] |= 1 << (p & 7)
+
+    def __contains__(self, key: str) -> bool:
+        return all(self.bits[p >> 3] & (1 << (p & 7)) for p in self._positions(key))
+
+
+class RevocationList:
+    # revoked token ids: a Bloom filter answers "not revoked" for almost every request, the exact
+    # map confirms the rest. Revoking all of a user's tokens stores one cutoff instead of every id.
+    # Sync routes check tokens from worker threads while the sync task writes, hence the lock.
+    def __init__(self, capacity: int):
+        self.capacity = max(capacity, 1)
+        self._lock = threading.Lock()
+        self._tokens: dict[str, float] = {}               # token id -> exp
+        self._users: dict[int, tuple[float, float]] = {}  # user_id -> (not_before, exp)
+        self._bloom = BloomFilter(self.capacity)
+        self._bloom_items = 0
+        self.checks = 0
+        self.filter_hits = 0
+        self.false_positives = 0
+        self.rebuilds = 0
+
+    def revoke(self, token_id: str, exp: float):
+        with self._lock:
+            if token_id in self._tokens:
+                return
+            self._tokens[token_id] = exp
+            self._bloom.add(token_id)
+            self._bloom_items += 1
+            if self._bloom_items > self._bloom.capacity:
+                self._rebuild()
+
+    def revoke_user(self, user_id: int, not_before: float, exp: float):
+        with self._lock:
+            current = self._users.get(user_id)
+            if current is None or not_before > current[0]:
+                self._users[user_id] = (not_before, exp)
+
+    def is_revoked(self, token_id: str, user_id: int, issued_at: float) -> bool:
+        with self._lock:
+            self.checks += 1
+            cutoff = self._users.get(user_id)
+            if cutoff is not None and issued_at < cutoff[0]:
+                return True
+
+            if token_id not in self._bloom:
+                return False
+            self.filter_hits += 1
+            if token_id in self._tokens:
+                return True
+            self.false_positives += 1
+            return False
+
+    def prune(self, now: float | None = None):
+        now = time.time() if now is None else now
+        with self._lock:
+            expired = [k for k, exp in self._tokens.items() if exp <= now]
+            for k in expired:
+                del self._tokens[k]
+            for user_id in [u for u, (_, exp) in self._users.items() if exp <= now]:
+                del self._users[user_id]
+        # expired ids stay in the filter (only costing an exact lookup) until it fills up
+
+    def _rebuild(self):
+        # a Bloom filter cannot forget: once full it is rebuilt from the live ids, doubling if
+        # needed. Runs under the lock taken by revoke()
+        capacity = self.capacity
+        while capacity < 2 * len(self._tokens):
+            capacity *= 2
+        self._bloom = BloomFilter(capacity)
+        for k in self._tokens:
+            self._bloom.add(k)
+        self._bloom_items = len(self._tokens)
+        self.rebuilds += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "tokens": len(self._tokens),
+                "users": len(self._users),
+                "capacity": self._bloom.capacity,
+                "filter_items": self._bloom_items,
+                "checks": self.checks,
+                "filter_hits": self.filter_hits,
+                "false_positives": self.false_positives,
+                "rebuilds": self.rebuilds,
+            }
+
+
+revocations = RevocationList(TOKEN_DENYLIST_CAPACITY)
+
+
+class RevocationSync(PeriodicTask):
+    # pulls revocations written by other workers from token_revocations (stateless mode only)
+    def __init__(self, interval: float):
+        super().__init__(interval)
+        self.synced_until = None
+        self.syncs = 0
+
+    async def run_once(self):
+        if TOKEN_VALIDATION != "stateless":
+            return
+
+        async with get_async_db() as conn:
+            if self.synced_until is None:
+                # first run loads everything still live, then switches to the incremental window
+                self.synced_until = await conn.fetchval("SELECT now()")
+                rows = await conn.fetch(
+                    "SELECT jti, user_id, expire_at, issued_before, created_at FROM token_revocations WHERE expire_at > now()"
+                )
+            else:
+                rows = await conn.fetch(
+                    "SELECT jti, user_id, expire_at, issued_before, created_at FROM token_revocations WHERE created_at > $1",
+                    self.synced_until - SYNC_OVERLAP,
+                )
+
+        for row in rows:
+            issued_before = row["issued_before"] or row["created_at"]
+            apply_revocation(row["jti"], row["user_id"], row["expire_at"].timestamp(), issued_before.timestamp())
+            self.synced_until = max(self.synced_until, row["created_at"])
+
+        revocations.prune()
+        self.syncs += 1
+
+
+def apply_revocation(jti: str | None, user_id: int, exp: float, issued_before: float):
+    # a row without jti revokes every token of the user issued before issued_before
+    if jti is None:
+        revocations.revoke_user(user_id, issued_before, exp)
+    else:
+        revocations.revoke(jti, exp)
+
+
+revocation_sync = RevocationSync(TOKEN_REVOCATION_SYNC_INTERVAL)
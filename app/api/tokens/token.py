@@ -1,20 +1,57 @@
+import asyncio
+import hashlib
+import time
+import uuid
 from datetime import timedelta, datetime, timezone
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
+import anyio
 import jwt
 
+from app.api.background import PeriodicTask
+from app.api.cache import TTLCache
+from app.api.tokens.revocation import revocations, apply_revocation
 from app.api.utils import ensure_utc_aware
-from app.config import TOKEN_EXPIRE_MINUTES, ALGORITHM, SECRET_KEY
-from app.db.db import get_db, close_db
+from app.api.ws.pubsub import pubsub
+from app.config import TOKEN_EXPIRE_MINUTES, ALGORITHM, SECRET_KEY, TOKEN_CACHE_SIZE, TOKEN_CACHE_TTL, TOKEN_SWEEP_INTERVAL, TOKEN_SWEEP_BATCH_SIZE, TOKEN_VALIDATION
+from app.db.async_db import get_async_db
+from app.db.db import get_db
 
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/login")
 
+# verified token rows, keyed by sha256(token); entries never outlive the token itself
+token_cache = TTLCache(maxsize=TOKEN_CACHE_SIZE, ttl=TOKEN_CACHE_TTL)
+
+# revocations evict token_cache entries on every worker; only digests go over the channel
+TOKEN_CACHE_CHANNEL = "token_cache"
+
+
+async def _on_token_evict(room_id, message: dict):
+    if "digest" in message:
+        token_cache.pop(message["digest"])
+    else:
+        token_cache.pop_where(lambda _, doc: doc.get("user_id") == room_id)
+
+
+pubsub.subscribe(TOKEN_CACHE_CHANNEL, _on_token_evict)
+pubsub.on_reconnect(token_cache.clear)
+
+
+def evict_cached_tokens_from_thread(user_id: int, digest: str | None = None):
+    # for the sync REST handlers, which run in anyio worker threads; without a digest every
+    # cached token of the user is dropped
+    message = {"digest": digest} if digest else {}
+    anyio.from_thread.run(pubsub.publish, TOKEN_CACHE_CHANNEL, user_id, message)
+
 def create_access_token(data: dict):
-    expire_at = datetime.now(timezone.utc) + timedelta(minutes=TOKEN_EXPIRE_MINUTES)
+    now = datetime.now(timezone.utc)
+    expire_at = now + timedelta(minutes=TOKEN_EXPIRE_MINUTES)
 
     payload = {
         'exp': int(expire_at.timestamp()),
+        'iat': now.timestamp(),
+        'jti': uuid.uuid4().hex,
         'user_id': data.get('user_id'),
     }
 
@@ -23,41 +60,113 @@ def create_access_token(data: dict):
     return token, expire_at
 
 
-def save_token_to_db(token: str, expire_at: datetime, user_id: int):
-    conn, cur = get_db()
+def validate_token_doc(token_doc: dict | None, user_id: int):
+    if not token_doc:
+        raise HTTPException(status_code=401, detail="Invalid token")
+
+    expire_at = ensure_utc_aware(token_doc.get("expire_at"))
+    if not expire_at:
+        raise HTTPException(status_code=401, detail="Invalid token expiry")
+
+    if expire_at <= datetime.now(timezone.utc):
+        raise HTTPException(status_code=401, detail="Expired token")
 
-    cur.execute(f""" INSERT INTO tokens (user_id,token, expire_at) VALUES (%s, %s, %s) """, (user_id, token, expire_at))
-    conn.commit()
-    close_db(conn, cur)
+    if token_doc.get("user_id") != user_id:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token user mismatch")
 
-    return {"success": True}
+    return token_doc
 
 
-def check_token(token: str):
+def token_digest(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
 
-    conn, cur = get_db()
-    try:
-        now = datetime.now(timezone.utc)
 
-        cur.execute("SELECT * FROM tokens WHERE token = %s", (token,))
-        token_doc = cur.fetchone()
+def get_cached_token(token: str) -> dict | None:
+    return token_cache.get(token_digest(token))
 
-        if not token_doc:
-            raise HTTPException(status_code=401, detail="Invalid token")
 
-        expire_at = ensure_utc_aware(token_doc.get("expire_at"))
-        if not expire_at:
-            raise HTTPException(status_code=401, detail="Invalid token expiry")
+def cache_token(token: str, token_doc: dict):
+    expire_at = ensure_utc_aware(token_doc["expire_at"])
+    ttl = (expire_at - datetime.now(timezone.utc)).total_seconds()
+    token_cache.set(token_digest(token), token_doc, ttl=ttl)
 
-        if expire_at <= now:
-            raise HTTPException(status_code=401, detail="Expired token")
 
-        return token_doc
-    finally:
-        close_db(conn, cur)
+def check_token(token: str, user_id: int):
 
+    token_doc = get_cached_token(token)
+    if token_doc is None:
+        with get_db() as (conn, cur):
+            cur.execute("SELECT * FROM tokens WHERE token = %s", (token,))
+            token_doc = cur.fetchone()
 
-def current_user(token:str = Depends(oauth2_scheme)):
+        validate_token_doc(token_doc, user_id)
+        cache_token(token, token_doc)
+
+    return validate_token_doc(token_doc, user_id)
+
+
+def token_id(token: str, payload: dict) -> str:
+    # tokens issued before jti was added are identified by their digest
+    return payload.get("jti") or token_digest(token)
+
+
+def stateless_token_doc(token: str, payload: dict) -> dict:
+    # signature and exp are already checked by decode_token; only the denylist is left
+    issued_at = payload.get("iat", payload["exp"] - TOKEN_EXPIRE_MINUTES * 60)
+    if revocations.is_revoked(token_id(token, payload), payload["user_id"], issued_at):
+        raise HTTPException(status_code=401, detail="Revoked token")
+
+    return {
+        "user_id": payload["user_id"],
+        "token": token,
+        "expire_at": datetime.fromtimestamp(payload["exp"], timezone.utc),
+    }
+
+
+def revoke_token(token: str):
+    if TOKEN_VALIDATION == "stateless":
+        payload = decode_token(token)
+        jti = token_id(token, payload)
+        with get_db() as (conn, cur):
+            cur.execute(
+                "INSERT INTO token_revocations (jti, user_id, expire_at) VALUES (%s, %s, to_timestamp(%s))",
+                (jti, payload["user_id"], payload["exp"]),
+            )
+            conn.commit()
+        apply_revocation(jti, payload["user_id"], payload["exp"], time.time())
+        return
+
+    with get_db() as (conn, cur):
+        cur.execute("DELETE FROM tokens WHERE token = %s RETURNING user_id", (token,))
+        row = cur.fetchone()
+        conn.commit()
+
+    if row is not None:
+        evict_cached_tokens_from_thread(row["user_id"], token_digest(token))
+
+
+def revoke_user_tokens(user_id: int):
+    if TOKEN_VALIDATION == "stateless":
+        # the cutoff is compared with iat, so it comes from the same (app) clock, not the DB's now()
+        now = datetime.now(timezone.utc)
+        expire_at = now + timedelta(minutes=TOKEN_EXPIRE_MINUTES)
+        with get_db() as (conn, cur):
+            cur.execute(
+                "INSERT INTO token_revocations (jti, user_id, expire_at, issued_before) VALUES (NULL, %s, %s, %s)",
+                (user_id, expire_at, now),
+            )
+            conn.commit()
+        apply_revocation(None, user_id, expire_at.timestamp(), now.timestamp())
+        return
+
+    with get_db() as (conn, cur):
+        cur.execute("DELETE FROM tokens WHERE user_id = %s", (user_id,))
+        conn.commit()
+
+    evict_cached_tokens_from_thread(user_id)
+
+
+def decode_token(token: str) -> dict:
 
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
@@ -70,38 +179,105 @@ def current_user(token:str = Depends(oauth2_scheme)):
     except jwt.InvalidTokenError:
         raise HTTPException(status_code=401, detail="Invalid token")
 
-    user_id = payload.get("user_id")
-
-    if not user_id:
+    if not payload.get("user_id"):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="user_id not found")
-    token_doc = check_token(token)
 
-    if token_doc.get("user_id") != user_id:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token user mismatch")
+    return payload
 
-    return token_doc
 
+def current_user(token:str = Depends(oauth2_scheme)):
 
-def active_or_new_token(user: dict):
-    conn, cur = get_db()
-    try:
-        user_id = user.get("id")
-        if not user_id:
-            raise HTTPException(status_code=401, detail="User id not found")
+    payload = decode_token(token)
 
-        now = datetime.now(timezone.utc)
+    if TOKEN_VALIDATION == "stateless":
+        return stateless_token_doc(token, payload)
 
-        cur.execute("""SELECT * FROM tokens WHERE user_id = %s ORDER BY expire_at DESC LIMIT 1 """, (user_id,))
-        existing = cur.fetchone()
+    return check_token(token, payload["user_id"])
 
-        if existing:
-            expire_at = ensure_utc_aware(existing.get("expire_at"))
-            token = existing.get("token")
-            if token and expire_at and expire_at > now:
-                return token, expire_at
 
-        new_token, expire_at = create_access_token({"user_id": user_id})
-        save_token_to_db(new_token, expire_at, user_id)
-        return new_token, expire_at
-    finally:
-        close_db(conn, cur)
\ No newline at end of file
+def new_session_token(user: dict, cur=None):
+    # every login is its own session with its own token row, so logging out on one device leaves
+    # the others signed in; pass `cur` to make it part of the caller's transaction (the caller
+    # commits). Stateless mode stores nothing.
+    user_id = user.get("id")
+    if not user_id:
+        raise HTTPException(status_code=401, detail="User id not found")
+
+    new_token, new_expire_at = create_access_token({"user_id": user_id})
+    if TOKEN_VALIDATION == "stateless":
+        # nothing to store: the signed token is the session
+        return new_token, new_expire_at
+
+    sql = "INSERT INTO tokens (user_id, token, expire_at) VALUES (%s, %s, %s) RETURNING token, expire_at"
+    params = (user_id, new_token, new_expire_at)
+
+    if cur is None:
+        with get_db() as (conn, cur):
+            cur.execute(sql, params)
+            row = cur.fetchone()
+            conn.commit()
+    else:
+        cur.execute(sql, params)
+        row = cur.fetchone()
+
+    return row["token"], ensure_utc_aware(row["expire_at"])
+
+
+class TokenSweeper(PeriodicTask):
+    # deletes expired tokens (and expired revocations) a small batch per transaction;
+    # SKIP LOCKED lets every worker run one
+    TABLES = ("tokens", "token_revocations")
+
+    def __init__(self, interval: float, batch_size: int):
+        super().__init__(interval)
+        self.batch_size = max(batch_size, 1)
+        self.runs = 0
+        self.batches = 0
+        self.deleted = {table: 0 for table in self.TABLES}
+        self.last_deleted = 0
+        self.last_run_ms = 0.0
+
+    async def sweep(self, table: str) -> int:
+        deleted = 0
+        while True:
+            async with get_async_db() as conn:
+                status = await conn.execute(
+                    f"""
+                    DELETE FROM {table} WHERE id IN (
+                        SELECT id FROM {table} WHERE expire_at < now()
+                        ORDER BY expire_at LIMIT $1
+                        FOR UPDATE SKIP LOCKED
+                    )
+                    """,
+                    self.batch_size,
+                )
+            count = int(status.split()[-1])
+            deleted += count
+            self.batches += 1
+            if count < self.batch_size:
+                return deleted
+            await asyncio.sleep(0)
+
+    async def run_once(self):
+        started = time.perf_counter()
+        deleted = 0
+        for table in self.TABLES:
+            count = await self.sweep(table)
+            self.deleted[table] += count
+            deleted += count
+
+        self.runs += 1
+        self.last_deleted = deleted
+        self.last_run_ms = round((time.perf_counter() - started) * 1000, 3)
+
+    def stats(self) -> dict:
+        return {
+            "runs": self.runs,
+            "batches": self.batches,
+            "deleted": self.deleted,
+            "last_deleted": self.last_deleted,
+            "last_run_ms": self.last_run_ms,
+        }
+
+
+token_sweeper = TokenSweeper(TOKEN_SWEEP_INTERVAL, TOKEN_SWEEP_BATCH_SIZE)
@@ -0,0 +1,40 @@
+from fastapi import APIRouter, Depends
+
+from app.api.tokens.token import current_user
+from app.db.db import get_db
+
+router = APIRouter()
+
+
+@router.get("/me/unread", summary="Unread counts per chat", tags=["Unread"])
+def get_unread(current: dict = Depends(current_user)):
+    # counters are maintained on insert/read, so this is one row per chat, never a scan of messages
+    with get_db() as (conn, cur):
+        user_id = current["user_id"]
+
+        cur.execute(
+            """
+            SELECT conversation_id, unread_count
+            FROM conversation_reads
+            WHERE user_id = %s AND unread_count > 0
+            ORDER BY conversation_id
+            """,
+            (user_id,),
+        )
+        conversations = cur.fetchall()
+
+        cur.execute(
+            """
+            SELECT gm.group_id, gm.unread_count
+            FROM group_members gm
+            JOIN groups g ON g.id = gm.group_id
+            WHERE gm.user_id = %s AND g.deleted_at IS NULL AND gm.unread_count > 0
+            ORDER BY gm.group_id
+            """,
+            (user_id,),
+        )
+        groups = cur.fetchall()
+
+        total = sum(c["unread_count"] for c in conversations) + sum(g["unread_count"] for g in groups)
+
+        return {"success": True, "message": "unread counts", "data": {"conversations": conversations, "groups": groups, "total": total}}
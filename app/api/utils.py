@@ -1,15 +1,81 @@
-
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from datetime import timezone
 
-from passlib.handlers.sha2_crypt import sha256_crypt
+from fastapi import HTTPException
+from passlib.context import CryptContext
+
+from app.config import PASSWORD_SCHEME, PASSWORD_ROUNDS, PASSWORD_HASH_WORKERS, PASSWORD_HASH_CONCURRENCY, PASSWORD_HASH_TIMEOUT
+
+
+def build_password_context(scheme: str, rounds: int) -> CryptContext:
+    # sha256_crypt stays verifiable so existing users can still log in (and get rehashed)
+    schemes = [scheme] + [s for s in ("sha256_crypt",) if s != scheme]
+    settings = {}
+    if rounds:
+        # pin the cost both ways, so raising or lowering PASSWORD_ROUNDS rehashes on login
+        settings = {f"{scheme}__default_rounds": rounds, f"{scheme}__min_rounds": rounds, f"{scheme}__max_rounds": rounds}
+    return CryptContext(schemes=schemes, default=scheme, deprecated="auto", **settings)
+
+
+pwd_context = build_password_context(PASSWORD_SCHEME, PASSWORD_ROUNDS)
 
 
 def hash_password(password: str) -> str:
-    return sha256_crypt.hash(password)
+    return pwd_context.hash(password)
 
 
 def verify_password(plain: str, hashed: str) -> bool:
-    return sha256_crypt.verify(plain, hashed)
+    return pwd_context.verify(plain, hashed)
+
+
+def verify_and_update_password(plain: str, hashed: str) -> tuple[bool, str | None]:
+    # (matches, new hash when the stored one uses an old scheme/cost)
+    return pwd_context.verify_and_update(plain, hashed)
+
+
+_hash_pool: ProcessPoolExecutor | None = None
+_hash_slots: asyncio.Semaphore | None = None
+
+
+def _get_hash_pool() -> tuple[ProcessPoolExecutor, asyncio.Semaphore]:
+    global _hash_pool, _hash_slots
+    if _hash_pool is None:
+        # spawn, not fork: a forked child would inherit the worker's event loop, pool
+        # connections and lock state from whatever thread held them
+        _hash_pool = ProcessPoolExecutor(max_workers=max(PASSWORD_HASH_WORKERS, 1), mp_context=multiprocessing.get_context("spawn"))
+        _hash_slots = asyncio.Semaphore(max(PASSWORD_HASH_CONCURRENCY, 1))
+    return _hash_pool, _hash_slots
+
+
+async def _run_hashing(fn, *args):
+    pool, slots = _get_hash_pool()
+    try:
+        # bounded: a login burst queues here instead of piling work onto the pool
+        await asyncio.wait_for(slots.acquire(), PASSWORD_HASH_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=503, detail="Server busy, try again")
+    try:
+        return await asyncio.get_running_loop().run_in_executor(pool, fn, *args)
+    finally:
+        slots.release()
+
+
+async def hash_password_async(password: str) -> str:
+    return await _run_hashing(hash_password, password)
+
+
+async def verify_and_update_password_async(plain: str, hashed: str) -> tuple[bool, str | None]:
+    return await _run_hashing(verify_and_update_password, plain, hashed)
+
+
+def close_hash_pool():
+    global _hash_pool, _hash_slots
+    if _hash_pool is not None:
+        _hash_pool.shutdown(wait=False, cancel_futures=True)
+        _hash_pool = None
+        _hash_slots = None
 
 
 def ensure_utc_aware(dt):
@@ -17,4 +83,4 @@ def ensure_utc_aware(dt):
         return None
     if dt.tzinfo is None:
         return dt.replace(tzinfo=timezone.utc)
-    return dt.astimezone(timezone.utc)
\ No newline at end of file
+    return dt.astimezone(timezone.utc)
@@ -1,67 +1,149 @@
+import time
 from typing import Dict, Set
 
 from fastapi import WebSocket
 
+from app.api.metrics import ws_connections, ws_rooms, broadcast_seconds, broadcast_room_size
+from app.api.ws.frames import encode_frame
+from app.api.ws.outbox import Outbox, coalesce_key, message_event_id
+from app.config import WS_SEND_QUEUE_SIZE, WS_OVERFLOW_POLICY
+
 
 class ConnectionManager:
-    def __init__(self):
+    def __init__(self, channel: str | None = None, backend=None, presence=None, room_kind: str | None = None):
 
         self.active_connections: Dict[int, Set[WebSocket]] = {}
         self.user_connections: Dict[int, Set[WebSocket]] = {}
         self.ws_user: Dict[WebSocket, int] = {}
+        self.ws_rooms: Dict[WebSocket, Set[int]] = {}
+
+        # every socket gets its own bounded queue + writer task, so one slow client never delays the rest
+        self.outboxes: Dict[WebSocket, Outbox] = {}
+
+        # with a backend, broadcast goes through pub/sub and every worker delivers to its own sockets
+        self.channel = channel
+        self.backend = backend
+        if backend is not None:
+            backend.subscribe(channel, self.deliver)
+
+        self.presence = presence
+
+        # outgoing events carry "channel": "<room_kind>:<room>" so one socket can multiplex many rooms
+        self.room_kind = room_kind
+
+        kind = room_kind or channel
+        if kind:
+            ws_connections.set_function(lambda: len(self.ws_user), kind)
+            ws_rooms.set_function(lambda: len(self.active_connections), kind)
+        self.metrics_kind = kind or "local"
 
-    async def connect(self, conversation_id, websocket: WebSocket, user_id):
+    async def connect(self, conversation_id, websocket: WebSocket, user_id, paused: bool = False):
         await websocket.accept()
 
-        self.active_connections.setdefault(conversation_id, set()).add(websocket)
+        outbox = Outbox(websocket, WS_SEND_QUEUE_SIZE, WS_OVERFLOW_POLICY, on_close=self._remove, paused=paused)
+        self.attach(websocket, user_id, outbox)
+        self.subscribe(conversation_id, websocket)
+
+    def attach(self, websocket: WebSocket, user_id, outbox: Outbox):
+        # an accepted socket joins this manager with no rooms yet; the outbox may be shared with other managers
         self.user_connections.setdefault(user_id, set()).add(websocket)
         self.ws_user[websocket] = user_id
+        self.ws_rooms.setdefault(websocket, set())
+        self.outboxes[websocket] = outbox
+        if self.presence is not None:
+            self.presence.connected(user_id)
 
-    async def broadcast(self, conversation_id, message):
+    def detach(self, websocket: WebSocket):
+        self._remove(websocket)
+
+    def subscribe(self, room, websocket: WebSocket):
+        if websocket not in self.ws_user:
+            return
+        self.active_connections.setdefault(room, set()).add(websocket)
+        self.ws_rooms[websocket].add(room)
+
+    def unsubscribe(self, room, websocket: WebSocket):
+        rooms = self.ws_rooms.get(websocket)
+        if rooms is not None:
+            rooms.discard(room)
 
-        if conversation_id not in self.active_connections:
+        sockets = self.active_connections.get(room)
+        if sockets is not None:
+            sockets.discard(websocket)
+            if not sockets:
+                del self.active_connections[room]
+
+    def is_subscribed(self, room, websocket: WebSocket) -> bool:
+        return room in self.ws_rooms.get(websocket, ())
+
+    def channel_name(self, room) -> str | None:
+        return f"{self.room_kind}:{room}" if self.room_kind else None
+
+    async def broadcast(self, conversation_id, message):
+        if self.backend is None:
+            await self.deliver(conversation_id, message)
             return
 
-        dead: set[WebSocket] = set()
+        await self.backend.publish(self.channel, conversation_id, message)
+
+    async def deliver(self, conversation_id, message):
+        sockets = self.active_connections.get(conversation_id)
+        if not sockets:
+            return
 
-        for websocket in list(self.active_connections[conversation_id]):
+        if self.room_kind:
+            message = {**message, "channel": self.channel_name(conversation_id)}
 
-            try:
+        # encode once, then O(n) enqueue of the same frame; never waits on the network
+        started = time.perf_counter()
+        frame = encode_frame(message)
+        key = coalesce_key(message)
+        message_id = message_event_id(message)
+        for websocket in sockets:
+            outbox = self.outboxes.get(websocket)
+            if outbox is not None:
+                outbox.put(frame, key, message_id)
 
-                await websocket.send_json(message)
-            except Exception:
-                dead.add(websocket)
+        broadcast_seconds.observe(time.perf_counter() - started, self.metrics_kind)
+        broadcast_room_size.observe(len(sockets), self.metrics_kind)
 
-        for ws in dead:
-            self.active_connections[conversation_id].discard(ws)
+    def send(self, websocket: WebSocket, message, room=None):
+        if room is not None and self.room_kind:
+            message = {**message, "channel": self.channel_name(room)}
 
-            uid = self.ws_user.get(ws)
-            if uid is not None and uid not in self.user_connections:
-                self.user_connections[uid].discard(ws)
-                if len(self.user_connections[uid]) == 0:
-                    del self.user_connections[uid]
+        outbox = self.outboxes.get(websocket)
+        if outbox is not None:
+            outbox.put(encode_frame(message), coalesce_key(message))
 
-            self.ws_user.pop(ws, None)
+    def resume(self, websocket: WebSocket, message=None, replayed_up_to: int | None = None, room=None):
+        if message is not None and room is not None and self.room_kind:
+            message = {**message, "channel": self.channel_name(room)}
 
-        if len(self.active_connections[conversation_id]) == 0:
-            del self.active_connections[conversation_id]
+        outbox = self.outboxes.get(websocket)
+        if outbox is not None:
+            outbox.resume(encode_frame(message) if message is not None else None, replayed_up_to)
 
     def is_user_online(self, user_id: int) -> bool:
         return user_id in self.user_connections and len(self.user_connections[user_id]) > 0
 
-    def disconnect(self, conversation_id, websocket: WebSocket):
-        if conversation_id in self.active_connections:
-            self.active_connections[conversation_id].discard(websocket)
-
-            self.active_connections[conversation_id].discard(websocket)
-            if len(self.active_connections[conversation_id]) == 0:
-                del self.active_connections[conversation_id]
+    def _remove(self, websocket: WebSocket):
+        for conversation_id in list(self.ws_rooms.get(websocket, ())):
+            self.unsubscribe(conversation_id, websocket)
+        self.ws_rooms.pop(websocket, None)
 
-        uid = self.ws_user.get(websocket)
+        uid = self.ws_user.pop(websocket, None)
 
         if uid is not None and uid in self.user_connections:
             self.user_connections[uid].discard(websocket)
             if len(self.user_connections[uid]) == 0:
                 del self.user_connections[uid]
 
-        self.ws_user.pop(websocket, None)
+        if uid is not None and self.presence is not None:
+            self.presence.disconnected(uid)
+
+        outbox = self.outboxes.pop(websocket, None)
+        if outbox is not None:
+            outbox.close()
+
+    def disconnect(self, conversation_id, websocket: WebSocket):
+        self._remove(websocket)
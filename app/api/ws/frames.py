@@ -0,0 +1,13 @@
+import json
+
+try:
+    import orjson
+except ImportError:  # optional, falls back to the stdlib encoder
+    orjson = None
+
+
+def encode_frame(message) -> str:
+    # same output as starlette's send_json, done once per event instead of once per socket
+    if orjson is not None:
+        return orjson.dumps(message).decode()
+    return json.dumps(message, separators=(",", ":"), ensure_ascii=False)
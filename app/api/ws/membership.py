@@ -0,0 +1,45 @@
+import anyio
+
+from app.api.cache import membership_cache, update_cached_membership, set_cached_non_member, forget_group_member, forget_group
+from app.api.ws.pubsub import pubsub
+
+# keeps every worker's membership_cache in step with REST membership changes; the publishing
+# worker applies the change through its own local dispatch like everyone else
+MEMBERSHIP_CHANNEL = "membership_cache"
+
+
+async def _on_membership_change(group_id, message: dict):
+    op = message["op"]
+    if op == "forget_group":
+        forget_group(group_id)
+    elif op == "forget":
+        forget_group_member(group_id, message["user_id"])
+    elif op == "non_member":
+        set_cached_non_member(group_id, message["user_id"])
+    elif op == "update":
+        update_cached_membership(group_id, message["user_id"], **message["fields"])
+
+
+pubsub.subscribe(MEMBERSHIP_CHANNEL, _on_membership_change)
+pubsub.on_reconnect(membership_cache.clear)
+
+
+def _publish_from_thread(group_id: int, message: dict):
+    # for the sync REST handlers, which run in anyio worker threads
+    anyio.from_thread.run(pubsub.publish, MEMBERSHIP_CHANNEL, group_id, message)
+
+
+def forget_group_from_thread(group_id: int):
+    _publish_from_thread(group_id, {"op": "forget_group"})
+
+
+def forget_group_member_from_thread(group_id: int, user_id: int):
+    _publish_from_thread(group_id, {"op": "forget", "user_id": user_id})
+
+
+def set_non_member_from_thread(group_id: int, user_id: int):
+    _publish_from_thread(group_id, {"op": "non_member", "user_id": user_id})
+
+
+def update_membership_from_thread(group_id: int, user_id: int, **fields):
+    _publish_from_thread(group_id, {"op": "update", "user_id": user_id, "fields": fields})
@@ -0,0 +1,118 @@
+import asyncio
+import logging
+from collections import deque
+
+from fastapi import WebSocket
+
+logger = logging.getLogger(__name__)
+
+DROP_OLDEST = "drop_oldest"
+DISCONNECT = "disconnect"
+COALESCE = "coalesce"
+
+# close code for a consumer that cannot keep up ("try again later")
+SLOW_CONSUMER_CLOSE_CODE = 1013
+
+
+def coalesce_key(message: dict):
+    # events where only the newest one matters; older queued copies can be replaced
+    if message.get("type") == "conversation.read":
+        data = message.get("data") or {}
+        return "conversation.read", data.get("conversation_id"), data.get("reader_id")
+    if message.get("type") == "pong":
+        return "pong"
+    return None
+
+
+def message_event_id(message: dict) -> int | None:
+    # id of the chat message a new-message event carries, used to skip it after a replay
+    if message.get("type") in ("message.new", "group.message.new"):
+        return (message.get("data") or {}).get("id")
+    return None
+
+
+class Outbox:
+    def __init__(self, websocket: WebSocket, maxsize: int, policy: str, on_close, paused: bool = False):
+        self.websocket = websocket
+        self.maxsize = max(maxsize, 1)
+        self.policy = policy
+        self.dropped = 0
+        self.closed = False
+        # a paused outbox queues but does not send, until resume() puts the replay in front
+        self.paused = paused
+
+        self._queue: deque = deque()
+        self._ready = asyncio.Event()
+        self._on_close = on_close
+        self._task = asyncio.create_task(self._writer())
+
+    def put(self, frame: str, key=None, message_id: int | None = None) -> bool:
+        if self.closed:
+            return False
+
+        if self.policy != COALESCE:
+            key = None
+
+        if len(self._queue) >= self.maxsize:
+            if key is not None:
+                for i, (queued_key, _, _) in enumerate(self._queue):
+                    if queued_key == key:
+                        del self._queue[i]
+                        self._queue.append((key, frame, message_id))
+                        return True
+
+            if self.policy == DISCONNECT:
+                logger.warning("closing slow websocket consumer (%s queued)", len(self._queue))
+                self.close()
+                asyncio.create_task(self._close_socket())
+                return False
+
+            self._queue.popleft()
+            self.dropped += 1
+
+        self._queue.append((key, frame, message_id))
+        self._ready.set()
+        return True
+
+    def resume(self, first: str | None = None, replayed_up_to: int | None = None):
+        # events queued while paused that the replay already covers are dropped, so the client
+        # sees each message once: replay first, then live events
+        if replayed_up_to is not None:
+            self._queue = deque(
+                entry for entry in self._queue if entry[2] is None or entry[2] > replayed_up_to
+            )
+        if first is not None:
+            self._queue.appendleft((None, first, None))
+        self.paused = False
+        self._ready.set()
+
+    async def _writer(self):
+        try:
+            while True:
+                while not self._queue or self.paused:
+                    self._ready.clear()
+                    await self._ready.wait()
+
+                _, frame, _ = self._queue.popleft()
+                await self.websocket.send_text(frame)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self.closed = True
+            self._on_close(self.websocket)
+
+    async def _close_socket(self):
+        try:
+            await self.websocket.close(code=SLOW_CONSUMER_CLOSE_CODE)
+        except Exception:
+            pass
+        self._on_close(self.websocket)
+
+    def close(self):
+        self.closed = True
+        self._queue.clear()
+        if not self._task.done():
+            self._task.cancel()
+
+    def __len__(self):
+        return len(self._queue)
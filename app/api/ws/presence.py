@@ -0,0 +1,161 @@
+import logging
+import uuid
+from datetime import datetime, timezone
+
+from app.api.background import PeriodicTask
+from app.config import PRESENCE_FLUSH_INTERVAL, PRESENCE_WORKER_TIMEOUT
+from app.db.async_db import get_async_db
+
+logger = logging.getLogger(__name__)
+
+# a user is online while any live worker holds a socket for them
+LIVE_SOCKET_SQL = """
+    EXISTS (
+        SELECT 1 FROM presence_sockets ps
+        JOIN presence_workers pw ON pw.worker = ps.worker
+        WHERE ps.user_id = {user} AND pw.heartbeat_at > now() - make_interval(secs => {timeout})
+    )
+"""
+
+
+class PresenceRegistry(PeriodicTask):
+    # counts open sockets per user across every ConnectionManager; users.is_online / last_seen_at
+    # are written in one batched UPDATE per interval with the final state only. Other workers may
+    # hold sockets of the same user, so each worker mirrors its users into presence_sockets and
+    # heartbeats presence_workers; is_online is computed from every live worker's rows.
+    def __init__(self, interval: float, worker_timeout: float):
+        super().__init__(interval)
+        self.worker = uuid.uuid4().hex
+        self.worker_timeout = worker_timeout
+        self._sockets: dict[int, int] = {}
+        self._last_seen: dict[int, datetime] = {}
+        self._dirty: set[int] = set()
+
+    def connected(self, user_id: int):
+        self._sockets[user_id] = self._sockets.get(user_id, 0) + 1
+        self.touch(user_id)
+
+    def disconnected(self, user_id: int):
+        count = self._sockets.get(user_id, 0) - 1
+        if count > 0:
+            self._sockets[user_id] = count
+        else:
+            self._sockets.pop(user_id, None)
+        self.touch(user_id)
+
+    def touch(self, user_id: int):
+        self._last_seen[user_id] = datetime.now(timezone.utc)
+        self._dirty.add(user_id)
+
+    def is_online(self, user_id: int) -> bool:
+        return user_id in self._sockets
+
+    def online_users(self, user_ids) -> list[int]:
+        return [user_id for user_id in user_ids if user_id in self._sockets]
+
+    def last_seen(self, user_id: int) -> datetime | None:
+        return self._last_seen.get(user_id)
+
+    def lookup_remote(self, cur, user_ids: list[int]) -> dict[int, dict]:
+        # for users with no socket here (sync routes, psycopg2 cursor): online if another live
+        # worker holds one; this worker's own rows may be stale until its next flush
+        if not user_ids:
+            return {}
+        cur.execute(
+            """
+            SELECT u.id,
+                   EXISTS (
+                       SELECT 1 FROM presence_sockets ps
+                       JOIN presence_workers pw ON pw.worker = ps.worker
+                       WHERE ps.user_id = u.id AND ps.worker <> %s
+                         AND pw.heartbeat_at > now() - make_interval(secs => %s)
+                   ) AS is_online,
+                   u.last_seen_at
+            FROM users u WHERE u.id = ANY(%s)
+            """,
+            (self.worker, self.worker_timeout, list(user_ids)),
+        )
+        return {row["id"]: row for row in cur.fetchall()}
+
+    async def run_once(self):
+        dirty, self._dirty = self._dirty, set()
+        user_ids = list(dirty)
+        online = [user_id for user_id in user_ids if user_id in self._sockets]
+        offline = [user_id for user_id in user_ids if user_id not in self._sockets]
+        seen = [self._last_seen[user_id] for user_id in user_ids]
+
+        try:
+            async with get_async_db() as conn:
+                async with conn.transaction():
+                    await conn.execute(
+                        """
+                        INSERT INTO presence_workers (worker, heartbeat_at) VALUES ($1, now())
+                        ON CONFLICT (worker) DO UPDATE SET heartbeat_at = now()
+                        """,
+                        self.worker,
+                    )
+                    if user_ids:
+                        await conn.execute("DELETE FROM presence_sockets WHERE worker = $1 AND user_id = ANY($2::int[])", self.worker, offline)
+                        await conn.execute(
+                            "INSERT INTO presence_sockets (user_id, worker) SELECT unnest($2::int[]), $1 ON CONFLICT DO NOTHING",
+                            self.worker, online,
+                        )
+                        await conn.execute(
+                            f"""
+                            UPDATE users u
+                            SET is_online = {LIVE_SOCKET_SQL.format(user="u.id", timeout="$3")},
+                                last_seen_at = GREATEST(u.last_seen_at, v.last_seen_at)
+                            FROM unnest($1::int[], $2::timestamptz[]) AS v(id, last_seen_at)
+                            WHERE u.id = v.id
+                            """,
+                            user_ids, seen, self.worker_timeout,
+                        )
+                await self.reap(conn)
+        except Exception:
+            self._dirty |= dirty
+            raise
+
+        for user_id in user_ids:
+            if user_id not in self._sockets and user_id not in self._dirty:
+                self._last_seen.pop(user_id, None)
+
+    async def reap(self, conn):
+        # a worker that died without flushing leaves rows behind; once its heartbeat is stale
+        # its users go offline unless another live worker still has them
+        await conn.execute(
+            f"""
+            WITH dead AS (
+                DELETE FROM presence_workers
+                WHERE heartbeat_at < now() - make_interval(secs => $1)
+                RETURNING worker
+            ), gone AS (
+                DELETE FROM presence_sockets WHERE worker IN (SELECT worker FROM dead)
+                RETURNING user_id
+            )
+            UPDATE users u SET is_online = FALSE
+            WHERE u.id IN (SELECT user_id FROM gone) AND NOT {LIVE_SOCKET_SQL.format(user="u.id", timeout="$1")}
+            """,
+            self.worker_timeout,
+        )
+
+    async def stop(self):
+        await super().stop()
+        # anything still connected goes away with this worker; if this fails, reap() on the
+        # other workers cleans up once the heartbeat is stale
+        try:
+            async with get_async_db() as conn:
+                async with conn.transaction():
+                    await conn.execute("DELETE FROM presence_workers WHERE worker = $1", self.worker)
+                    await conn.execute(
+                        f"""
+                        WITH gone AS (DELETE FROM presence_sockets WHERE worker = $1 RETURNING user_id)
+                        UPDATE users u SET is_online = FALSE, last_seen_at = now()
+                        WHERE u.id IN (SELECT user_id FROM gone) AND NOT {LIVE_SOCKET_SQL.format(user="u.id", timeout="$2")}
+                        """,
+                        self.worker, self.worker_timeout,
+                    )
+        except Exception:
+            logger.exception("presence cleanup on shutdown failed")
+
+
+presence = PresenceRegistry(PRESENCE_FLUSH_INTERVAL, PRESENCE_WORKER_TIMEOUT)
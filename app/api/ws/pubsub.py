@@ -0,0 +1,140 @@
+import asyncio
+import json
+import logging
+import uuid
+
+import asyncpg
+
+from app.config import PUBSUB_BACKEND, DB_HOST, DB_PORT, DB_NAME, DB_USER, DB_PASSWORD
+from app.db.async_db import get_async_db
+
+logger = logging.getLogger(__name__)
+
+# NOTIFY payloads must stay under 8000 bytes; bigger events go through pubsub_spill
+NOTIFY_PAYLOAD_LIMIT = 7900
+
+
+class PubSubBackend:
+    def __init__(self):
+        self._handlers: dict[str, list] = {}
+        self._reconnect_hooks: list = []
+
+    def subscribe(self, channel: str, handler):
+        self._handlers.setdefault(channel, []).append(handler)
+
+    def on_reconnect(self, hook):
+        # called after a dropped listener is back; events sent meanwhile were missed, so
+        # anything kept in step by invalidations must be dropped
+        self._reconnect_hooks.append(hook)
+
+    async def _dispatch(self, channel: str, room_id, message: dict):
+        for handler in self._handlers.get(channel, ()):
+            await handler(room_id, message)
+
+    async def publish(self, channel: str, room_id, message: dict):
+        raise NotImplementedError
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+
+class InMemoryPubSub(PubSubBackend):
+    # loopback: everything is delivered inside this process
+    async def publish(self, channel: str, room_id, message: dict):
+        await self._dispatch(channel, room_id, message)
+
+
+class PostgresPubSub(PubSubBackend):
+    def __init__(self):
+        super().__init__()
+        self.origin = uuid.uuid4().hex
+        self._conn: asyncpg.Connection | None = None
+        self._stopping = False
+
+    async def start(self):
+        self._stopping = False
+        await self._listen()
+
+    async def _listen(self):
+        self._conn = await asyncpg.connect(
+            host=DB_HOST,
+            port=int(DB_PORT) if DB_PORT else None,
+            database=DB_NAME,
+            user=DB_USER,
+            password=DB_PASSWORD,
+        )
+        self._conn.add_termination_listener(self._on_terminated)
+        for channel in self._handlers:
+            await self._conn.add_listener(channel, self._on_notify)
+
+    def _on_terminated(self, conn):
+        if not self._stopping:
+            asyncio.get_running_loop().create_task(self._reconnect())
+
+    async def _reconnect(self):
+        delay = 0.5
+        while not self._stopping:
+            try:
+                await self._listen()
+                logger.info("pubsub listener reconnected")
+                for hook in self._reconnect_hooks:
+                    hook()
+                return
+            except (OSError, asyncpg.PostgresError):
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 10)
+
+    async def stop(self):
+        self._stopping = True
+        if self._conn is not None:
+            await self._conn.close()
+            self._conn = None
+
+    async def publish(self, channel: str, room_id, message: dict):
+        # local sockets get it right away, other workers through NOTIFY
+        await self._dispatch(channel, room_id, message)
+
+        payload = json.dumps({"origin": self.origin, "room": room_id, "message": message})
+        async with get_async_db() as conn:
+            if len(payload.encode()) > NOTIFY_PAYLOAD_LIMIT:
+                spill_id = await conn.fetchval(
+                    """
+                    WITH gc AS (DELETE FROM pubsub_spill WHERE created_at < now() - interval '1 minute')
+                    INSERT INTO pubsub_spill (payload) VALUES ($1) RETURNING id
+                    """,
+                    payload,
+                )
+                payload = json.dumps({"origin": self.origin, "spill": spill_id})
+            await conn.execute("SELECT pg_notify($1, $2)", channel, payload)
+
+    def _on_notify(self, conn, pid, channel, payload):
+        data = json.loads(payload)
+        if data.get("origin") == self.origin:
+            return
+        asyncio.get_running_loop().create_task(self._deliver_remote(channel, data))
+
+    async def _deliver_remote(self, channel: str, data: dict):
+        try:
+            if "spill" in data:
+                async with get_async_db() as conn:
+                    payload = await conn.fetchval("SELECT payload FROM pubsub_spill WHERE id = $1", data["spill"])
+                if payload is None:
+                    logger.warning("pubsub spill %s already gone", data["spill"])
+                    return
+                data = json.loads(payload)
+
+            await self._dispatch(channel, data["room"], data["message"])
+        except Exception:
+            logger.exception("pubsub delivery failed on %s", channel)
+
+
+def create_pubsub() -> PubSubBackend:
+    if PUBSUB_BACKEND == "postgres":
+        return PostgresPubSub()
+    return InMemoryPubSub()
+
+
+pubsub = create_pubsub()
@@ -0,0 +1,38 @@
+import anyio
+
+from app.api.cache import message_tail
+from app.api.functions import remember_message, remember_group_message
+from app.api.ws.pubsub import pubsub
+
+# keeps every worker's message_tail in step: new messages arrive with the normal broadcast,
+# REST edits/deletes publish an invalidation on TAIL_CHANNEL
+TAIL_CHANNEL = "message_tail"
+
+
+async def _on_conversation_event(room_id, message: dict):
+    if message.get("type") == "message.new":
+        remember_message(message["data"])
+
+
+async def _on_group_event(room_id, message: dict):
+    if message.get("type") == "group.message.new":
+        remember_group_message(message["data"])
+
+
+async def _on_invalidate(room_id, message: dict):
+    message_tail.invalidate((message["kind"], room_id))
+
+
+pubsub.subscribe("ws_conversations", _on_conversation_event)
+pubsub.subscribe("ws_groups", _on_group_event)
+pubsub.subscribe(TAIL_CHANNEL, _on_invalidate)
+pubsub.on_reconnect(message_tail.clear)
+
+
+async def invalidate_tail(kind: str, room_id: int):
+    await pubsub.publish(TAIL_CHANNEL, room_id, {"kind": kind})
+
+
+def invalidate_tail_from_thread(kind: str, room_id: int):
+    # for the sync REST handlers, which run in anyio worker threads
+    anyio.from_thread.run(invalidate_tail, kind, room_id)
@@ -1,15 +1,92 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, HTTPException
 from starlette.websockets import WebSocket, WebSocketDisconnect
 
-from app.api.functions import get_user_id_from_token, check_conversation, messages_insert_to_db, set_user_online, touch_last_seen, get_recipient_id, mark_delivered, mark_conversation_read
+from app.api.functions import get_user_id_from_token, check_conversation, messages_insert_to_db, get_recipient_id, mark_conversation_read, get_missed_messages, deliveries
+from app.api.metrics import track_ws_event
 from app.api.ws.connection_manager import ConnectionManager
+from app.api.ws.presence import presence
+from app.api.ws.pubsub import pubsub
+from app.config import WS_REPLAY_LIMIT
 
 
-manager = ConnectionManager()
+manager = ConnectionManager("ws_conversations", pubsub, presence, room_kind="conversation")
 
 router = APIRouter()
 
+EVENTS = frozenset({"ping", "message.send", "conversation.read"})
 
+# messages.id is a SERIAL (int4)
+MAX_MESSAGE_ID = 2**31 - 1
+
+
+async def _on_conversation_event(room_id, message: dict):
+    # the sender's worker only sees its own sockets; a recipient on this worker gets the frame
+    # here, so this is where such a message becomes delivered
+    if message.get("type") != "message.new" or message["data"].get("delivered_at"):
+        return
+    sender_id = message["data"]["sender_id"]
+    if any(manager.ws_user.get(ws) != sender_id for ws in manager.active_connections.get(room_id, ())):
+        deliveries.mark(message["data"]["id"])
+
+
+pubsub.subscribe("ws_conversations", _on_conversation_event)
+
+
+async def handle_conversation_event(websocket: WebSocket, conversation_id: int, user_id: int, event_type, data: dict):
+    # shared by /ws/conversations/{id} and the multiplexed /ws endpoint
+    if event_type == "message.send":
+        body = data.get("body")
+        if not body:
+            return
+
+        recipient_id = await get_recipient_id(conversation_id, user_id)
+        delivered = recipient_id is not None and manager.is_user_online(recipient_id)
+
+        msg = await messages_insert_to_db(conversation_id, user_id, body, delivered)
+
+        await manager.broadcast(conversation_id, {"type": "message.new","data": msg})
+
+
+    elif event_type == "conversation.read":
+        last_id = data.get("last_message_id")
+        if not last_id:
+            return
+
+        # client input: anything but a positive int4 would fail in the query and drop the socket
+        try:
+            last_id = int(last_id)
+        except (TypeError, ValueError):
+            last_id = 0
+        if isinstance(data["last_message_id"], bool) or not 0 < last_id <= MAX_MESSAGE_ID:
+            manager.send(websocket, {"type": "conversation.read.error", "detail": "Invalid last_message_id"}, conversation_id)
+            return
+
+        read = await mark_conversation_read(conversation_id, user_id, last_id)
+        if read is None:
+            return
+
+        last_read_id, updated = read
+        await manager.broadcast(conversation_id, {
+            "type": "conversation.read",
+            "data": {
+                "conversation_id": conversation_id,
+                "reader_id": user_id,
+                "last_message_id": last_read_id,
+                "updated_count": updated
+            }
+        })
+
+
+async def replay_missed(websocket: WebSocket, conversation_id: int, after_id: int):
+    # resume-on-reconnect: everything newer than the client's last message as one frame, ahead
+    # of the live events that queued up meanwhile
+    messages, truncated = await get_missed_messages(conversation_id, after_id, WS_REPLAY_LIMIT)
+    if truncated:
+        manager.resume(websocket, {"type": "replay.truncated", "after_id": after_id, "detail": "Too many missed messages, fetch history over REST"}, room=conversation_id)
+        return
+
+    last_id = messages[-1]["id"] if messages else after_id
+    manager.resume(websocket, {"type": "replay", "data": messages, "last_message_id": last_id}, last_id, room=conversation_id)
 
 
 @router.websocket("/ws/conversations/{conversation_id}")
@@ -17,24 +94,32 @@ async def ws_chat(websocket: WebSocket, conversation_id: int):
 
     token = websocket.query_params.get("token")
 
-    user_id = get_user_id_from_token(token)
-
     if not token:
         await websocket.close(code=1008)
         return
 
-    check_conver, _ = check_conversation(conversation_id, user_id)
+    try:
+        user_id = await get_user_id_from_token(token)
+    except HTTPException:
+        await websocket.close(code=1008)
+        return
+
+    check_conver, _ = await check_conversation(conversation_id, user_id)
 
     if not check_conver:
         await websocket.close(code=1008)
 
         return
 
-    await manager.connect(conversation_id, websocket, user_id)
-    set_user_online(user_id, True)
+    last_message_id = websocket.query_params.get("last_message_id")
+    resume_after = int(last_message_id) if last_message_id and last_message_id.isdigit() else None
+
+    await manager.connect(conversation_id, websocket, user_id, paused=resume_after is not None)
 
 
     try:
+        if resume_after is not None:
+            await replay_missed(websocket, conversation_id, resume_after)
 
         while True:
 
@@ -42,44 +127,14 @@ async def ws_chat(websocket: WebSocket, conversation_id: int):
 
             event_type = data.get("type")
 
-            if event_type == "message.send":
-                body = data.get("body")
-                if not body:
-                    continue
-
-                msg = messages_insert_to_db(conversation_id, user_id, body)
-
-                recipient_id = get_recipient_id(conversation_id, user_id)
-                if recipient_id is not None and manager.is_user_online(recipient_id):
-                    delivered_msg = mark_delivered(msg["id"])
-                    if delivered_msg:
-                        msg = delivered_msg
-
-                await manager.broadcast(conversation_id, {"type": "message.new","data": msg})
-
-
-            elif event_type == "conversation.read":
-                last_id = data.get("last_message_id")
-                if not last_id:
-                    continue
-
-                updated = mark_conversation_read(conversation_id, user_id, int(last_id))
-
-                await manager.broadcast(conversation_id, {
-                    "type": "conversation.read",
-                    "data": {
-                        "conversation_id": conversation_id,
-                        "reader_id": user_id,
-                        "last_message_id": int(last_id),
-                        "updated_count": updated
-                    }
-                })
-
-            elif event_type == "ping":
-                await websocket.send_json({"type": "pong"})
+            with track_ws_event("conversation", event_type, EVENTS):
+                if event_type == "ping":
+                    presence.touch(user_id)
+                    manager.send(websocket, {"type": "pong"})
+                else:
+                    await handle_conversation_event(websocket, conversation_id, user_id, event_type, data)
     except WebSocketDisconnect:
         pass
 
     finally:
         manager.disconnect(conversation_id,websocket)
-        set_user_online(user_id, False)
\ No newline at end of file
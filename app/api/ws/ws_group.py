@@ -1,14 +1,53 @@
-import psycopg2
-from fastapi import APIRouter
+from fastapi import APIRouter, HTTPException
 from starlette.websockets import WebSocket, WebSocketDisconnect
 
-from app.api.functions import get_user_id_from_token, check_groups, set_user_online, group_messages_insert_to_db, mark_group_read, is_user_muted_in_group
+from app.api.functions import get_user_id_from_token, check_groups, group_messages_insert_to_db, mark_group_read, is_user_muted_in_group, get_missed_group_messages
+from app.api.metrics import track_ws_event
 from app.api.ws.connection_manager import ConnectionManager
+from app.api.ws.presence import presence
+from app.api.ws.pubsub import pubsub
+from app.config import WS_REPLAY_LIMIT
 
-group_manager = ConnectionManager()
+group_manager = ConnectionManager("ws_groups", pubsub, presence, room_kind="group")
 
 router = APIRouter()
 
+EVENTS = frozenset({"ping", "group.message.sent", "group.read"})
+
+
+async def handle_group_event(websocket: WebSocket, group_id: int, user_id: int, event_type, data: dict):
+    # shared by /ws/groups/{id} and the multiplexed /ws endpoint
+    if event_type == "group.message.sent":
+
+        if await is_user_muted_in_group(group_id, user_id):
+            group_manager.send(websocket, {"type": "group.message.error", "detail": "Muted"}, group_id)
+            return
+
+        body = (data.get("body") or "").strip()
+        if not body:
+            return
+
+        msg = await group_messages_insert_to_db(group_id, user_id, body)
+
+        await group_manager.broadcast(group_id, {"type": "group.message.new", "data": msg}, )
+
+
+    elif event_type == "group.read":
+        await mark_group_read(group_id, user_id)
+        group_manager.send(websocket, {"type": "group.read.ok", "group_id": group_id}, group_id)
+
+
+async def replay_missed(websocket: WebSocket, group_id: int, after_id: int):
+    # resume-on-reconnect: everything newer than the client's last message as one frame, ahead
+    # of the live events that queued up meanwhile
+    messages, truncated = await get_missed_group_messages(group_id, after_id, WS_REPLAY_LIMIT)
+    if truncated:
+        group_manager.resume(websocket, {"type": "replay.truncated", "after_id": after_id, "detail": "Too many missed messages, fetch history over REST"}, room=group_id)
+        return
+
+    last_id = messages[-1]["id"] if messages else after_id
+    group_manager.resume(websocket, {"type": "replay", "data": messages, "last_message_id": last_id}, last_id, room=group_id)
+
 
 @router.websocket('/ws/groups/{group_id}')
 async def web_socker(websocket: WebSocket, group_id: int):
@@ -17,55 +56,45 @@ async def web_socker(websocket: WebSocket, group_id: int):
         await websocket.close(code=1008)
         return
 
-    user_id = get_user_id_from_token(token)
-
+    try:
+        user_id = await get_user_id_from_token(token)
+    except HTTPException:
+        await websocket.close(code=1008)
+        return
 
     if not user_id:
         await websocket.close(code=1008)
         return
 
-    check_group, _ = check_groups(group_id, user_id)
+    check_group, _ = await check_groups(group_id, user_id)
 
     if not check_group:
         await websocket.close(code=1008)
         return
 
-    await group_manager.connect(group_id, websocket, user_id)
-    set_user_online(user_id, True)
+    last_message_id = websocket.query_params.get("last_message_id")
+    resume_after = int(last_message_id) if last_message_id and last_message_id.isdigit() else None
+
+    await group_manager.connect(group_id, websocket, user_id, paused=resume_after is not None)
 
     try:
+        if resume_after is not None:
+            await replay_missed(websocket, group_id, resume_after)
 
         while True:
 
             data = await websocket.receive_json()
             event_type = data.get('type')
 
-            if event_type == "group.message.sent":
-
-                if is_user_muted_in_group(group_id, user_id):
-                    await websocket.send_json({"type": "group.message.error", "detail": "Muted"})
-                    continue
-
-                body = (data.get("body") or "").strip()
-                if not body:
-                    continue
-
-                msg = group_messages_insert_to_db(group_id, user_id, body)
-
-                await group_manager.broadcast(group_id, {"type": "group.message.new", "data": msg}, )
-
-
-            elif event_type == "group.read":
-                mark_group_read(group_id, user_id)
-                await websocket.send_json({"type": "group.read.ok", "group_id": group_id})
-
-            elif event_type == "ping":
-                await websocket.send_json({"type": "pong"})
+            with track_ws_event("group", event_type, EVENTS):
+                if event_type == "ping":
+                    presence.touch(user_id)
+                    group_manager.send(websocket, {"type": "pong"})
+                else:
+                    await handle_group_event(websocket, group_id, user_id, event_type, data)
 
     except WebSocketDisconnect:
         pass
 
     finally:
         group_manager.disconnect(group_id, websocket)
-        if not group_manager.is_user_online(user_id):
-            set_user_online(user_id, False)
\ No newline at end of file
@@ -0,0 +1,125 @@
+from fastapi import APIRouter, HTTPException
+from starlette.websockets import WebSocket, WebSocketDisconnect
+
+from app.api.functions import get_user_id_from_token, get_user_channels
+from app.api.metrics import track_ws_event
+from app.api.ws.outbox import Outbox
+from app.api.ws.presence import presence
+from app.api.ws.ws import manager, handle_conversation_event, EVENTS as CONVERSATION_EVENTS
+from app.api.ws.ws_group import group_manager, handle_group_event, EVENTS as GROUP_EVENTS
+from app.config import WS_SEND_QUEUE_SIZE, WS_OVERFLOW_POLICY
+
+router = APIRouter()
+
+EVENTS = frozenset({"ping", "subscribe", "unsubscribe"}) | CONVERSATION_EVENTS | GROUP_EVENTS
+
+
+def parse_ids(value: str | None) -> list[int] | None:
+    if value is None:
+        return None
+    try:
+        return [int(v) for v in value.split(",") if v.strip()]
+    except ValueError:
+        return []
+
+
+def parse_channels(channels) -> tuple[list[int], list[int]]:
+    conversation_ids, group_ids = [], []
+    for channel in channels or ():
+        kind, _, room = str(channel).partition(":")
+        if not room.isdigit():
+            continue
+        if kind == "conversation":
+            conversation_ids.append(int(room))
+        elif kind == "group":
+            group_ids.append(int(room))
+    return conversation_ids, group_ids
+
+
+def remove_socket(websocket: WebSocket):
+    manager.detach(websocket)
+    group_manager.detach(websocket)
+
+
+def subscribe(websocket: WebSocket, conversation_ids: list[int], group_ids: list[int]) -> list[str]:
+    for conversation_id in conversation_ids:
+        manager.subscribe(conversation_id, websocket)
+    for group_id in group_ids:
+        group_manager.subscribe(group_id, websocket)
+
+    return [manager.channel_name(c) for c in conversation_ids] + [group_manager.channel_name(g) for g in group_ids]
+
+
+@router.websocket("/ws")
+async def ws_multiplex(websocket: WebSocket):
+    # one socket per session for all of the user's chats: token and membership are checked
+    # once for the whole set instead of once per chat socket
+    token = websocket.query_params.get("token")
+
+    if not token:
+        await websocket.close(code=1008)
+        return
+
+    try:
+        user_id = await get_user_id_from_token(token)
+    except HTTPException:
+        await websocket.close(code=1008)
+        return
+
+    # ?conversations=1,2&groups=3 picks a subset; with neither, every chat of the user
+    conversation_ids = parse_ids(websocket.query_params.get("conversations"))
+    group_ids = parse_ids(websocket.query_params.get("groups"))
+    if conversation_ids is not None or group_ids is not None:
+        conversation_ids, group_ids = conversation_ids or [], group_ids or []
+
+    conversation_ids, group_ids = await get_user_channels(user_id, conversation_ids, group_ids)
+
+    await websocket.accept()
+
+    outbox = Outbox(websocket, WS_SEND_QUEUE_SIZE, WS_OVERFLOW_POLICY, on_close=remove_socket)
+    manager.attach(websocket, user_id, outbox)
+    group_manager.attach(websocket, user_id, outbox)
+
+    manager.send(websocket, {"type": "subscribed", "channels": subscribe(websocket, conversation_ids, group_ids)})
+
+    try:
+
+        while True:
+
+            data = await websocket.receive_json()
+            event_type = data.get("type")
+
+            with track_ws_event("mux", event_type, EVENTS):
+                if event_type == "ping":
+                    presence.touch(user_id)
+                    manager.send(websocket, {"type": "pong"})
+
+                elif event_type == "subscribe":
+                    wanted_conversations, wanted_groups = parse_channels(data.get("channels"))
+                    allowed_conversations, allowed_groups = await get_user_channels(user_id, wanted_conversations, wanted_groups)
+                    manager.send(websocket, {"type": "subscribed", "channels": subscribe(websocket, allowed_conversations, allowed_groups)})
+
+                elif event_type == "unsubscribe":
+                    drop_conversations, drop_groups = parse_channels(data.get("channels"))
+                    for conversation_id in drop_conversations:
+                        manager.unsubscribe(conversation_id, websocket)
+                    for group_id in drop_groups:
+                        group_manager.unsubscribe(group_id, websocket)
+                    manager.send(websocket, {"type": "unsubscribed", "channels": data.get("channels") or []})
+
+                else:
+                    channel = data.get("channel")
+                    conversations, groups = parse_channels([channel])
+
+                    if conversations and manager.is_subscribed(conversations[0], websocket):
+                        await handle_conversation_event(websocket, conversations[0], user_id, event_type, data)
+                    elif groups and group_manager.is_subscribed(groups[0], websocket):
+                        await handle_group_event(websocket, groups[0], user_id, event_type, data)
+                    else:
+                        manager.send(websocket, {"type": "error", "detail": "Not subscribed", "channel": channel})
+
+    except WebSocketDisconnect:
+        pass
+
+    finally:
+        remove_socket(websocket)
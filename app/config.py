@@ -13,4 +13,73 @@ DB_HOST = os.getenv('DB_HOST')
 DB_PORT = os.getenv('DB_PORT')
 DB_NAME = os.getenv('DB_NAME')
 DB_USER = os.getenv('DB_USER')
-DB_PASSWORD = os.getenv('DB_PASSWORD')
\ No newline at end of file
+DB_PASSWORD = os.getenv('DB_PASSWORD')
+
+DB_POOL_MIN_SIZE = int(os.getenv('DB_POOL_MIN_SIZE', '2'))
+DB_POOL_MAX_SIZE = int(os.getenv('DB_POOL_MAX_SIZE', '20'))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '5'))
+DB_POOL_MAX_LIFETIME = float(os.getenv('DB_POOL_MAX_LIFETIME', '1800'))
+# asyncpg pool only: idle connections above DB_POOL_MIN_SIZE are closed after this many seconds
+DB_POOL_MAX_IDLE = float(os.getenv('DB_POOL_MAX_IDLE', '300'))
+DB_POOL_HEALTH_CHECK_AFTER = float(os.getenv('DB_POOL_HEALTH_CHECK_AFTER', '30'))
+
+# statements slower than DB_SLOW_QUERY_MS are logged (0 disables); a REST request or WS event that runs
+# more than DB_QUERY_BUDGET statements (0 disables) is logged, or fails with DB_QUERY_BUDGET_MODE=raise (tests)
+DB_SLOW_QUERY_MS = float(os.getenv('DB_SLOW_QUERY_MS', '200'))
+DB_QUERY_BUDGET = int(os.getenv('DB_QUERY_BUDGET', '20'))
+DB_QUERY_BUDGET_MODE = os.getenv('DB_QUERY_BUDGET_MODE', 'log')
+
+
+TOKEN_CACHE_SIZE = int(os.getenv('TOKEN_CACHE_SIZE', '10000'))
+TOKEN_CACHE_TTL = float(os.getenv('TOKEN_CACHE_TTL', '60'))
+
+# expired rows are deleted from `tokens` every TOKEN_SWEEP_INTERVAL seconds, TOKEN_SWEEP_BATCH_SIZE per transaction
+TOKEN_SWEEP_INTERVAL = float(os.getenv('TOKEN_SWEEP_INTERVAL', '60'))
+TOKEN_SWEEP_BATCH_SIZE = int(os.getenv('TOKEN_SWEEP_BATCH_SIZE', '1000'))
+
+# db: every request needs its row in `tokens` (cached), stateless: trust the signed JWT and only
+# check the in-memory revocation denylist, which is synced from `token_revocations`
+TOKEN_VALIDATION = os.getenv('TOKEN_VALIDATION', 'db')
+TOKEN_DENYLIST_CAPACITY = int(os.getenv('TOKEN_DENYLIST_CAPACITY', '100000'))
+TOKEN_REVOCATION_SYNC_INTERVAL = float(os.getenv('TOKEN_REVOCATION_SYNC_INTERVAL', '1'))
+
+MEMBERSHIP_CACHE_SIZE = int(os.getenv('MEMBERSHIP_CACHE_SIZE', '50000'))
+MEMBERSHIP_CACHE_TTL = float(os.getenv('MEMBERSHIP_CACHE_TTL', '30'))
+
+GROUP_ACTIVITY_FLUSH_INTERVAL = float(os.getenv('GROUP_ACTIVITY_FLUSH_INTERVAL', '2'))
+
+# memory: single worker / tests, postgres: LISTEN/NOTIFY fan-out across workers
+PUBSUB_BACKEND = os.getenv('PUBSUB_BACKEND', 'memory')
+# uvicorn --workers default; per-worker in-memory state is only safe with the memory backend when 1
+WORKERS = int(os.getenv('WEB_CONCURRENCY', '1'))
+
+# per-socket outbound queue; on overflow: drop_oldest | disconnect | coalesce
+WS_SEND_QUEUE_SIZE = int(os.getenv('WS_SEND_QUEUE_SIZE', '256'))
+WS_OVERFLOW_POLICY = os.getenv('WS_OVERFLOW_POLICY', 'drop_oldest')
+
+PRESENCE_FLUSH_INTERVAL = float(os.getenv('PRESENCE_FLUSH_INTERVAL', '5'))
+# a worker whose presence heartbeat is older than this is treated as gone; keep it well above the flush interval
+PRESENCE_WORKER_TIMEOUT = float(os.getenv('PRESENCE_WORKER_TIMEOUT', '30'))
+
+READ_RECEIPT_FLUSH_INTERVAL = float(os.getenv('READ_RECEIPT_FLUSH_INTERVAL', '1'))
+
+# direct: one INSERT + commit per WS message, batch: group commit through a batching writer
+INGEST_MODE = os.getenv('INGEST_MODE', 'direct')
+INGEST_BATCH_SIZE = int(os.getenv('INGEST_BATCH_SIZE', '200'))
+INGEST_BATCH_MAX_DELAY = float(os.getenv('INGEST_BATCH_MAX_DELAY', '0.005'))
+
+# newest messages kept in memory per conversation/group for first-page history (0 disables)
+MESSAGE_TAIL_SIZE = int(os.getenv('MESSAGE_TAIL_SIZE', '100'))
+MESSAGE_TAIL_MAX_BYTES = int(os.getenv('MESSAGE_TAIL_MAX_BYTES', str(32 * 1024 * 1024)))
+
+# most messages replayed to a reconnecting socket; beyond that the client reloads over REST
+WS_REPLAY_LIMIT = int(os.getenv('WS_REPLAY_LIMIT', '500'))
+
+# new hashes use PASSWORD_SCHEME (any passlib scheme) with PASSWORD_ROUNDS (0 = scheme default);
+# older hashes are upgraded on the next successful login
+PASSWORD_SCHEME = os.getenv('PASSWORD_SCHEME', 'sha256_crypt')
+PASSWORD_ROUNDS = int(os.getenv('PASSWORD_ROUNDS', '0'))
+# hashing runs in its own process pool so it never holds the GIL of the API worker
+PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', '2'))
+PASSWORD_HASH_CONCURRENCY = int(os.getenv('PASSWORD_HASH_CONCURRENCY', '32'))
+PASSWORD_HASH_TIMEOUT = float(os.getenv('PASSWORD_HASH_TIMEOUT', '10'))
@@ -0,0 +1,68 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+
+import asyncpg
+
+from app.config import DB_HOST, DB_PORT, DB_NAME, DB_USER, DB_PASSWORD, DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE, DB_POOL_TIMEOUT, DB_POOL_MAX_LIFETIME, DB_POOL_MAX_IDLE
+from app.db.instrument import InstrumentedConnection
+
+_pool: asyncpg.Pool | None = None
+_pool_lock = asyncio.Lock()
+_expired_at = 0.0
+
+
+async def get_async_pool() -> asyncpg.Pool:
+    global _pool, _expired_at
+    if _pool is None:
+        async with _pool_lock:
+            if _pool is None:
+                _pool = await asyncpg.create_pool(
+                    host=DB_HOST,
+                    port=int(DB_PORT) if DB_PORT else None,
+                    database=DB_NAME,
+                    user=DB_USER,
+                    password=DB_PASSWORD,
+                    min_size=DB_POOL_MIN_SIZE,
+                    max_size=DB_POOL_MAX_SIZE,
+                    max_inactive_connection_lifetime=DB_POOL_MAX_IDLE,
+                    connection_class=InstrumentedConnection,
+                )
+                _expired_at = time.monotonic()
+    return _pool
+
+
+async def close_async_pool():
+    global _pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
+
+
+def async_pool_stats() -> dict | None:
+    if _pool is None:
+        return None
+
+    size = _pool.get_size()
+    idle = _pool.get_idle_size()
+    return {
+        "min_size": _pool.get_min_size(),
+        "max_size": _pool.get_max_size(),
+        "in_use": size - idle,
+        "idle": idle,
+    }
+
+
+@asynccontextmanager
+async def get_async_db():
+    global _expired_at
+    pool = await get_async_pool()
+
+    # asyncpg has no max-age setting: every DB_POOL_MAX_LIFETIME seconds all connections are marked
+    # expired and get replaced on their next release/acquire, so none outlives the lifetime by much
+    if DB_POOL_MAX_LIFETIME and time.monotonic() - _expired_at > DB_POOL_MAX_LIFETIME:
+        _expired_at = time.monotonic()
+        await pool.expire_connections()
+
+    async with pool.acquire(timeout=DB_POOL_TIMEOUT) as conn:
+        yield conn
@@ -1,14 +1,222 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
 import psycopg2
+from psycopg2 import extensions
 
-from app.config import DB_HOST, DB_PORT, DB_NAME, DB_USER, DB_PASSWORD
-from psycopg2.extras import RealDictCursor
+from app.config import DB_HOST, DB_PORT, DB_NAME, DB_USER, DB_PASSWORD, DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE, DB_POOL_TIMEOUT, DB_POOL_MAX_LIFETIME, DB_POOL_HEALTH_CHECK_AFTER
+from app.db.instrument import InstrumentedCursor
 
-def get_db():
-    conn = psycopg2.connect(host=DB_HOST,port=DB_PORT,dbname=DB_NAME,user=DB_USER,password=DB_PASSWORD)
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    return conn, cur
 
+class PoolTimeout(Exception):
+    pass
+
+
+class _PooledConnection:
+    def __init__(self, conn):
+        self.conn = conn
+        self.created_at = time.monotonic()
+        self.returned_at = self.created_at
+
+
+class ConnectionPool:
+    def __init__(self, min_size: int, max_size: int, timeout: float, max_lifetime: float, health_check_after: float, **conn_kwargs):
+        self.min_size = min_size
+        self.max_size = max(max_size, 1)
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.health_check_after = health_check_after
+        self.conn_kwargs = conn_kwargs
+
+        self._idle: deque[_PooledConnection] = deque()
+        self._in_use: dict[int, _PooledConnection] = {}
+        self._opening = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+        self._checkouts = 0
+        self._waits = 0
+        self._wait_time_total = 0.0
+        self._wait_time_max = 0.0
+        self._timeouts = 0
+        self._discarded = 0
+
+        for _ in range(min(min_size, self.max_size)):
+            self._idle.append(self._open())
+
+    def _open(self) -> _PooledConnection:
+        return _PooledConnection(psycopg2.connect(**self.conn_kwargs))
+
+    def _discard(self, pooled: _PooledConnection):
+        self._discarded += 1
+        try:
+            pooled.conn.close()
+        except Exception:
+            pass
+
+    def _is_usable(self, pooled: _PooledConnection) -> bool:
+        if pooled.conn.closed:
+            return False
+
+        now = time.monotonic()
+        if self.max_lifetime and now - pooled.created_at > self.max_lifetime:
+            return False
+
+        if now - pooled.returned_at >= self.health_check_after:
+            try:
+                with pooled.conn.cursor() as cur:
+                    cur.execute("SELECT 1")
+                pooled.conn.rollback()
+            except psycopg2.Error:
+                return False
+
+        return True
+
+    def getconn(self):
+        started = time.monotonic()
+        deadline = started + self.timeout
+        waited = False
+
+        while True:
+            with self._cond:
+                if self._closed:
+                    raise PoolTimeout("Connection pool is closed")
+
+                pooled = None
+                open_new = False
+
+                while pooled is None and not open_new:
+                    if self._idle:
+                        pooled = self._idle.pop()
+                        self._in_use[id(pooled.conn)] = pooled
+                    elif len(self._in_use) + self._opening < self.max_size:
+                        self._opening += 1
+                        open_new = True
+                    else:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self._timeouts += 1
+                            raise PoolTimeout(f"Timed out after {self.timeout}s waiting for a database connection")
+                        waited = True
+                        self._cond.wait(remaining)
+
+            if open_new:
+                try:
+                    pooled = self._open()
+                finally:
+                    with self._cond:
+                        self._opening -= 1
+                        if pooled is None:
+                            self._cond.notify()
+                        else:
+                            self._in_use[id(pooled.conn)] = pooled
+            elif not self._is_usable(pooled):
+                with self._cond:
+                    self._in_use.pop(id(pooled.conn), None)
+                    self._discard(pooled)
+                    self._cond.notify()
+                continue
 
-def close_db(conn, cur):
-    cur.close()
-    conn.close()
\ No newline at end of file
+            wait_time = time.monotonic() - started
+            with self._cond:
+                self._checkouts += 1
+                if waited:
+                    self._waits += 1
+                self._wait_time_total += wait_time
+                self._wait_time_max = max(self._wait_time_max, wait_time)
+
+            return pooled.conn
+
+    def putconn(self, conn):
+        with self._cond:
+            pooled = self._in_use.get(id(conn))
+        if pooled is None:
+            return
+
+        broken = conn.closed or conn.get_transaction_status() == extensions.TRANSACTION_STATUS_UNKNOWN
+        if not broken and conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                broken = True
+
+        expired = self.max_lifetime and time.monotonic() - pooled.created_at > self.max_lifetime
+
+        with self._cond:
+            self._in_use.pop(id(conn), None)
+            if broken or expired or self._closed:
+                self._discard(pooled)
+            else:
+                pooled.returned_at = time.monotonic()
+                self._idle.append(pooled)
+
+            self._cond.notify()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            while self._idle:
+                self._discard(self._idle.pop())
+            self._cond.notify_all()
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "in_use": len(self._in_use),
+                "idle": len(self._idle),
+                "opening": self._opening,
+                "checkouts": self._checkouts,
+                "waits": self._waits,
+                "timeouts": self._timeouts,
+                "discarded": self._discarded,
+                "wait_time_avg_ms": round(self._wait_time_total / self._checkouts * 1000, 3) if self._checkouts else 0.0,
+                "wait_time_max_ms": round(self._wait_time_max * 1000, 3),
+            }
+
+
+_pool: ConnectionPool | None = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(
+                    min_size=DB_POOL_MIN_SIZE,
+                    max_size=DB_POOL_MAX_SIZE,
+                    timeout=DB_POOL_TIMEOUT,
+                    max_lifetime=DB_POOL_MAX_LIFETIME,
+                    health_check_after=DB_POOL_HEALTH_CHECK_AFTER,
+                    host=DB_HOST, port=DB_PORT, dbname=DB_NAME, user=DB_USER, password=DB_PASSWORD,
+                )
+    return _pool
+
+
+def close_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+
+
+def pool_stats() -> dict | None:
+    return _pool.stats() if _pool is not None else None
+
+
+@contextmanager
+def get_db():
+    pool = get_pool()
+    conn = pool.getconn()
+    cur = conn.cursor(cursor_factory=InstrumentedCursor)
+    try:
+        yield conn, cur
+    finally:
+        cur.close()
+        pool.putconn(conn)
@@ -0,0 +1,135 @@
+import logging
+import re
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import lru_cache
+
+import asyncpg
+from psycopg2.extras import RealDictCursor
+
+from app.config import DB_SLOW_QUERY_MS, DB_QUERY_BUDGET, DB_QUERY_BUDGET_MODE
+
+logger = logging.getLogger(__name__)
+
+# statements run by the current REST request or WS event; both cursors below record into it.
+# Sync routes run in worker threads, which get a copy of the context pointing at the same scope.
+_scope: ContextVar["QueryScope | None"] = ContextVar("query_scope", default=None)
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+@lru_cache(maxsize=1024)
+def normalize_sql(sql: str) -> str:
+    # statements are parameterized already; this folds whitespace and any inline literals
+    return " ".join(_LITERALS.sub("?", sql).split())
+
+
+class QueryScope:
+    def __init__(self, label: str | None = None):
+        self.label = label
+        self.statements = 0
+        self.seconds = 0.0
+        self.by_sql: dict[str, list] = {}  # normalized sql -> [count, seconds]
+
+    def record(self, sql: str, elapsed: float):
+        self.statements += 1
+        self.seconds += elapsed
+        entry = self.by_sql.get(sql)
+        if entry is None:
+            self.by_sql[sql] = [1, elapsed]
+        else:
+            entry[0] += 1
+            entry[1] += elapsed
+
+    def over_budget(self) -> bool:
+        return DB_QUERY_BUDGET > 0 and self.statements > DB_QUERY_BUDGET
+
+    def summary(self, top: int = 3) -> str:
+        repeated = sorted(self.by_sql.items(), key=lambda kv: kv[1][0], reverse=True)[:top]
+        return "; ".join(f"{count}x {sql[:200]}" for sql, (count, _) in repeated)
+
+
+def record_query(query, elapsed: float):
+    sql = normalize_sql(query if isinstance(query, str) else str(query))
+    scope = _scope.get()
+
+    if DB_SLOW_QUERY_MS and elapsed * 1000 >= DB_SLOW_QUERY_MS:
+        logger.warning("slow query %.1fms%s: %s", elapsed * 1000, f" in {scope.label}" if scope and scope.label else "", sql)
+
+    if scope is not None:
+        scope.record(sql, elapsed)
+
+
+@contextmanager
+def query_scope(label: str | None = None):
+    scope = QueryScope(label)
+    token = _scope.set(scope)
+    try:
+        yield scope
+    finally:
+        _scope.reset(token)
+
+    if scope.over_budget():
+        message = f"{scope.label} ran {scope.statements} statements (budget {DB_QUERY_BUDGET}, {scope.seconds * 1000:.1f}ms): {scope.summary()}"
+        if DB_QUERY_BUDGET_MODE == "raise":
+            raise QueryBudgetExceeded(message)
+        logger.warning(message)
+
+
+class InstrumentedCursor(RealDictCursor):
+    def execute(self, query, vars=None):
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            record_query(query, time.perf_counter() - started)
+
+    def executemany(self, query, vars_list):
+        started = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            record_query(query, time.perf_counter() - started)
+
+
+class InstrumentedConnection(asyncpg.Connection):
+    # the asyncpg side of the same bookkeeping, used as the pool's connection_class
+    async def execute(self, query, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await super().execute(query, *args, **kwargs)
+        finally:
+            record_query(query, time.perf_counter() - started)
+
+    async def executemany(self, command, args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await super().executemany(command, args, **kwargs)
+        finally:
+            record_query(command, time.perf_counter() - started)
+
+    async def fetch(self, query, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await super().fetch(query, *args, **kwargs)
+        finally:
+            record_query(query, time.perf_counter() - started)
+
+    async def fetchrow(self, query, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await super().fetchrow(query, *args, **kwargs)
+        finally:
+            record_query(query, time.perf_counter() - started)
+
+    async def fetchval(self, query, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await super().fetchval(query, *args, **kwargs)
+        finally:
+            record_query(query, time.perf_counter() - started)
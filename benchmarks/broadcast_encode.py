@@ -0,0 +1,88 @@
+# CPU per broadcast message vs room size: per-socket JSON encoding against encode-once frames.
+#
+#   python -m benchmarks.broadcast_encode --messages 200
+#
+# Runs in-process with stub sockets (no network, no database). Both modes go
+# through the same outbox/writer path, so the difference is serialization only.
+import argparse
+import asyncio
+import json
+import time
+
+from app.api.ws.connection_manager import ConnectionManager
+from app.api.ws.frames import orjson
+from app.api.ws.outbox import coalesce_key
+from benchmarks.report import emit
+
+ROOM_SIZES = [10, 100, 500, 2000]
+
+MESSAGE = {
+    "type": "group.message.new",
+    "data": {
+        "id": 123456,
+        "group_id": 42,
+        "sender_id": 7,
+        "sender_name": "ali",
+        "content": "hello everyone, this is a reasonably sized chat message 👋" * 2,
+        "created_at": "2026-01-13T17:00:29.317890+00:00",
+        "is_mute": False,
+    },
+}
+
+
+class StubSocket:
+    sent = 0
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, data):
+        StubSocket.sent += 1
+
+
+class PerSocketEncodingManager(ConnectionManager):
+    # the old behaviour: send_json serialized the event once per recipient
+    async def deliver(self, conversation_id, message):
+        key = coalesce_key(message)
+        for websocket in self.active_connections.get(conversation_id, ()):
+            self.outboxes[websocket].put(json.dumps(message, separators=(",", ":"), ensure_ascii=False), key)
+
+
+async def run(manager: ConnectionManager, room_size: int, messages: int) -> float:
+    for i in range(room_size):
+        await manager.connect(1, StubSocket(), i)
+
+    StubSocket.sent = 0
+    t0 = time.process_time()
+    for i in range(messages):
+        await manager.broadcast(1, MESSAGE)
+        # let the writer tasks drain
+        while StubSocket.sent < (i + 1) * room_size:
+            await asyncio.sleep(0)
+    elapsed = time.process_time() - t0
+
+    for websocket in list(manager.outboxes):
+        manager.disconnect(1, websocket)
+    return elapsed
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=200)
+    args = parser.parse_args()
+
+    results = []
+    for room_size in ROOM_SIZES:
+        per_socket_s = await run(PerSocketEncodingManager(), room_size, args.messages)
+        encode_once_s = await run(ConnectionManager(), room_size, args.messages)
+        results.append({
+            "room_size": room_size,
+            "per_socket_cpu_us_per_message": round(per_socket_s / args.messages * 1e6, 1),
+            "encode_once_cpu_us_per_message": round(encode_once_s / args.messages * 1e6, 1),
+        })
+
+    emit({"benchmark": "broadcast_encode", "encoder": "orjson" if orjson else "json", "messages": args.messages, "results": results})
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,47 @@
+import uuid
+
+from app.db.db import get_db
+
+
+def create_users(count: int) -> list[int]:
+    prefix = f"bench_{uuid.uuid4().hex[:8]}"
+    with get_db() as (conn, cur):
+        cur.execute(
+            """
+            INSERT INTO users (username, email, password_hash)
+            SELECT %s || '_' || i, %s || '_' || i || '@bench.local', 'x'
+            FROM generate_series(1, %s) AS i
+            RETURNING id
+            """,
+            (prefix, prefix, count),
+        )
+        ids = [r["id"] for r in cur.fetchall()]
+        conn.commit()
+    return ids
+
+
+def create_conversation(user_a: int, user_b: int) -> int:
+    with get_db() as (conn, cur):
+        cur.execute(
+            "INSERT INTO conversations (user1_id, user2_id) VALUES (%s, %s) RETURNING id",
+            (min(user_a, user_b), max(user_a, user_b)),
+        )
+        conversation_id = cur.fetchone()["id"]
+        conn.commit()
+    return conversation_id
+
+
+def drop_users(user_ids: list[int]):
+    with get_db() as (conn, cur):
+        cur.execute(
+            "DELETE FROM messages WHERE conversation_id IN (SELECT id FROM conversations WHERE user1_id = ANY(%s) OR user2_id = ANY(%s))",
+            (user_ids, user_ids),
+        )
+        cur.execute("DELETE FROM conversation_reads WHERE user_id = ANY(%s)", (user_ids,))
+        cur.execute("DELETE FROM conversations WHERE user1_id = ANY(%s) OR user2_id = ANY(%s)", (user_ids, user_ids))
+        cur.execute("DELETE FROM groups WHERE owner_id = ANY(%s)", (user_ids,))
+        cur.execute("DELETE FROM group_messages WHERE sender_id = ANY(%s)", (user_ids,))
+        cur.execute("DELETE FROM tokens WHERE user_id = ANY(%s)", (user_ids,))
+        cur.execute("DELETE FROM users WHERE id = ANY(%s)", (user_ids,))
+        conn.commit()
+
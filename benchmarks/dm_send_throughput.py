@@ -0,0 +1,76 @@
+# Messages/sec per worker on the DM send path.
+#
+#   python -m benchmarks.dm_send_throughput --concurrency 20 --messages 5000
+#
+# "legacy" is INSERT, recipient lookup, then UPDATE delivered_at (three round
+# trips, the row is written twice); "fused" is the single INSERT used by ws_chat.
+import argparse
+import asyncio
+import time
+
+from app.api import functions
+from app.db.async_db import get_async_db, close_async_pool
+from app.db.db import close_pool
+from benchmarks.common import create_users, create_conversation, drop_users
+from benchmarks.report import emit
+
+
+async def legacy_send(conversation_id: int, sender_id: int, body: str):
+    async with get_async_db() as conn:
+        message_id = await conn.fetchval(
+            "INSERT INTO messages (conversation_id, sender_id, body) VALUES ($1, $2, $3) RETURNING id",
+            conversation_id, sender_id, body,
+        )
+    async with get_async_db() as conn:
+        await conn.fetchrow("SELECT user1_id, user2_id FROM conversations WHERE id = $1", conversation_id)
+    async with get_async_db() as conn:
+        await conn.fetchrow(
+            "UPDATE messages SET delivered_at = now() WHERE id = $1 AND delivered_at IS NULL RETURNING *",
+            message_id,
+        )
+
+
+async def fused_send(conversation_id: int, sender_id: int, body: str):
+    await functions.get_recipient_id(conversation_id, sender_id)
+    await functions.messages_insert_to_db(conversation_id, sender_id, body, delivered=True)
+
+
+async def run(name, send, concurrency: int, messages: int, conversation_id: int, sender_id: int) -> dict:
+    queue = asyncio.Queue()
+    for i in range(messages):
+        queue.put_nowait(i)
+
+    async def worker():
+        while not queue.empty():
+            i = queue.get_nowait()
+            await send(conversation_id, sender_id, f"bench {i}")
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    return {"path": name, "messages": messages, "concurrency": concurrency, "seconds": round(elapsed, 3), "messages_per_sec": round(messages / elapsed, 1)}
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--messages", type=int, default=5000)
+    args = parser.parse_args()
+
+    user_ids = create_users(2)
+    conversation_id = create_conversation(*user_ids)
+    try:
+        results = [
+            await run("legacy", legacy_send, args.concurrency, args.messages, conversation_id, user_ids[0]),
+            await run("fused", fused_send, args.concurrency, args.messages, conversation_id, user_ids[0]),
+        ]
+        emit({"benchmark": "dm_send_throughput", "results": results})
+    finally:
+        drop_users(user_ids)
+        await close_async_pool()
+        close_pool()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
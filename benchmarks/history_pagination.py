@@ -0,0 +1,90 @@
+# History page fetch time vs scroll depth: OFFSET paging against keyset (before_id).
+#
+#   python -m benchmarks.history_pagination --rows 1000000 --limit 100
+#
+# Seeds one conversation with --rows messages (half of them read by the peer), then
+# times GET /messages/{conversation_id}'s MESSAGE_SELECT at increasing depths.
+import argparse
+import time
+
+from app.api.messages import MESSAGE_SELECT
+from app.db.db import get_db, close_pool
+from benchmarks.common import create_users, create_conversation, drop_users
+from benchmarks.report import emit
+
+DEPTHS = [0, 1_000, 10_000, 100_000, 500_000, 900_000]
+
+
+def seed(conversation_id: int, sender_id: int, reader_id: int, rows: int):
+    with get_db() as (conn, cur):
+        cur.execute(
+            """
+            INSERT INTO messages (conversation_id, sender_id, body, created_at)
+            SELECT %s, %s, 'bench ' || i, now() - make_interval(secs => %s - i)
+            FROM generate_series(1, %s) AS i
+            """,
+            (conversation_id, sender_id, rows, rows),
+        )
+        # read watermark halfway, so read_at comes from both sides of the join
+        cur.execute(
+            """
+            INSERT INTO conversation_reads (conversation_id, user_id, last_read_message_id, read_at)
+            SELECT %s, %s, (SELECT min(id) + %s / 2 FROM messages WHERE conversation_id = %s), now()
+            """,
+            (conversation_id, reader_id, rows, conversation_id),
+        )
+        cur.execute("ANALYZE messages")
+        conn.commit()
+
+
+def timed(cur, sql: str, params: tuple, repeat: int) -> tuple[float, list]:
+    best = float("inf")
+    rows = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        cur.execute(sql, params)
+        rows = cur.fetchall()
+        best = min(best, time.perf_counter() - t0)
+    return best, rows
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--limit", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    user_ids = create_users(2)
+    conversation_id = create_conversation(*user_ids)
+    try:
+        seed(conversation_id, user_ids[0], user_ids[1], args.rows)
+
+        results = []
+        with get_db() as (conn, cur):
+            cur.execute("SELECT id FROM messages WHERE conversation_id = %s ORDER BY id DESC", (conversation_id,))
+            ids = [r["id"] for r in cur.fetchall()]
+
+            for depth in [d for d in DEPTHS if d < args.rows]:
+                offset_s, _ = timed(
+                    cur,
+                    MESSAGE_SELECT + "WHERE m.conversation_id = %s ORDER BY m.created_at DESC LIMIT %s OFFSET %s",
+                    (conversation_id, args.limit, depth),
+                    args.repeat,
+                )
+                keyset_s, _ = timed(
+                    cur,
+                    MESSAGE_SELECT + "WHERE m.conversation_id = %s AND m.id < %s ORDER BY m.id DESC LIMIT %s",
+                    (conversation_id, ids[depth - 1] if depth else ids[0] + 1, args.limit + 1),
+                    args.repeat,
+                )
+                results.append({"depth": depth, "offset_ms": round(offset_s * 1000, 3), "keyset_ms": round(keyset_s * 1000, 3)})
+
+        emit({"benchmark": "history_pagination", "rows": args.rows, "limit": args.limit, "results": results})
+    finally:
+        drop_users(user_ids)
+        close_pool()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+# Messages/sec for WS message writes: messages_insert_to_db / group_messages_insert_to_db
+# with one INSERT + commit per message ("direct")
+# versus the group-commit writer ("batch", INGEST_MODE=batch).
+#
+#   python -m benchmarks.ingest_throughput --senders 200 --messages 20 --batch-size 200 --max-delay 0.005
+#
+# Every sender awaits its own write before sending the next one, like a socket
+# handler does. completed_in_id_order tells whether writes finished (and would be
+# broadcast) in the order their ids were assigned within each conversation.
+import argparse
+import asyncio
+import time
+
+from app.api import functions
+from app.api.background import BatchWriter
+from app.db.async_db import close_async_pool
+from app.db.db import get_db, close_pool
+from benchmarks.common import create_users, create_conversation, drop_users
+from benchmarks.report import summarize_ms, emit
+
+
+def create_group(owner_id: int) -> int:
+    with get_db() as (conn, cur):
+        cur.execute(
+            """
+            WITH g AS (
+                INSERT INTO groups (name, owner_id) VALUES ('bench', %s) RETURNING id
+            )
+            INSERT INTO group_members (group_id, user_id, role)
+            SELECT id, %s, 'owner' FROM g
+            RETURNING group_id
+            """,
+            (owner_id, owner_id),
+        )
+        group_id = cur.fetchone()["group_id"]
+        conn.commit()
+    return group_id
+
+
+async def run(name: str, send, senders: int, messages: int, conversations: list[int]) -> dict:
+    latencies: list[float] = []
+    ids: dict[int, list[int]] = {c: [] for c in conversations}
+
+    async def sender(n: int):
+        conversation_id = conversations[n % len(conversations)]
+        for i in range(messages):
+            t0 = time.perf_counter()
+            msg = await send(conversation_id, f"bench {n}/{i}")
+            latencies.append(time.perf_counter() - t0)
+            ids[conversation_id].append(msg["id"])
+
+    started = time.perf_counter()
+    await asyncio.gather(*(sender(n) for n in range(senders)))
+    elapsed = time.perf_counter() - started
+
+    total = senders * messages
+    return {
+        "path": name,
+        "messages": total,
+        "senders": senders,
+        "seconds": round(elapsed, 3),
+        "messages_per_sec": round(total / elapsed, 1),
+        "completed_in_id_order": all(v == sorted(v) for v in ids.values()),
+        "latency": summarize_ms(latencies),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--senders", type=int, default=200)
+    parser.add_argument("--messages", type=int, default=20)
+    parser.add_argument("--conversations", type=int, default=20)
+    parser.add_argument("--batch-size", type=int, default=200)
+    parser.add_argument("--max-delay", type=float, default=0.005)
+    args = parser.parse_args()
+
+    user_ids = create_users(args.conversations + 1)
+    sender_id = user_ids[0]
+    conversations = [create_conversation(sender_id, peer) for peer in user_ids[1:]]
+    group_id = create_group(sender_id)
+
+    dm_batch = BatchWriter(functions.messages_insert_batch, args.batch_size, args.max_delay)
+    group_batch = BatchWriter(functions.group_messages_insert_batch, args.batch_size, args.max_delay)
+    dm_batch.start()
+    group_batch.start()
+
+    # the direct baseline is the route's own unbatched write path, whatever INGEST_MODE says
+    functions.INGEST_MODE = "direct"
+
+    async def dm_direct(conversation_id, body):
+        return await functions.messages_insert_to_db(conversation_id, sender_id, body)
+
+    async def group_direct(_, body):
+        return await functions.group_messages_insert_to_db(group_id, sender_id, body)
+
+    try:
+        results = [
+            await run("dm_direct", dm_direct, args.senders, args.messages, conversations),
+            await run("dm_batch", lambda c, b: dm_batch.submit(c, sender_id, b, False), args.senders, args.messages, conversations),
+            await run("group_direct", group_direct, args.senders, args.messages, [group_id]),
+            await run("group_batch", lambda _, b: group_batch.submit(group_id, sender_id, b), args.senders, args.messages, [group_id]),
+        ]
+        emit({"benchmark": "ingest_throughput", "batch_size": args.batch_size, "max_delay": args.max_delay, "results": results})
+    finally:
+        await dm_batch.stop()
+        await group_batch.stop()
+        await functions.group_activity.run_once()
+        drop_users(user_ids)
+        await close_async_pool()
+        close_pool()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,272 @@
+# End-to-end load test against a running server: REST setup through the real routers, then
+# every user on WebSockets sending and reading at fixed rates.
+#
+#   python -m benchmarks.load_test --url http://127.0.0.1:7722 --users 200 --group-size 20 \
+#       --duration 30 --send-rate 1 --read-rate 0.2 --out load.json
+#
+# Users are paired into conversations (/ws/conversations/{id}) and split into groups of
+# --group-size (/ws/groups/{id}); each user holds one socket per chat. Every message body
+# carries its send time, so delivery latency is measured per receiving socket (sender and
+# receivers share this process's clock). "echo" is the sender's own copy of the broadcast.
+# Only HTTP/WS is used; the database is touched only with --cleanup.
+import argparse
+import asyncio
+import json
+import random
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+
+import jwt
+import websockets
+
+from benchmarks.report import summarize_ms, emit
+
+PASSWORD = "load-test-password"
+
+
+class Stats:
+    def __init__(self):
+        self.rest: dict[str, list[float]] = {}
+        self.rest_errors: dict[str, int] = {}
+        self.connect: list[float] = []
+        self.connect_errors = 0
+        self.delivery: dict[str, list[float]] = {"conversation": [], "group": []}
+        self.echo: dict[str, list[float]] = {"conversation": [], "group": []}
+        self.sent: dict[str, int] = {"conversation": 0, "group": 0}
+        self.expected: dict[str, int] = {"conversation": 0, "group": 0}
+        self.reads = 0
+        self.errors: dict[str, int] = {}
+
+
+class Api:
+    def __init__(self, url: str, stats: Stats, concurrency: int):
+        self.url = url.rstrip("/")
+        self.stats = stats
+        self.slots = asyncio.Semaphore(concurrency)
+
+    def _call(self, method: str, path: str, body: bytes | None, headers: dict):
+        request = urllib.request.Request(self.url + path, data=body, method=method, headers=headers)
+        with urllib.request.urlopen(request, timeout=60) as response:
+            return json.loads(response.read())
+
+    async def request(self, route: str, method: str, path: str, json_body=None, form=None, token: str | None = None):
+        headers = {}
+        body = None
+        if json_body is not None:
+            body = json.dumps(json_body).encode()
+            headers["Content-Type"] = "application/json"
+        if form is not None:
+            body = urllib.parse.urlencode(form).encode()
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+        if token:
+            headers["Authorization"] = f"Bearer {token}"
+
+        async with self.slots:
+            t0 = time.perf_counter()
+            try:
+                result = await asyncio.to_thread(self._call, method, path, body, headers)
+            except urllib.error.HTTPError as e:
+                self.stats.rest_errors[route] = self.stats.rest_errors.get(route, 0) + 1
+                raise RuntimeError(f"{method} {path} -> {e.code} {e.read()[:200]!r}") from None
+            self.stats.rest.setdefault(route, []).append(time.perf_counter() - t0)
+        return result
+
+
+async def create_user(api: Api, prefix: str, n: int) -> dict:
+    username = f"{prefix}_{n}"
+    await api.request("POST /register", "POST", "/register", json_body={"username": username, "email": f"{username}@example.com", "password": PASSWORD})
+    login = await api.request("POST /login", "POST", "/login", form={"username": username, "password": PASSWORD})
+    token = login["access_token"]
+    user_id = jwt.decode(token, options={"verify_signature": False})["user_id"]
+    return {"id": user_id, "token": token}
+
+
+async def create_group(api: Api, owner: dict, members: list[dict], name: str) -> int:
+    created = await api.request("POST /groups", "POST", "/groups", json_body={"name": name}, token=owner["token"])
+    group_id = created["group_id"]
+    await asyncio.gather(*(
+        api.request("POST /groups/{id}/members", "POST", f"/groups/{group_id}/members", json_body={"member_id": m["id"], "role": "member"}, token=owner["token"])
+        for m in members
+    ))
+    return group_id
+
+
+class Socket:
+    # one user's socket in one chat
+    def __init__(self, kind: str, room: int, user: dict, stats: Stats):
+        self.kind = kind
+        self.room = room
+        self.user = user
+        self.stats = stats
+        self.ws = None
+        self.last_id = 0
+        self.seq = 0
+
+    @property
+    def path(self) -> str:
+        return f"/ws/conversations/{self.room}" if self.kind == "conversation" else f"/ws/groups/{self.room}"
+
+    async def connect(self, ws_url: str):
+        t0 = time.perf_counter()
+        try:
+            self.ws = await websockets.connect(f"{ws_url}{self.path}?token={self.user['token']}", max_size=None)
+        except Exception:
+            self.stats.connect_errors += 1
+            raise
+        self.stats.connect.append(time.perf_counter() - t0)
+
+    async def send(self, receivers: int):
+        self.seq += 1
+        body = f"load {self.user['id']} {self.seq} {time.perf_counter()!r}"
+        if self.kind == "conversation":
+            await self.ws.send(json.dumps({"type": "message.send", "body": body}))
+        else:
+            await self.ws.send(json.dumps({"type": "group.message.sent", "body": body}))
+        self.stats.sent[self.kind] += 1
+        self.stats.expected[self.kind] += receivers
+
+    async def read(self):
+        if self.kind == "conversation":
+            if not self.last_id:
+                return
+            await self.ws.send(json.dumps({"type": "conversation.read", "last_message_id": self.last_id}))
+        else:
+            await self.ws.send(json.dumps({"type": "group.read"}))
+        self.stats.reads += 1
+
+    async def receive(self):
+        try:
+            async for frame in self.ws:
+                received = time.perf_counter()
+                event = json.loads(frame)
+                event_type = event.get("type")
+                if event_type in ("message.new", "group.message.new"):
+                    data = event["data"]
+                    self.last_id = max(self.last_id, data["id"])
+                    _, sender_id, _, sent = (data.get("body") or data.get("content")).split(" ")
+                    target = self.stats.echo if int(sender_id) == self.user["id"] else self.stats.delivery
+                    target[self.kind].append(received - float(sent))
+                elif event_type and event_type.endswith("error"):
+                    self.stats.errors[event_type] = self.stats.errors.get(event_type, 0) + 1
+        except websockets.ConnectionClosed:
+            pass
+
+
+async def every(rate: float, until: float, action):
+    # fixed-rate loop with a random phase, scheduled on absolute times so it does not drift
+    if rate <= 0:
+        return
+    interval = 1 / rate
+    next_at = time.perf_counter() + random.random() * interval
+    while next_at < until:
+        await asyncio.sleep(max(next_at - time.perf_counter(), 0))
+        await action()
+        next_at += interval
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://127.0.0.1:7722")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--group-size", type=int, default=10, help="0 disables groups")
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--send-rate", type=float, default=1, help="messages/sec per socket")
+    parser.add_argument("--read-rate", type=float, default=0.2, help="read receipts/sec per socket")
+    parser.add_argument("--drain", type=float, default=3, help="seconds to wait for in-flight messages")
+    parser.add_argument("--setup-concurrency", type=int, default=20)
+    parser.add_argument("--out", help="also write the JSON result to this file")
+    parser.add_argument("--cleanup", action="store_true", help="delete the created users (needs DB access via .env)")
+    args = parser.parse_args()
+
+    stats = Stats()
+    api = Api(args.url, stats, args.setup_concurrency)
+    ws_url = "ws" + args.url[len("http"):]
+    prefix = f"load_{uuid.uuid4().hex[:8]}"
+
+    setup_started = time.perf_counter()
+    users = await asyncio.gather(*(create_user(api, prefix, n) for n in range(args.users)))
+
+    pairs = [(users[i], users[i + 1]) for i in range(0, len(users) - 1, 2)]
+    conversations = await asyncio.gather(*(
+        api.request("POST /conversations/{friend_id}", "POST", f"/conversations/{b['id']}", token=a["token"])
+        for a, b in pairs
+    ))
+    rooms = [("conversation", c["conversation_id"], list(pair)) for c, pair in zip(conversations, pairs)]
+
+    if args.group_size > 1:
+        chunks = [users[i:i + args.group_size] for i in range(0, len(users), args.group_size)]
+        chunks = [c for c in chunks if len(c) > 1]
+        group_ids = await asyncio.gather(*(create_group(api, c[0], c[1:], f"{prefix}_{n}") for n, c in enumerate(chunks)))
+        rooms += [("group", g, c) for g, c in zip(group_ids, chunks)]
+    setup_seconds = time.perf_counter() - setup_started
+
+    sockets = [[Socket(kind, room, user, stats) for user in members] for kind, room, members in rooms]
+    flat = [s for room in sockets for s in room]
+    connect_slots = asyncio.Semaphore(args.setup_concurrency)
+
+    async def connect(s: Socket):
+        async with connect_slots:
+            await s.connect(ws_url)
+
+    await asyncio.gather(*(connect(s) for s in flat))
+    receivers = [asyncio.create_task(s.receive()) for s in flat]
+
+    load_started = time.perf_counter()
+    until = load_started + args.duration
+    drivers = []
+    for room in sockets:
+        for s in room:
+            drivers.append(every(args.send_rate, until, lambda s=s, n=len(room) - 1: s.send(n)))
+            drivers.append(every(args.read_rate, until, s.read))
+    await asyncio.gather(*drivers)
+    load_seconds = time.perf_counter() - load_started
+
+    await asyncio.sleep(args.drain)
+    await asyncio.gather(*(s.ws.close() for s in flat))
+    await asyncio.gather(*receivers)
+
+    result = {
+        "benchmark": "load_test",
+        "url": args.url,
+        "users": args.users,
+        "conversations": len(pairs),
+        "groups": len(rooms) - len(pairs),
+        "sockets": len(flat),
+        "send_rate": args.send_rate,
+        "read_rate": args.read_rate,
+        "setup_seconds": round(setup_seconds, 3),
+        "load_seconds": round(load_seconds, 3),
+        "rest": {route: summarize_ms(v) | {"errors": stats.rest_errors.get(route, 0)} for route, v in stats.rest.items()},
+        "ws_connect": summarize_ms(stats.connect) | {"errors": stats.connect_errors},
+        "reads_sent": stats.reads,
+        "errors": stats.errors,
+    }
+    for kind in ("conversation", "group"):
+        delivered = len(stats.delivery[kind])
+        result[kind] = {
+            "sent": stats.sent[kind],
+            "messages_per_sec": round(stats.sent[kind] / load_seconds, 1),
+            "deliveries": delivered,
+            "deliveries_per_sec": round(delivered / load_seconds, 1),
+            "missing": stats.expected[kind] - delivered,
+            "delivery_latency": summarize_ms(stats.delivery[kind]),
+            "echo_latency": summarize_ms(stats.echo[kind]),
+        }
+
+    emit(result)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(result, f, indent=2)
+
+    if args.cleanup:
+        from app.db.db import close_pool
+        from benchmarks.common import drop_users
+        drop_users([u["id"] for u in users])
+        close_pool()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
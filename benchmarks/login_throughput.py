@@ -0,0 +1,71 @@
+# Password checks/sec during a login burst, and what the rest of the worker feels.
+#
+#   python -m benchmarks.login_throughput --logins 200 --workers 4
+#
+# "threadpool" replays the old path: the hash check runs in Starlette's shared
+# threadpool and holds the GIL. "process_pool" is verify_and_update_password_async.
+# While the burst runs, a probe keeps making cheap threadpool calls (what any
+# other sync REST route does); its latency is the starvation other requests see.
+# No database needed.
+import argparse
+import asyncio
+import time
+
+from starlette.concurrency import run_in_threadpool
+
+from app.api import utils
+from benchmarks.report import summarize_ms, emit
+
+
+async def run(name: str, check, logins: int, hashed: str) -> dict:
+    probe_latencies: list[float] = []
+    done = asyncio.Event()
+
+    async def probe():
+        while not done.is_set():
+            t0 = time.perf_counter()
+            await run_in_threadpool(sum, range(100))
+            probe_latencies.append(time.perf_counter() - t0)
+            await asyncio.sleep(0.01)
+
+    probe_task = asyncio.create_task(probe())
+    started = time.perf_counter()
+    results = await asyncio.gather(*(check("secret", hashed) for _ in range(logins)))
+    elapsed = time.perf_counter() - started
+    done.set()
+    await probe_task
+
+    assert all(ok for ok, _ in results)
+    return {
+        "path": name,
+        "logins": logins,
+        "seconds": round(elapsed, 3),
+        "logins_per_sec": round(logins / elapsed, 1),
+        "other_request_latency": summarize_ms(probe_latencies),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=utils.PASSWORD_HASH_WORKERS)
+    args = parser.parse_args()
+
+    utils.PASSWORD_HASH_WORKERS = args.workers
+    hashed = utils.hash_password("secret")
+
+    async def threadpool_check(plain, hashed):
+        return await run_in_threadpool(utils.verify_and_update_password, plain, hashed)
+
+    try:
+        results = [
+            await run("threadpool", threadpool_check, args.logins, hashed),
+            await run("process_pool", utils.verify_and_update_password_async, args.logins, hashed),
+        ]
+        emit({"benchmark": "login_throughput", "scheme": utils.PASSWORD_SCHEME, "workers": args.workers, "results": results})
+    finally:
+        utils.close_hash_pool()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,111 @@
+# Message search latency on a synthetic corpus: the GIN/tsvector query used by
+# GET /search/messages against an ILIKE scan with the same membership filter.
+#
+#   python -m benchmarks.message_search --rows 2000000 --conversations 2000 --mine 50
+#
+# Bodies are 8 words from a skewed 2000-word vocabulary, so "w0" is very common
+# and "w1990" is rare. The searcher takes part in --mine of the conversations.
+import argparse
+import time
+
+from app.api.search import build_search_query
+from app.db.db import get_db, close_pool
+from benchmarks.common import create_users, create_conversation, drop_users
+from benchmarks.report import emit
+
+TERMS = {"common": "w0", "medium": "w40", "rare": "w1990", "two_words": "w3 w7"}
+
+
+def seed(conversation_ids: list[int], sender_id: int, rows: int):
+    with get_db() as (conn, cur):
+        cur.execute(
+            """
+            INSERT INTO messages (conversation_id, sender_id, body)
+            SELECT (%s::int[])[1 + i %% %s], %s,
+                   array_to_string(ARRAY(
+                       SELECT 'w' || floor(2000 * random() ^ 3)::int FROM generate_series(1, 8 + 0 * i)
+                   ), ' ')
+            FROM generate_series(1, %s) AS i
+            """,
+            (conversation_ids, len(conversation_ids), sender_id, rows),
+        )
+        cur.execute("ANALYZE messages")
+        cur.execute("ANALYZE conversations")
+        conn.commit()
+
+
+def timed(cur, sql: str, params, repeat: int) -> tuple[float, int]:
+    best = float("inf")
+    count = 0
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        cur.execute(sql, params)
+        count = len(cur.fetchall())
+        best = min(best, time.perf_counter() - t0)
+    return best, count
+
+
+ILIKE_ALL = """
+    SELECT m.id, m.body FROM messages m
+    JOIN conversations c ON c.id = m.conversation_id AND (c.user1_id = %s OR c.user2_id = %s)
+    WHERE m.body ILIKE %s
+    ORDER BY m.id DESC LIMIT %s
+"""
+
+ILIKE_ONE = """
+    SELECT m.id, m.body FROM messages m
+    WHERE m.conversation_id = %s AND m.body ILIKE %s
+    ORDER BY m.id DESC LIMIT %s
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    parser.add_argument("--conversations", type=int, default=2000)
+    parser.add_argument("--mine", type=int, default=50)
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    user_ids = create_users(args.conversations + 1)
+    searcher, others = user_ids[0], user_ids[1:]
+    conversation_ids = [
+        create_conversation(searcher, others[i]) if i < args.mine else create_conversation(others[i - 1], others[i])
+        for i in range(args.conversations)
+    ]
+    try:
+        seed(conversation_ids, searcher, args.rows)
+
+        results = []
+        with get_db() as (conn, cur):
+            for label, term in TERMS.items():
+                sql, params = build_search_query(searcher, term, args.limit + 1)
+                fts_all_s, fts_all_n = timed(cur, sql, params, args.repeat)
+
+                sql, params = build_search_query(searcher, term, args.limit + 1, conversation_id=conversation_ids[0])
+                fts_one_s, fts_one_n = timed(cur, sql, params, args.repeat)
+
+                pattern = "%" + term.split()[0] + " %"
+                ilike_all_s, _ = timed(cur, ILIKE_ALL, (searcher, searcher, pattern, args.limit + 1), args.repeat)
+                ilike_one_s, _ = timed(cur, ILIKE_ONE, (conversation_ids[0], pattern, args.limit + 1), args.repeat)
+
+                results.append({
+                    "term": label,
+                    "query": term,
+                    "fts_all_chats_ms": round(fts_all_s * 1000, 3),
+                    "fts_all_chats_rows": fts_all_n,
+                    "fts_one_chat_ms": round(fts_one_s * 1000, 3),
+                    "fts_one_chat_rows": fts_one_n,
+                    "ilike_all_chats_ms": round(ilike_all_s * 1000, 3),
+                    "ilike_one_chat_ms": round(ilike_one_s * 1000, 3),
+                })
+
+        emit({"benchmark": "message_search", "rows": args.rows, "conversations": args.conversations, "mine": args.mine, "results": results})
+    finally:
+        drop_users(user_ids)
+        close_pool()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,25 @@
+import json
+
+# result helpers with no app or database import, so HTTP/WS-only clients run without the server's .env
+
+
+def percentile(values: list[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[k]
+
+
+def summarize_ms(values: list[float]) -> dict:
+    return {
+        "count": len(values),
+        "p50_ms": round(percentile(values, 50) * 1000, 3),
+        "p95_ms": round(percentile(values, 95) * 1000, 3),
+        "p99_ms": round(percentile(values, 99) * 1000, 3),
+        "max_ms": round(max(values) * 1000, 3) if values else 0.0,
+    }
+
+
+def emit(result: dict):
+    print(json.dumps(result, indent=2, default=str))
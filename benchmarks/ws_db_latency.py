@@ -0,0 +1,100 @@
+# Message latency on the WS send path under concurrent senders.
+#
+#   python -m benchmarks.ws_db_latency --senders 50 --messages 40
+#
+# "sync" replays the old path (blocking psycopg2 calls made directly on the
+# event loop), "async" uses the asyncpg helpers in app/api/functions.py.
+# A ticker task reports how long the loop was stalled, which is what every
+# other socket on the worker feels.
+import argparse
+import asyncio
+import time
+
+from app.api import functions
+from app.db.async_db import close_async_pool
+from app.db.db import get_db, close_pool
+from benchmarks.common import create_users, create_conversation, drop_users
+from benchmarks.report import summarize_ms, emit
+
+
+def sync_send(conversation_id: int, sender_id: int, body: str):
+    with get_db() as (conn, cur):
+        cur.execute(
+            "INSERT INTO messages (conversation_id, sender_id, body) VALUES (%s, %s, %s) RETURNING id",
+            (conversation_id, sender_id, body),
+        )
+        message_id = cur.fetchone()["id"]
+        conn.commit()
+    with get_db() as (conn, cur):
+        cur.execute("SELECT user1_id, user2_id FROM conversations WHERE id = %s", (conversation_id,))
+        cur.fetchone()
+    with get_db() as (conn, cur):
+        cur.execute("UPDATE messages SET delivered_at = now() WHERE id = %s AND delivered_at IS NULL", (message_id,))
+        conn.commit()
+
+
+async def async_send(conversation_id: int, sender_id: int, body: str):
+    await functions.get_recipient_id(conversation_id, sender_id)
+    await functions.messages_insert_to_db(conversation_id, sender_id, body, delivered=True)
+
+
+async def run(mode: str, senders: int, messages: int, conversation_id: int, sender_id: int) -> dict:
+    latencies: list[float] = []
+    lags: list[float] = []
+    done = asyncio.Event()
+
+    async def ticker():
+        interval = 0.005
+        while not done.is_set():
+            t0 = time.perf_counter()
+            await asyncio.sleep(interval)
+            lags.append(max(0.0, time.perf_counter() - t0 - interval))
+
+    async def sender(n: int):
+        for i in range(messages):
+            t0 = time.perf_counter()
+            if mode == "sync":
+                sync_send(conversation_id, sender_id, f"bench {n}/{i}")
+            else:
+                await async_send(conversation_id, sender_id, f"bench {n}/{i}")
+            latencies.append(time.perf_counter() - t0)
+            await asyncio.sleep(0)
+
+    tick = asyncio.create_task(ticker())
+    started = time.perf_counter()
+    await asyncio.gather(*(sender(n) for n in range(senders)))
+    elapsed = time.perf_counter() - started
+    done.set()
+    await tick
+
+    return {
+        "mode": mode,
+        "senders": senders,
+        "messages_per_sender": messages,
+        "throughput_msg_s": round(senders * messages / elapsed, 1),
+        "latency": summarize_ms(latencies),
+        "loop_lag": summarize_ms(lags),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--senders", type=int, default=50)
+    parser.add_argument("--messages", type=int, default=40)
+    parser.add_argument("--mode", choices=["sync", "async", "both"], default="both")
+    args = parser.parse_args()
+
+    user_ids = create_users(2)
+    conversation_id = create_conversation(*user_ids)
+    try:
+        modes = ["sync", "async"] if args.mode == "both" else [args.mode]
+        results = [await run(m, args.senders, args.messages, conversation_id, user_ids[0]) for m in modes]
+        emit({"benchmark": "ws_db_latency", "results": results})
+    finally:
+        drop_users(user_ids)
+        await close_async_pool()
+        close_pool()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
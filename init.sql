@@ -28,7 +28,29 @@ CREATE TABLE IF NOT EXISTS tokens
 );
 
 CREATE UNIQUE INDEX IF NOT EXISTS idx_tokens_token ON tokens(token);
-CREATE INDEX IF NOT EXISTS idx_tokens_user_id ON tokens(user_id);
+-- newest live token per user on login; also serves revoke-all by user_id
+CREATE INDEX IF NOT EXISTS idx_tokens_user_expire_at ON tokens(user_id, expire_at DESC);
+-- expired-token sweeper
+CREATE INDEX IF NOT EXISTS idx_tokens_expire_at ON tokens(expire_at);
+
+-- TOKEN REVOCATIONS (TOKEN_VALIDATION=stateless): one token by jti, or with jti NULL every
+-- token of user_id issued before issued_before. issued_before is taken from the app clock, like
+-- the tokens' iat; created_at (DB clock) only drives the workers' incremental sync
+CREATE TABLE IF NOT EXISTS token_revocations
+(
+    id            BIGSERIAL PRIMARY KEY,
+    jti           TEXT,
+    user_id       INTEGER     NOT NULL,
+    expire_at     TIMESTAMPTZ NOT NULL,
+    issued_before TIMESTAMPTZ NULL,
+    created_at    TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+ALTER TABLE token_revocations
+    ADD COLUMN IF NOT EXISTS issued_before TIMESTAMPTZ NULL;
+
+CREATE INDEX IF NOT EXISTS idx_token_revocations_created_at ON token_revocations(created_at);
+CREATE INDEX IF NOT EXISTS idx_token_revocations_expire_at ON token_revocations(expire_at);
 
 -- CONVERSATIONS (DM)
 CREATE TABLE IF NOT EXISTS conversations
@@ -37,11 +59,21 @@ CREATE TABLE IF NOT EXISTS conversations
     user1_id   INTEGER NOT NULL,
     user2_id   INTEGER NOT NULL,
     created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    -- kept current by every message insert; feeds the inbox
+    last_message_id INTEGER NULL,
+    last_message_at TIMESTAMPTZ NULL,
     CONSTRAINT conversations_unique_pair UNIQUE (user1_id, user2_id)
 );
 
-CREATE INDEX IF NOT EXISTS idx_conversations_user1 ON conversations(user1_id);
-CREATE INDEX IF NOT EXISTS idx_conversations_user2 ON conversations(user2_id);
+-- existing databases: CREATE TABLE IF NOT EXISTS leaves them as they were, so every column added
+-- after the first release is also added here (init.sql is safe to re-run with psql -f)
+ALTER TABLE conversations
+    ADD COLUMN IF NOT EXISTS last_message_id INTEGER NULL,
+    ADD COLUMN IF NOT EXISTS last_message_at TIMESTAMPTZ NULL;
+
+-- per side, in inbox order (last activity first); also serve plain user lookups
+CREATE INDEX IF NOT EXISTS idx_conversations_user1_activity ON conversations(user1_id, (COALESCE(last_message_at, created_at)) DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_conversations_user2_activity ON conversations(user2_id, (COALESCE(last_message_at, created_at)) DESC, id DESC);
 
 -- MESSAGES
 CREATE TABLE IF NOT EXISTS messages
@@ -52,13 +84,58 @@ CREATE TABLE IF NOT EXISTS messages
     body            TEXT NOT NULL,
     created_at      TIMESTAMPTZ NOT NULL DEFAULT now(),
     delivered_at    TIMESTAMPTZ NULL,
-    read_at         TIMESTAMPTZ NULL
+    read_at         TIMESTAMPTZ NULL,
+    search_vector   TSVECTOR GENERATED ALWAYS AS (to_tsvector('simple', body)) STORED
 );
 
-CREATE INDEX IF NOT EXISTS idx_messages_conversation_id ON messages(conversation_id);
+ALTER TABLE messages
+    ADD COLUMN IF NOT EXISTS search_vector TSVECTOR GENERATED ALWAYS AS (to_tsvector('simple', body)) STORED;
+
+-- conversations from before last_message_id: point them at their newest message
+UPDATE conversations c
+SET last_message_id = m.id, last_message_at = m.created_at
+FROM (
+    SELECT DISTINCT ON (conversation_id) conversation_id, id, created_at
+    FROM messages
+    ORDER BY conversation_id, id DESC
+) m
+WHERE c.id = m.conversation_id AND c.last_message_id IS NULL;
+
+-- (conversation_id, id) serves both the plain filter and keyset pagination
+CREATE INDEX IF NOT EXISTS idx_messages_conversation_id_id ON messages(conversation_id, id);
 CREATE INDEX IF NOT EXISTS idx_messages_sender_id ON messages(sender_id);
 CREATE INDEX IF NOT EXISTS idx_messages_created_at ON messages(created_at);
 
+-- full-text search; the leading conversation_id (btree_gin) serves both per-chat and all-chats search
+CREATE EXTENSION IF NOT EXISTS btree_gin;
+CREATE INDEX IF NOT EXISTS idx_messages_search ON messages USING GIN (conversation_id, search_vector);
+
+-- READ WATERMARKS (DM read receipts: everything up to last_read_message_id is read)
+CREATE TABLE IF NOT EXISTS conversation_reads
+(
+    conversation_id      INTEGER NOT NULL,
+    user_id              INTEGER NOT NULL,
+    last_read_message_id INTEGER NOT NULL DEFAULT 0,
+    read_at              TIMESTAMPTZ NULL,
+    -- peer messages above the watermark; +1 on insert, recounted when the watermark advances
+    unread_count         INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (conversation_id, user_id)
+);
+
+ALTER TABLE conversation_reads
+    ADD COLUMN IF NOT EXISTS unread_count INTEGER NOT NULL DEFAULT 0;
+
+-- chats nobody has read or written to since the counters came in: count per-message read_at
+INSERT INTO conversation_reads (conversation_id, user_id, unread_count)
+SELECT m.conversation_id, CASE WHEN c.user1_id = m.sender_id THEN c.user2_id ELSE c.user1_id END, count(*)
+FROM messages m
+JOIN conversations c ON c.id = m.conversation_id
+WHERE m.read_at IS NULL
+GROUP BY 1, 2
+ON CONFLICT (conversation_id, user_id) DO NOTHING;
+
+CREATE INDEX IF NOT EXISTS idx_conversation_reads_user_id ON conversation_reads(user_id);
+
 -- FRIEND REQUESTS
 CREATE TABLE IF NOT EXISTS friend_requests
 (
@@ -156,6 +233,8 @@ CREATE TABLE IF NOT EXISTS group_members (
   joined_at  TIMESTAMPTZ NOT NULL DEFAULT now(),
 
   last_read_at TIMESTAMPTZ,
+  -- other members' messages since last_read_at; +1 on insert, reset to 0 on read
+  unread_count INTEGER NOT NULL DEFAULT 0,
   muted_until  TIMESTAMPTZ,
 
   PRIMARY KEY (group_id, user_id)
@@ -181,13 +260,71 @@ CREATE TABLE IF NOT EXISTS group_messages (
   created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
   updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
 
+  search_vector TSVECTOR GENERATED ALWAYS AS (to_tsvector('simple', content)) STORED,
+
   CONSTRAINT group_messages_content_not_blank
     CHECK (length(trim(content)) > 0)
 );
 
+ALTER TABLE group_messages
+  ADD COLUMN IF NOT EXISTS search_vector TSVECTOR GENERATED ALWAYS AS (to_tsvector('simple', content)) STORED;
+
+-- group_members.unread_count: added and backfilled once (later runs must not reset live counters)
+DO $$ BEGIN
+  IF NOT EXISTS (
+    SELECT 1 FROM information_schema.columns
+    WHERE table_schema = current_schema() AND table_name = 'group_members' AND column_name = 'unread_count'
+  ) THEN
+    ALTER TABLE group_members ADD COLUMN unread_count INTEGER NOT NULL DEFAULT 0;
+
+    UPDATE group_members gm
+    SET unread_count = (
+      SELECT count(*) FROM group_messages m
+      WHERE m.group_id = gm.group_id AND m.sender_id <> gm.user_id
+        AND m.created_at > COALESCE(gm.last_read_at, gm.joined_at)
+    );
+  END IF;
+END $$;
+
 CREATE INDEX IF NOT EXISTS idx_group_messages_group_id_created_at
   ON group_messages (group_id, created_at DESC);
 
 
+CREATE INDEX IF NOT EXISTS idx_group_messages_group_id_id
+  ON group_messages (group_id, id);
+
+
 CREATE INDEX IF NOT EXISTS idx_group_messages_sender_id_created_at
   ON group_messages (sender_id, created_at DESC);
+
+
+CREATE INDEX IF NOT EXISTS idx_group_messages_search
+  ON group_messages USING GIN (group_id, search_vector);
+
+
+-- PUBSUB SPILL (WebSocket events too large for a NOTIFY payload, kept ~1 minute)
+CREATE UNLOGGED TABLE IF NOT EXISTS pubsub_spill (
+  id         BIGSERIAL PRIMARY KEY,
+  payload    TEXT NOT NULL,
+  created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+CREATE INDEX IF NOT EXISTS idx_pubsub_spill_created_at
+  ON pubsub_spill (created_at);
+
+
+-- PRESENCE: which worker holds sockets of which user; a user is online while any worker with a
+-- fresh heartbeat has a row for them
+CREATE UNLOGGED TABLE IF NOT EXISTS presence_workers (
+  worker       TEXT PRIMARY KEY,
+  heartbeat_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+CREATE UNLOGGED TABLE IF NOT EXISTS presence_sockets (
+  user_id INTEGER NOT NULL,
+  worker  TEXT    NOT NULL,
+  PRIMARY KEY (user_id, worker)
+);
+
+CREATE INDEX IF NOT EXISTS idx_presence_sockets_worker
+  ON presence_sockets (worker);